@@ -1,13 +1,67 @@
 import axios from "axios"
 
+// time (in milliseconds) to wait before reopening the event stream
+const RECONNECT_DELAY = 3000
+
 export default {
-  getAll(cb, errCb) {
+  getAll(cb, errCb, before) {
+    // newest first, a page at a time. `before` is the id of the last
+    // notification of the previous page
+    let params = before ? { before } : {}
     axios
-      .get("/api/notifications/")
+      .get("/api/notifications/", { params })
       .then(response => cb(response.data))
       .catch(error => errCb(error))
   },
 
+  getUnreadCount(cb, errCb) {
+    axios
+      .get("/api/notifications/unread_count/")
+      .then(response => cb(response.data.unread))
+      .catch(error => errCb(error))
+  },
+
+  subscribe(handlers) {
+    // server-sent events of the user. EventSource can't send the auth header,
+    // so every connection uses a single use token and is reopened with a new
+    // token when the stream ends, instead of the browser reconnecting with the
+    // used one.
+    let subscription = {
+      source: null,
+      closed: false,
+      close() {
+        this.closed = true
+        if (this.source) this.source.close()
+      }
+    }
+    let reconnect = () => {
+      if (!subscription.closed) setTimeout(connect, RECONNECT_DELAY)
+    }
+    let connect = () => {
+      axios
+        .post("/api/events/token/")
+        .then(response => {
+          if (subscription.closed) return
+          let source = new EventSource(
+            `/api/events/?token=${encodeURIComponent(response.data.token)}`
+          )
+          Object.keys(handlers).forEach(event => {
+            source.addEventListener(event, e =>
+              handlers[event](JSON.parse(e.data))
+            )
+          })
+          source.onerror = () => {
+            source.close()
+            reconnect()
+          }
+          subscription.source = source
+        })
+        .catch(reconnect)
+    }
+    connect()
+    return subscription
+  },
+
   markAsRead(notification, cb, errCb) {
     axios
       .put(`/api/notification/${notification.id}/`, { read: true })
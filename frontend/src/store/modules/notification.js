@@ -1,7 +1,17 @@
 import notificationAPI from "../../api/notification"
 
+// no.of notifications returned by the API per page
+export const PAGE_SIZE = 50
+
+// the event stream of the user, shared by all the components
+let subscription = null
+
 export const state = {
-  notifications: []
+  notifications: [],
+  hasMore: false,
+  unreadCount: 0,
+  // latest progress event of the background jobs, by job id
+  jobProgress: {}
 }
 
 function groupNotifications(notes) {
@@ -66,6 +76,13 @@ export const mutations = {
   setAll: function(state, payload) {
     if (Array.isArray(payload)) {
       state.notifications = payload
+      state.hasMore = payload.length >= PAGE_SIZE
+    }
+  },
+  appendNotifications: function(state, payload) {
+    if (Array.isArray(payload)) {
+      state.notifications = [...state.notifications, ...payload]
+      state.hasMore = payload.length >= PAGE_SIZE
     }
   },
   updateNotification: function(state, notification) {
@@ -76,6 +93,13 @@ export const mutations = {
   },
   markAllRead: function(state) {
     state.notifications.forEach(n => (n.read = true))
+    state.unreadCount = 0
+  },
+  setUnreadCount: function(state, count) {
+    state.unreadCount = count
+  },
+  setJobProgress: function(state, event) {
+    state.jobProgress = { ...state.jobProgress, [event.job_id]: event }
   }
 }
 
@@ -88,6 +112,36 @@ export const actions = {
       }
     )
   },
+  getUnreadCount: function({ commit }) {
+    notificationAPI.getUnreadCount(
+      count => commit("setUnreadCount", count),
+      err => console.log(err)
+    )
+  },
+  subscribeToEvents: function({ commit, dispatch }) {
+    if (subscription) return
+    subscription = notificationAPI.subscribe({
+      notification: () => {
+        dispatch("getNotifications")
+        dispatch("getUnreadCount")
+      },
+      job_progress: event => commit("setJobProgress", event)
+    })
+  },
+  unsubscribeFromEvents: function() {
+    if (!subscription) return
+    subscription.close()
+    subscription = null
+  },
+  loadMoreNotifications: function({ commit, state }) {
+    let last = state.notifications[state.notifications.length - 1]
+    if (!state.hasMore || typeof last === "undefined") return
+    notificationAPI.getAll(
+      notes => commit("appendNotifications", notes),
+      err => console.log(err),
+      last.id
+    )
+  },
   markNotificationRead: function({ commit, state }, id) {
     let notification = state.notifications.find(note => note.id === id)
     if (typeof notification === "undefined") return
@@ -1,8 +1,14 @@
 import { expect } from "chai"
-import { getters, mutations, actions } from "@/store/modules/notification"
+import {
+  getters,
+  mutations,
+  actions,
+  PAGE_SIZE
+} from "@/store/modules/notification"
 import { testAction } from "../utils"
 import axios from "axios"
 import sinon from "sinon"
+import notificationAPI from "@/api/notification"
 
 describe("🗄  Store: notifications", function() {
   describe("💉  mutations", function() {
@@ -18,6 +24,28 @@ describe("🗄  Store: notifications", function() {
         expect(state.notifications).to.deep.equal([1, 2, 3])
       })
     })
+    describe("↳ setJobProgress()", function() {
+      it("saves the latest event of each job", function() {
+        const state = { jobProgress: { a: { job_id: "a", progress: 10 } } }
+        mutations.setJobProgress(state, { job_id: "a", progress: 50 })
+        mutations.setJobProgress(state, { job_id: "b", progress: 5 })
+        expect(state.jobProgress.a.progress).to.equal(50)
+        expect(state.jobProgress.b.progress).to.equal(5)
+      })
+    })
+    describe("↳ appendNotifications()", function() {
+      it("adds the page after the loaded notifications", function() {
+        const state = { notifications: [3, 2], hasMore: true }
+        mutations.appendNotifications(state, [1])
+        expect(state.notifications).to.deep.equal([3, 2, 1])
+        expect(state.hasMore).to.equal(false)
+      })
+      it("expects more pages after a full page", function() {
+        const state = { notifications: [], hasMore: false }
+        mutations.appendNotifications(state, new Array(PAGE_SIZE).fill(1))
+        expect(state.hasMore).to.equal(true)
+      })
+    })
   })
 
   describe("⛷  actions", function() {
@@ -40,6 +68,44 @@ describe("🗄  Store: notifications", function() {
       })
     })
 
+    describe("↳ subscribeToEvents()", function() {
+      afterEach(() => actions.unsubscribeFromEvents())
+      it("opens the event stream only once", function() {
+        const subscribe = sandbox
+          .stub(notificationAPI, "subscribe")
+          .returns({ close: sinon.spy() })
+        actions.subscribeToEvents({ commit: () => {}, dispatch: () => {} })
+        actions.subscribeToEvents({ commit: () => {}, dispatch: () => {} })
+        sinon.assert.calledOnce(subscribe)
+      })
+      it("refreshes the notifications on a notification event", function() {
+        const dispatch = sinon.spy()
+        sandbox.stub(notificationAPI, "subscribe").returns({ close() {} })
+        actions.subscribeToEvents({ commit: () => {}, dispatch })
+        notificationAPI.subscribe.firstCall.args[0].notification({})
+        sinon.assert.calledWith(dispatch, "getNotifications")
+        sinon.assert.calledWith(dispatch, "getUnreadCount")
+      })
+    })
+
+    describe("↳ loadMoreNotifications()", function() {
+      it("should fetch the notifications before the last one", function(done) {
+        const response = { data: [{ id: 1, read: false }] }
+        const state = { notifications: [{ id: 7, read: false }], hasMore: true }
+        sandbox.stub(axios, "get").resolves(response)
+        testAction(
+          actions.loadMoreNotifications,
+          null,
+          state,
+          [{ type: "appendNotifications", payload: response.data }],
+          done
+        )
+        sinon.assert.calledWith(axios.get, "/api/notifications/", {
+          params: { before: 7 }
+        })
+      })
+    })
+
     describe("↳ markNotificationRead()", function() {
       it("should call the api and update the store on success", function(done) {
         const response = { data: { id: 2, read: true } }
@@ -1,5 +1,16 @@
 import os
 
+# Threaded workers, so that the long lived event streams (/api/events/) don't
+# hold up a whole worker process each.
+#
+# Every open event stream still takes up a thread for up to
+# EVENT_STREAM_DURATION (5 minutes) before the browser reconnects, so a server
+# can serve about WEB_CONCURRENCY x GUNICORN_THREADS users with an open page,
+# minus the threads needed for the other requests. The threads mostly wait on
+# Redis, so raise GUNICORN_THREADS rather than the workers for more users.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+
 if os.environ.get("ENV") == "dev":
     reload = True
     timeout = 100000
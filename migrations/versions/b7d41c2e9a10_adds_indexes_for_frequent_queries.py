@@ -0,0 +1,42 @@
+"""adds indexes for frequent queries
+
+Revision ID: b7d41c2e9a10
+Revises: 3a879fcb21e3
+Create Date: 2022-05-10 11:20:31.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41c2e9a10'
+down_revision = '3a879fcb21e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_pairing_grader', 'pairing', ['course_id', 'assignment_id', 'grader_id', 'archived'], unique=False)
+    op.create_index('ix_pairing_recipient', 'pairing', ['course_id', 'assignment_id', 'recipient_id', 'archived'], unique=False)
+    op.create_index('ix_feedback_receiver', 'feedback', ['assignment_id', 'receiver_id', 'draft'], unique=False)
+    op.create_index('ix_feedback_reviewer', 'feedback', ['assignment_id', 'reviewer_id', 'draft'], unique=False)
+    op.create_index('ix_feedback_submitted', 'feedback', ['assignment_id'], unique=False, postgresql_where=sa.text('draft IS false'))
+    op.create_index('ix_feedback_pairing_id', 'feedback', ['pairing_id'], unique=False)
+    op.create_index('ix_task_user_status', 'task', ['user_id', 'status'], unique=False)
+    op.create_index('ix_task_pairing_id', 'task', ['pairing_id'], unique=False)
+    op.create_index('ix_notification_recipient_read', 'notification', ['recipient_id', 'read'], unique=False)
+    op.create_index('ix_course_usermap_course_user', 'course_usermap', ['course_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_course_usermap_course_user', table_name='course_usermap')
+    op.drop_index('ix_notification_recipient_read', table_name='notification')
+    op.drop_index('ix_task_pairing_id', table_name='task')
+    op.drop_index('ix_task_user_status', table_name='task')
+    op.drop_index('ix_feedback_pairing_id', table_name='feedback')
+    op.drop_index('ix_feedback_submitted', table_name='feedback')
+    op.drop_index('ix_feedback_reviewer', table_name='feedback')
+    op.drop_index('ix_feedback_receiver', table_name='feedback')
+    op.drop_index('ix_pairing_recipient', table_name='pairing')
+    op.drop_index('ix_pairing_grader', table_name='pairing')
@@ -0,0 +1,299 @@
+"""A cache for the objects fetched from the Canvas API.
+
+The course, assignment, user, group and submission objects are stored in the
+application `cache` (Redis) so that the views and the jobs don't make the same
+HTTP calls to Canvas repeatedly. Only the attributes of the canvasapi objects
+are cached, the objects are rebuilt with the requester of the Canvas client
+that asks for them.
+
+Every key contains a per-course version. `invalidate_course` changes the version
+so all the cached entries of the course are dropped at once, without having to
+find and delete the individual keys.
+"""
+import logging
+from uuid import uuid4
+
+from canvasapi.assignment import Assignment
+from canvasapi.course import Course
+from canvasapi.group import Group
+from canvasapi.paginated_list import PaginatedList
+from canvasapi.submission import Submission
+from canvasapi.user import User as CanvasUser
+
+from peerfeedback.api.canvas_fetch import fetch_all, fetch_group_members
+from peerfeedback.extensions import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "canvas"
+
+# Time (in seconds) for which each type of resource is cached
+TIMEOUTS = {
+    "course": 60 * 60 * 12,
+    "assignment": 60 * 60,
+    "assignments": 60 * 60,
+    "users": 60 * 30,
+    "groups": 60 * 30,
+    "group_users": 60 * 30,
+    "submissions": 60 * 5,
+}
+
+
+def get_requester(canvas):
+    """Return the requester of a Canvas client. The requester is needed to
+    rebuild the cached objects so that they can make further API calls.
+
+    :param canvas: canvasapi.Canvas client
+    """
+    return canvas._Canvas__requester
+
+
+def dump_object(obj):
+    """Return the attributes of a canvasapi object which can be pickled.
+
+    :param obj: a canvasapi.canvas_object.CanvasObject
+    :return: dict of the object attributes without the requester
+    """
+    return {k: v for k, v in obj.__dict__.items() if k != "_requester"}
+
+
+def load_object(cls, requester, attributes):
+    """Rebuild a canvasapi object from the cached attributes.
+
+    :param cls: the canvasapi class of the object
+    :param requester: the requester of the Canvas client
+    :param attributes: dict of attributes returned by `dump_object`
+    """
+    return cls(requester, attributes)
+
+
+def get_course_version(course_id):
+    """Return the current cache version of the course.
+
+    :param course_id: canvas id of the course
+    """
+    return cache.get(f"{KEY_PREFIX}:version:{course_id}") or 0
+
+
+def invalidate_course(course_id):
+    """Drop all the cached Canvas data of a course. Called when the course or
+    its assignments are changed in the app.
+
+    :param course_id: canvas id of the course
+    """
+    cache.set(f"{KEY_PREFIX}:version:{course_id}", uuid4().hex, timeout=0)
+    logger.info("Invalidated the cached Canvas data of course %s", course_id)
+
+
+def make_key(resource, course_id, *parts, scope=None):
+    """Build the cache key of a resource of the course.
+
+    :param resource: the type of resource, one of the keys of `TIMEOUTS`
+    :param course_id: canvas id of the course the resource belongs to
+    :param parts: other values identifying the resource
+    :param scope: id of the user when the data is fetched using the user's own
+        token, as the user might only be able to see a part of it
+    """
+    version = get_course_version(course_id)
+    key = ":".join(str(p) for p in (KEY_PREFIX, version, resource, course_id) + parts)
+    if scope is not None:
+        key += f":u{scope}"
+    return key
+
+
+def params_key(params):
+    """Convert the request params into a stable string for the cache key."""
+    return ",".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+def record(resource, hit):
+    """Increment the hit/miss counter of the resource type.
+
+    :param resource: the type of resource
+    :param hit: boolean - True for a cache hit, False for a miss
+    """
+    cache.inc(f"{KEY_PREFIX}:stats:{resource}:{'hits' if hit else 'misses'}")
+
+
+def get_stats():
+    """Return the hit/miss counters of all the resource types.
+
+    :return: dict of resource -> {"hits": <int>, "misses": <int>}
+    """
+    return {
+        resource: {
+            "hits": int(cache.get(f"{KEY_PREFIX}:stats:{resource}:hits") or 0),
+            "misses": int(cache.get(f"{KEY_PREFIX}:stats:{resource}:misses") or 0),
+        }
+        for resource in TIMEOUTS
+    }
+
+
+def _cached(resource, key, cls, requester, fetch, many=False):
+    data = cache.get(key)
+    if data is not None:
+        record(resource, True)
+        if many:
+            return [load_object(cls, requester, attrs) for attrs in data]
+        return load_object(cls, requester, data)
+
+    record(resource, False)
+    result = fetch()
+    if many:
+        if isinstance(result, PaginatedList):
+            result = fetch_all(result)
+        result = list(result)
+        data = [dump_object(obj) for obj in result]
+    else:
+        data = dump_object(result)
+    cache.set(key, data, timeout=TIMEOUTS[resource])
+    return result
+
+
+def get_course(canvas, course_id, scope=None, **kwargs):
+    """Cached version of `canvas.get_course`
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course
+    :param scope: id of the user if the client uses the user's own token
+    :param kwargs: params passed on to the Canvas API
+    :return: canvasapi.course.Course
+    """
+    key = make_key("course", course_id, params_key(kwargs), scope=scope)
+    return _cached(
+        "course",
+        key,
+        Course,
+        get_requester(canvas),
+        lambda: canvas.get_course(course_id, **kwargs),
+    )
+
+
+def get_assignment(canvas, course_id, assignment_id, scope=None):
+    """Cached version of `course.get_assignment`
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course
+    :param assignment_id: canvas id of the assignment
+    :param scope: id of the user if the client uses the user's own token
+    :return: canvasapi.assignment.Assignment
+    """
+    key = make_key("assignment", course_id, assignment_id, scope=scope)
+    return _cached(
+        "assignment",
+        key,
+        Assignment,
+        get_requester(canvas),
+        lambda: get_course(canvas, course_id, scope).get_assignment(assignment_id),
+    )
+
+
+def get_assignments(canvas, course_id, scope=None):
+    """Cached version of `course.get_assignments`
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course
+    :param scope: id of the user if the client uses the user's own token
+    :return: list of canvasapi.assignment.Assignment
+    """
+    key = make_key("assignments", course_id, scope=scope)
+    return _cached(
+        "assignments",
+        key,
+        Assignment,
+        get_requester(canvas),
+        lambda: get_course(canvas, course_id, scope).get_assignments(),
+        many=True,
+    )
+
+
+def get_users(canvas, course_id, scope=None, **kwargs):
+    """Cached version of `course.get_users`
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course
+    :param scope: id of the user if the client uses the user's own token
+    :param kwargs: params passed on to the Canvas API like `enrollment_type`
+    :return: list of canvasapi.user.User
+    """
+    key = make_key("users", course_id, params_key(kwargs), scope=scope)
+    return _cached(
+        "users",
+        key,
+        CanvasUser,
+        get_requester(canvas),
+        lambda: get_course(canvas, course_id, scope).get_users(**kwargs),
+        many=True,
+    )
+
+
+def get_groups(canvas, course_id, group_category_id, scope=None):
+    """Cached list of groups of a group category.
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course the group category belongs to
+    :param group_category_id: canvas id of the group category
+    :param scope: id of the user if the client uses the user's own token
+    :return: list of canvasapi.group.Group
+    """
+    key = make_key("groups", course_id, group_category_id, scope=scope)
+    return _cached(
+        "groups",
+        key,
+        Group,
+        get_requester(canvas),
+        lambda: canvas.get_group_category(group_category_id).get_groups(),
+        many=True,
+    )
+
+
+def get_groups_users(canvas, course_id, groups, scope=None):
+    """Cached members of multiple groups. The members of the groups which are
+    not in the cache are fetched from Canvas in parallel.
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course the groups belong to
+    :param groups: list of canvasapi.group.Group objects
+    :param scope: id of the user if the client uses the user's own token
+    :return: dict of group id -> list of canvasapi.user.User
+    """
+    requester = get_requester(canvas)
+    members = {}
+    missing = []
+    for group in groups:
+        key = make_key("group_users", course_id, group.id, scope=scope)
+        data = cache.get(key)
+        record("group_users", data is not None)
+        if data is None:
+            missing.append((group, key))
+            continue
+        members[group.id] = [load_object(CanvasUser, requester, a) for a in data]
+
+    fetched = fetch_group_members([group for group, _ in missing])
+    for group, key in missing:
+        users = fetched[group.id]
+        cache.set(key, [dump_object(u) for u in users], timeout=TIMEOUTS["group_users"])
+        members[group.id] = users
+    return members
+
+
+def get_submissions(canvas, course_id, assignment_id, scope=None):
+    """Cached version of `assignment.get_submissions`
+
+    :param canvas: canvasapi.Canvas client
+    :param course_id: canvas id of the course
+    :param assignment_id: canvas id of the assignment
+    :param scope: id of the user if the client uses the user's own token
+    :return: list of canvasapi.submission.Submission
+    """
+    key = make_key("submissions", course_id, assignment_id, scope=scope)
+    return _cached(
+        "submissions",
+        key,
+        Submission,
+        get_requester(canvas),
+        lambda: get_assignment(
+            canvas, course_id, assignment_id, scope
+        ).get_submissions(),
+        many=True,
+    )
@@ -0,0 +1,248 @@
+"""Concurrent fetching of paginated collections from the Canvas API.
+
+canvasapi's `PaginatedList` walks through the pages one request at a time,
+following the `next` link of every response. For large courses that is a long
+chain of sequential HTTP calls. The functions here fetch the first page, read
+the total no.of pages from the `last` link and then fetch the rest of the pages
+in parallel using a thread pool. When Canvas doesn't provide a numbered `last`
+link (bookmark based pagination), the pages are fetched sequentially as usual.
+
+Canvas applies a cost based rate limit on every token. The remaining quota is
+read from the `X-Rate-Limit-Remaining` header of each response and the workers
+back off when the quota runs low or when Canvas rejects a request as throttled.
+
+The workers run in the app context of the calling thread, so that the hooks of
+the Canvas client (like the quota tracking) can use the app extensions.
+"""
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlparse
+
+from canvasapi.exceptions import Forbidden
+from canvasapi.paginated_list import PaginatedList
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# No.of concurrent requests made to Canvas
+MAX_WORKERS = 8
+# Start slowing down the requests when the remaining quota is below this
+RATE_LIMIT_THRESHOLD = 200.0
+# Seconds to wait when the quota is low or a request has been throttled
+RATE_LIMIT_BACKOFF = 1.0
+# No.of times a throttled request is retried
+MAX_RETRIES = 5
+
+
+class RateLimiter(object):
+    """Keeps track of the rate limit quota reported by Canvas and makes the
+    workers wait when it is running out.
+    """
+
+    def __init__(self, threshold=RATE_LIMIT_THRESHOLD, backoff=RATE_LIMIT_BACKOFF):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.remaining = None
+        self.lock = threading.Lock()
+
+    def record(self, response):
+        """Save the remaining quota from the response headers.
+
+        :param response: requests.Response returned by Canvas
+        """
+        remaining = response.headers.get("X-Rate-Limit-Remaining")
+        if remaining is None:
+            return
+        with self.lock:
+            self.remaining = float(remaining)
+
+    def wait(self):
+        """Sleep for a while if the remaining quota is below the threshold."""
+        with self.lock:
+            remaining = self.remaining
+        if remaining is not None and remaining < self.threshold:
+            logger.debug("Canvas rate limit quota low (%s), backing off", remaining)
+            time.sleep(self.backoff)
+
+
+def is_rate_limited(error):
+    """Check if the Canvas error is due to the request being throttled."""
+    return isinstance(error, Forbidden) and "Rate Limit Exceeded" in str(error)
+
+
+def with_app_context(func):
+    """Wrap the function so that it runs in the app context of the calling
+    thread. The worker threads of the pool don't have an app context of their
+    own.
+
+    :param func: the function to run in the worker threads
+    :return: the wrapped function, or `func` itself outside an app context
+    """
+    if not has_app_context():
+        return func
+    app = current_app._get_current_object()
+
+    def run(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return run
+
+
+def request(requester, method, endpoint, limiter, **kwargs):
+    """Make a request using the canvasapi requester, retrying when the request
+    is throttled by Canvas.
+
+    :param requester: canvasapi.requester.Requester
+    :param method: HTTP method
+    :param endpoint: API endpoint relative to the base url
+    :param limiter: RateLimiter shared by the concurrent requests
+    :param kwargs: params of the request
+    :return: requests.Response
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.wait()
+        params = dict(kwargs)
+        # the requester extends the `_kwargs` list in place, so pass a copy
+        if "_kwargs" in params:
+            params["_kwargs"] = list(params["_kwargs"])
+        try:
+            response = requester.request(method, endpoint, **params)
+        except Forbidden as e:
+            if not is_rate_limited(e) or attempt == MAX_RETRIES:
+                raise
+            logger.warning("Canvas request throttled, retrying: %s", endpoint)
+            time.sleep(limiter.backoff * 2 ** attempt)
+            continue
+        limiter.record(response)
+        return response
+
+
+def parse_elements(paginated, response):
+    """Build the canvasapi objects from the response of a page in the same way
+    as `PaginatedList` does.
+
+    :param paginated: canvasapi.paginated_list.PaginatedList
+    :param response: requests.Response of the page
+    :return: list of objects of the paginated list's content class
+    """
+    data = response.json()
+    if paginated._root:
+        data = data[paginated._root]
+
+    elements = []
+    for element in data:
+        if element is not None:
+            element.update(paginated._extra_attribs)
+            elements.append(paginated._content_class(paginated._requester, element))
+    return elements
+
+
+def get_endpoint(requester, url):
+    """Strip the base url from a pagination link to get the API endpoint."""
+    match = re.search(r"{}(.*)".format(re.escape(requester.base_url)), url)
+    return match.group(1) if match else url
+
+
+def page_number(url):
+    """Return the `page` param of a pagination link if it is a number."""
+    params = dict(parse_qsl(urlparse(url).query))
+    page = params.get("page", "")
+    return int(page) if page.isdigit() else None
+
+
+def page_request(requester, url, page):
+    """Return the endpoint and params for fetching a particular page, built from
+    a numbered pagination link.
+    """
+    parsed = urlparse(url)
+    params = [(k, v) for k, v in parse_qsl(parsed.query) if k != "page"]
+    params.append(("page", str(page)))
+    endpoint = get_endpoint(requester, parsed._replace(query="").geturl())
+    return endpoint, params
+
+
+def fetch_all(paginated, max_workers=MAX_WORKERS, limiter=None):
+    """Fetch all the items of a canvasapi PaginatedList, requesting the pages
+    concurrently whenever possible.
+
+    :param paginated: canvasapi.paginated_list.PaginatedList, any other
+        iterable is read as it is
+    :param max_workers: the maximum no.of concurrent requests
+    :param limiter: RateLimiter to share the quota information between calls
+    :return: list of all the items, in the same order as the paginated list
+    """
+    if not isinstance(paginated, PaginatedList):
+        return list(paginated)
+
+    requester = paginated._requester
+    method = paginated._request_method
+    limiter = limiter or RateLimiter()
+
+    response = request(
+        requester, method, paginated._first_url, limiter, **paginated._first_params
+    )
+    items = parse_elements(paginated, response)
+
+    last = response.links.get("last")
+    last_page = page_number(last["url"]) if last else None
+    if last_page and last_page > 1:
+        pages = [
+            page_request(requester, last["url"], n) for n in range(2, last_page + 1)
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = executor.map(
+                with_app_context(
+                    lambda page: request(
+                        requester, method, page[0], limiter, _kwargs=page[1]
+                    )
+                ),
+                pages,
+            )
+            for page_response in responses:
+                items.extend(parse_elements(paginated, page_response))
+        return items
+
+    # no numbered pages, follow the `next` links one after the other
+    next_link = response.links.get("next")
+    while next_link:
+        response = request(
+            requester, method, get_endpoint(requester, next_link["url"]), limiter
+        )
+        items.extend(parse_elements(paginated, response))
+        next_link = response.links.get("next")
+    return items
+
+
+def fetch_many(paginated_lists, max_workers=MAX_WORKERS):
+    """Fetch several paginated lists in parallel.
+
+    :param paginated_lists: list of canvasapi PaginatedLists
+    :param max_workers: the maximum no.of concurrent requests
+    :return: list of lists of items in the same order as the input
+    """
+    limiter = RateLimiter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                with_app_context(
+                    lambda p: fetch_all(p, max_workers=1, limiter=limiter)
+                ),
+                paginated_lists,
+            )
+        )
+
+
+def fetch_group_members(groups, max_workers=MAX_WORKERS):
+    """Fetch the members of all the groups in parallel.
+
+    :param groups: list of canvasapi Group objects
+    :param max_workers: the maximum no.of concurrent requests
+    :return: dict of group id -> list of canvasapi User objects
+    """
+    groups = list(groups)
+    members = fetch_many([group.get_users() for group in groups], max_workers)
+    return {group.id: users for group, users in zip(groups, members)}
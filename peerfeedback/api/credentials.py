@@ -0,0 +1,152 @@
+"""Pool of the Canvas credentials of the course staff.
+
+The Canvas calls made on behalf of the students use the token of a teacher of
+the course. Canvas rate limits every token separately, so instead of using the
+same teacher's token for all the calls, the calls are spread across the tokens
+of all the staff members with the roles in `CANVAS_CREDENTIAL_ROLES`.
+
+Only the teachers are included by default. A TA enrolled in some sections of
+the course gets a partial list of the students and submissions from Canvas,
+without any error, so the TAs should be added only when they can access the
+whole course.
+
+Every Canvas client created by `get_canvas_client` records the remaining quota
+reported in the `X-Rate-Limit-Remaining` header of the responses. The pool
+hands out the valid token with the most quota left.
+"""
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from flask import current_app as app
+from flask import has_app_context
+
+from peerfeedback.api.canvas_cache import get_requester
+from peerfeedback.api.jobs.tokens import TOKEN_MIN_VALIDITY
+from peerfeedback.extensions import cache, db
+from peerfeedback.models import CourseUserMap, User
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "canvas-quota"
+# Time (in seconds) for which the recorded quota is considered current. Canvas
+# replenishes the quota continuously, so old values are of no use.
+QUOTA_TIMEOUT = 60 * 5
+# Quota assumed for tokens which haven't been used recently
+DEFAULT_QUOTA = 700.0
+DEFAULT_ROLES = (CourseUserMap.TEACHER,)
+
+
+def quota_key(token):
+    """Return the cache key of the quota of a token. The token itself is not
+    stored in the key.
+    """
+    digest = hashlib.sha256(token.encode()).hexdigest()[:32]
+    return f"{KEY_PREFIX}:{digest}"
+
+
+def record_quota(token, response):
+    """Save the remaining rate limit quota of the token from a Canvas response.
+
+    The quota is only a hint for picking the tokens, so the Canvas request is
+    never failed because of it. Nothing is saved outside an app context.
+
+    :param token: the canvas access token used for the request
+    :param response: requests.Response from Canvas
+    """
+    remaining = response.headers.get("X-Rate-Limit-Remaining")
+    if remaining is None or not has_app_context():
+        return
+    try:
+        remaining = float(remaining)
+    except ValueError:
+        logger.debug("Invalid rate limit header: %s", remaining)
+        return
+    try:
+        cache.set(quota_key(token), remaining, timeout=QUOTA_TIMEOUT)
+    except Exception:
+        logger.warning("Unable to save the canvas quota", exc_info=True)
+
+
+def track_quota(canvas, token):
+    """Record the quota of the token from all the responses of the client.
+
+    :param canvas: canvasapi.Canvas client
+    :param token: the canvas access token of the client
+    """
+    if not token:
+        return
+    session = get_requester(canvas)._session
+    session.hooks["response"].append(
+        lambda response, *args, **kwargs: record_quota(token, response)
+    )
+
+
+def get_quota(token):
+    """Return the last known remaining quota of the token."""
+    remaining = cache.get(quota_key(token))
+    return DEFAULT_QUOTA if remaining is None else remaining
+
+
+class CredentialPool(object):
+    """The staff members of a course whose tokens can be used for the course.
+
+    :param course_id: canvas id of the course
+    :param roles: OPTIONAL - roles of the staff members included in the pool
+    """
+
+    def __init__(self, course_id, roles=None):
+        self.course_id = course_id
+        self.roles = tuple(
+            roles or app.config.get("CANVAS_CREDENTIAL_ROLES", DEFAULT_ROLES)
+        )
+
+    def members(self):
+        """Return the staff members who have a canvas token, along with their
+        roles.
+
+        :return: list of (User, role) tuples
+        """
+        return (
+            db.session.query(User, CourseUserMap.role)
+            .join(CourseUserMap, CourseUserMap.user_id == User.id)
+            .filter(
+                CourseUserMap.course_id == self.course_id,
+                CourseUserMap.role.in_(self.roles),
+                User.canvas_access_token.isnot(None),
+                User.canvas_expiration_time.isnot(None),
+            )
+            .order_by(CourseUserMap.id)
+            .all()
+        )
+
+    def primary(self):
+        """Return the first teacher of the course with a token, for the
+        operations which must always run as the same user.
+
+        :return: User or None if no teacher has a token
+        """
+        return next(
+            (u for u, role in self.members() if role == CourseUserMap.TEACHER), None
+        )
+
+    def least_loaded(self):
+        """Return the staff member whose token has the most quota left.
+
+        Tokens which are still valid are preferred over the expired ones, and
+        teachers are preferred over the TAs when the quota is the same.
+
+        :return: User or None if no staff member has a token
+        """
+        valid_after = datetime.now(tz=timezone.utc) + TOKEN_MIN_VALIDITY
+        best = None
+        best_rank = None
+        for user, role in self.members():
+            rank = (
+                user.canvas_expiration_time > valid_after,
+                get_quota(user.canvas_access_token),
+                role == CourseUserMap.TEACHER,
+            )
+            if best_rank is None or rank > best_rank:
+                best, best_rank = user, rank
+        return best
@@ -0,0 +1,129 @@
+"""Push channel for the events of a user.
+
+The events like a new notification or the progress of a background job are
+published to a per-user Redis pub/sub channel. The `/api/events/` endpoint
+streams them to the browser as server-sent events, so the clients don't have to
+poll the notifications and the job status endpoints.
+
+Publishing is best effort. The events only tell the clients to refresh, so a
+failure to publish is logged and never affects the operation that caused it.
+
+The browsers' `EventSource` can't set the Authorization header. Instead of
+putting the access token in the URL, where it ends up in the access logs, the
+client gets a short lived stream token which can be used only once.
+"""
+import json
+import logging
+import secrets
+import time
+
+from flask import current_app as app
+from redis.exceptions import RedisError
+
+from peerfeedback.extensions import rq
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "events"
+# Time (in seconds) after which a comment is sent to keep the connection open
+HEARTBEAT_INTERVAL = 15
+# Time (in seconds) for which a stream is kept open. The browsers reconnect to
+# the endpoint automatically after the stream ends.
+STREAM_DURATION = 60 * 5
+# Time (in milliseconds) the browsers wait before reconnecting
+RECONNECT_DELAY = 3000
+STREAM_TOKEN_PREFIX = "events-token"
+# Time (in seconds) within which a stream token has to be used
+STREAM_TOKEN_TIMEOUT = 60
+
+NOTIFICATION = "notification"
+JOB_PROGRESS = "job_progress"
+
+
+def channel(user_id):
+    """Return the name of the pub/sub channel of the user."""
+    return f"{CHANNEL_PREFIX}:{user_id}"
+
+
+def publish(user_id, event, data):
+    """Publish an event to the channel of the user.
+
+    :param user_id: local id of the user receiving the event
+    :param event: the type of the event
+    :param data: JSON serializable data of the event
+    :return: the number of streams which received the event
+    """
+    if not user_id or not app.config.get("PUBLISH_EVENTS", True):
+        return 0
+    message = json.dumps({"event": event, "data": data})
+    try:
+        return rq.connection.publish(channel(user_id), message)
+    except RedisError:
+        logger.warning("Failed to publish %s event to user %s", event, user_id)
+        return 0
+
+
+def create_stream_token(user_id):
+    """Create a single use token for opening the event stream of the user.
+
+    :param user_id: local id of the user
+    :return: the token
+    """
+    token = secrets.token_urlsafe(32)
+    rq.connection.setex(
+        f"{STREAM_TOKEN_PREFIX}:{token}", STREAM_TOKEN_TIMEOUT, str(user_id)
+    )
+    return token
+
+
+def redeem_stream_token(token):
+    """Return the user of a stream token and remove the token, so that it can't
+    be used again.
+
+    :param token: the token returned by `create_stream_token`
+    :return: local id of the user or None if the token is invalid or expired
+    """
+    key = f"{STREAM_TOKEN_PREFIX}:{token}"
+    pipe = rq.connection.pipeline()
+    pipe.get(key)
+    pipe.delete(key)
+    user_id, _ = pipe.execute()
+    return int(user_id) if user_id else None
+
+
+def format_event(event, data):
+    """Format an event in the server-sent events wire format.
+
+    :param event: the type of the event
+    :param data: JSON serializable data of the event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(user_id, heartbeat=None, duration=None):
+    """Stream the events published to the channel of the user.
+
+    :param user_id: local id of the user
+    :param heartbeat: OPTIONAL - seconds between the keep alive comments
+    :param duration: OPTIONAL - seconds after which the stream ends
+    :return: a generator of the server-sent events
+    """
+    heartbeat = heartbeat or HEARTBEAT_INTERVAL
+    duration = duration or app.config.get("EVENT_STREAM_DURATION", STREAM_DURATION)
+
+    pubsub = rq.connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel(user_id))
+    try:
+        yield f"retry: {RECONNECT_DELAY}\n\n"
+        started = last_sent = time.monotonic()
+        while time.monotonic() - started < duration:
+            message = pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "message":
+                payload = json.loads(message["data"])
+                yield format_event(payload["event"], payload["data"])
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+    finally:
+        pubsub.close()
@@ -1,6 +1,7 @@
 from rq import get_current_job
 
-from peerfeedback.api import errors
+from peerfeedback.api import canvas_cache, errors, roles
+from peerfeedback.api.jobs.progress import ProgressReporter
 from peerfeedback.api.utils import get_canvas_client, create_user
 from peerfeedback.extensions import rq
 from peerfeedback.models import User, AssignmentSettings, CourseUserMap
@@ -19,11 +20,10 @@ def import_course_information(course_id, user_id, run_as_job=True):
     :return: status as a dict
     """
 
-    if run_as_job:
-        job = get_current_job()
-        job.meta["progress"] = 1
-        job.meta["message"] = "Initializing course {0}".format(course_id)
-        job.save_meta()
+    progress = ProgressReporter(
+        get_current_job() if run_as_job else None, user_id=user_id
+    )
+    progress.update(1, "Initializing course {0}".format(course_id))
 
     user = User.query.get(user_id)
     canvas = get_canvas_client(user.canvas_access_token)
@@ -31,15 +31,10 @@ def import_course_information(course_id, user_id, run_as_job=True):
     enrollments = course.get_enrollments(user_id=user.canvas_id)
     enrolls = [e.type for e in enrollments]
     if "TeacherEnrollment" not in enrolls:
-        if run_as_job:
-            job.meta["message"] = errors.ONLY_TEACHERS
-            job.save_meta()
+        progress.update(message=errors.ONLY_TEACHERS)
         return {"status": "fail", "message": errors.ONLY_TEACHERS}
 
-    if run_as_job:
-        job.meta["message"] = "Setting up the course assignments."
-        job.meta["progress"] = 5
-        job.save_meta()
+    progress.update(5, "Setting up the course assignments.")
 
     assignments = course.get_assignments()
     for assignment in assignments:
@@ -60,10 +55,7 @@ def import_course_information(course_id, user_id, run_as_job=True):
         )
         settings.save()
 
-    if run_as_job:
-        job.meta["progress"] = 30
-        job.meta["message"] = "Importing users in the course"
-        job.save_meta()
+    progress.update(30, "Importing users in the course")
 
     course_users = course.get_users(include=["enrollments"])
     for cu in course_users:
@@ -84,14 +76,12 @@ def import_course_information(course_id, user_id, run_as_job=True):
             )
         mapping.save()
 
-        if run_as_job and job.meta["progress"] < 90:
-            job.meta["progress"] += 1
-            job.save_meta()
+        if progress.progress < 90:
+            progress.update(progress.progress + 1)
 
-    if run_as_job:
-        job.meta["progress"] = 100
-        job.meta["message"] = "Course initialization completed successfully."
-        job.save_meta()
+    canvas_cache.invalidate_course(course_id)
+    roles.invalidate_course(course_id)
+    progress.complete("Course initialization completed successfully.")
 
     return {
         "status": "success",
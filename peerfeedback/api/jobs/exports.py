@@ -1,11 +1,12 @@
-import csv
 import datetime
-import io
+import itertools
 import logging
 import os
 import statistics
+from collections import defaultdict
 
 from dateutil.parser import parse as parse_date
+from peerfeedback.api.canvas_fetch import fetch_all, fetch_group_members
 from peerfeedback.api.jobs.sendmail import (
     send_download_email,
     send_export_request_received_email,
@@ -13,9 +14,10 @@ from peerfeedback.api.jobs.sendmail import (
 from peerfeedback.api.utils import (
     get_canvas_client,
     get_db_users,
-    make_csv,
-    upload_file_to_s3,
+    iter_csv,
+    upload_stream_to_s3,
 )
+from peerfeedback.api.scoring import RubricScorer
 from peerfeedback.crons import award_ml_grade
 from peerfeedback.extensions import db, rq
 from peerfeedback.models import (
@@ -23,7 +25,6 @@ from peerfeedback.models import (
     CourseUserMap,
     Feedback,
     Pairing,
-    RubricCriteria,
     User,
 )
 from sqlalchemy import text
@@ -31,6 +32,32 @@ from sqlalchemy.orm import joinedload
 
 logger = logging.getLogger(__name__)
 
+# No.of rows fetched from the DB at a time when streaming the export data
+EXPORT_BATCH_SIZE = 500
+
+
+def save_export(rows, heading, name):
+    """Write the rows as a CSV file and upload it to S3. The rows are consumed
+    lazily, so they can be generated from a streaming query.
+
+    In the dev environment the CSV is printed to the console instead.
+
+    :param rows: iterable of rows, each row being a list of values
+    :param heading: list of column names
+    :param name: name of the file
+    :return: the download url of the file or None in the dev environment
+    """
+    chunks = iter_csv(rows, heading)
+    if os.getenv("ENV", "prod") == "dev":
+        print("")
+        for chunk in chunks:
+            print(chunk, end="")
+        print("")
+        return None
+
+    logger.info("Uploading %s to S3 Bucket", name)
+    return upload_stream_to_s3(chunks, name)
+
 
 @rq.job("high", timeout=60 * 10)
 def export_course_data(course_id, user_id, include_drafts, run_ai, assignment_id=None):
@@ -43,9 +70,7 @@ def export_course_data(course_id, user_id, include_drafts, run_ai, assignment_id
         before the export is prepared
     :param assignment_id: OPTIONAL - the ID of the assignment to filter the data.
         By default the data for all the assignments are exported. This can be
-        limited to a specific assignment by setting the assignment.
-            By default the data for all the assignments are exported. This can be
-            limited to a specific assignment by setting the assignment ID
+        limited to a specific assignment by setting the assignment ID
     """
     user = User.query.get(user_id)
     if not user:
@@ -56,7 +81,7 @@ def export_course_data(course_id, user_id, include_drafts, run_ai, assignment_id
 
     canvas = get_canvas_client(user.canvas_access_token)
     course = canvas.get_course(course_id)
-    assignments = course.get_assignments()
+    assignments = fetch_all(course.get_assignments())
     assignment_map = {a.id: f"{a.name} ({a.id})" for a in assignments}
     group_maps = {a.id: generate_user_group_map(canvas, course, a) for a in assignments}
 
@@ -115,7 +140,7 @@ def export_course_data(course_id, user_id, include_drafts, run_ai, assignment_id
     if include_drafts:
         feedback_sql = text(feedback_sql + ";")
     else:
-        feedback_sql = text(feedback_sql + " AND feedback.draft=false;")
+        feedback_sql = text(feedback_sql + " AND feedback.draft IS false;")
 
     comments_sql = text(
         f"""
@@ -148,68 +173,71 @@ def export_course_data(course_id, user_id, include_drafts, run_ai, assignment_id
     """
     )
 
-    result = db.engine.execute(feedback_sql)
-    feedback_rows = [list(row) for row in result.fetchall()]
-    for row in feedback_rows:
-        assignment_id = row[ASSIGNMENT_ID_INDEX]
-        user_group_map = group_maps[assignment_id]
-        grader_id = row[GRADER_ID_INDEX]
-        row[GRADER_ID_INDEX] = user_group_map.get(grader_id, 0)
-
-        row[ASSIGNMENT_ID_INDEX] = assignment_map[assignment_id]
-
-    prev_rubric_id = -1
-    rubric_criteria = []
-    for f in feedback_rows:
-        rubric_id = f[RUBRIC_ID_INDEX]
-
-        if rubric_id:
-            if rubric_id != prev_rubric_id:
-                rubric_criteria = (
-                    RubricCriteria.query.filter(rubric_id == rubric_id)
-                    .order_by(RubricCriteria.id)
-                    .all()
-                )
-
-            grades = f[GRADES_INDEX]
-            grade_calc = 0
+    # The rubric criteria in the heading are of the rubric currently set for the
+    # assignment, or for the most recently set up assignment of the course
+    course_settings = AssignmentSettings.query.filter(
+        AssignmentSettings.course_id == course_id
+    )
+    if assignment_id:
+        scope = Feedback.assignment_id == assignment_id
+        course_settings = course_settings.filter(
+            AssignmentSettings.assignment_id == assignment_id
+        )
+    else:
+        scope = Feedback.assignment_id.in_(
+            course_settings.with_entities(AssignmentSettings.assignment_id)
+        )
+    heading_settings = (
+        course_settings.filter(AssignmentSettings.rubric_id.isnot(None))
+        .order_by(AssignmentSettings.id.desc())
+        .first()
+    )
+    heading_rubric_id = heading_settings.rubric_id if heading_settings else None
+
+    # Criteria of all the rubrics used in the export
+    rubric_ids = [
+        r for r, in db.session.query(Feedback.rubric_id).filter(scope).distinct()
+    ]
+    scorer = RubricScorer.for_rubrics(rubric_ids + [heading_rubric_id])
+
+    def feedback_rows(conn):
+        for row in conn.execute(feedback_sql):
+            f = list(row)
+            row_assignment_id = f[ASSIGNMENT_ID_INDEX]
+            user_group_map = group_maps.get(row_assignment_id, {})
+            f[GRADER_ID_INDEX] = user_group_map.get(f[GRADER_ID_INDEX], 0)
+            f[ASSIGNMENT_ID_INDEX] = assignment_map.get(
+                row_assignment_id, row_assignment_id
+            )
 
+            rubric_id = f[RUBRIC_ID_INDEX]
+            if not rubric_id:
+                f[GRADES_INDEX] = "no rubric"
+                yield f
+                continue
+
+            grade_calc = 0
             submitted = f[DRAFT_INDEX]
 
             if submitted:
-                for i, grade in enumerate(grades):
-                    try:
-                        criteria_id = grade["criteria_id"]
-                        criteria = next(
-                            filter(lambda x: x.id == criteria_id, rubric_criteria)
-                        )
-                        cur_criteria = criteria.levels
-                    except KeyError:
-                        rubric_levels = [rc.levels for rc in rubric_criteria]
-                        cur_criteria = rubric_levels[i]
-
-                    level = grade["level"]
-
-                    if level == None:
+                grades = f[GRADES_INDEX]
+                points_list = scorer.grade_points(grades, rubric_id)
+                for grade, points in zip(grades, points_list):
+                    if grade["level"] is None:
                         f.append("No level selected")
                     else:
-                        cur_level = next(
-                            filter(lambda x: x["position"] == level, cur_criteria)
-                        )
-                        grade_calc = grade_calc + cur_level["points"]
-                        f.append(cur_level["points"])
+                        grade_calc += points or 0
+                        f.append(points)
 
             f[GRADES_INDEX] = grade_calc
-        else:
-            f[GRADES_INDEX] = "no rubric"
+            yield f
 
-        prev_rubric_id = rubric_id
-
-    result = db.engine.execute(comments_sql)
-    comment_rows = [list(row) for row in result.fetchall()]
-    for row in comment_rows:
-        row[0] = assignment_map[row[0]]
-        row.append("")
+    def comment_rows(conn):
+        for row in conn.execute(comments_sql):
+            row = list(row)
+            row[0] = assignment_map.get(row[0], row[0])
+            row.append("")
+            yield row
 
     heading = [
         "Assignment",
@@ -234,28 +262,24 @@ def export_course_data(course_id, user_id, include_drafts, run_ai, assignment_id
         "Section",
     ]
 
-    for rc in rubric_criteria:
-        heading.append(rc.name + " " + rc.description)
+    if heading_rubric_id:
+        for rc in scorer.criteria_for(heading_rubric_id):
+            heading.append(rc.name + " " + rc.description)
 
-    csv_data = make_csv(feedback_rows + comment_rows, heading)
     today = datetime.date.today()
+    if assignment_id:
+        name = f"{course_id}_{assignment_id}_{today}_assign_detailed_data.csv"
+    else:
+        name = f"{course_id}_{today}_course_data_export.csv"
 
-    if os.getenv("ENV", "prod") == "dev":
-        print("")
-        print(csv_data.getvalue())
-        print("")
-        return
+    # server side cursors so that the rows are fetched as they are written
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        rows = itertools.chain(feedback_rows(conn), comment_rows(conn))
+        file_url = save_export(rows, heading, name)
 
-    if assignment_id == None:
-        file_url = upload_file_to_s3(
-            csv_data, f"{course_id}_{assignment_id}_{today}_assign_detailed_data.csv"
-        )
+    if file_url:
         send_download_email(user, file_url, course_id, assignment_id)
-    else:
-        file_url = upload_file_to_s3(
-            csv_data, str(course_id) + "_" + str(today) + "_course_data_export.csv"
-        )
-        send_download_email(user, file_url, course_id)
 
 
 def generate_user_group_map(canvas, course, assignment):
@@ -276,13 +300,13 @@ def generate_user_group_map(canvas, course, assignment):
         return {s.user_id: 0 for s in course_students}
 
     group_category = canvas.get_group_category(assignment.group_category_id)
-    groups = group_category.get_groups()
+    groups = fetch_all(group_category.get_groups())
+    group_members = fetch_group_members(groups)
     canvas_map = {c.user.canvas_id: c.user for c in course_students}
     user_group_map = {}
     for group in groups:
         logger.debug("Processing group: %d - %s", group.id, group.name)
-        members = group.get_users()
-        for member in members:
+        for member in group_members[group.id]:
             if member.id not in canvas_map:
                 continue
             user = canvas_map[member.id]
@@ -321,7 +345,7 @@ def export_assignment_data(course_id, assignment_id, user_id):
 
         user_group_map = generate_user_group_map(canvas, course, assignment)
 
-    query = (
+    reviews = (
         Feedback.query.filter(
             Feedback.assignment_id == assignment_id,
             Feedback.draft.is_(False),
@@ -329,67 +353,56 @@ def export_assignment_data(course_id, assignment_id, user_id):
         )
         .order_by(Feedback.reviewer_id, Feedback.end_date.desc())
         .options(joinedload(Feedback.reviewer))
-        .all()
+        .yield_per(EXPORT_BATCH_SIZE)
     )
 
-    scores = []
-
     FB_SCORE_POSITION = 7
     TOTAL_SCORE_POSITION = 8
 
-    for review in query:
-
-        if not settings.intra_group_review and not review.end_date:
-            continue
-
-        points = 0
-        if not settings.intra_group_review:
-            delta = deadline - review.end_date
-            decimal_d = delta / datetime.timedelta(days=1)
-            days = int(decimal_d)
-            if days < 0:
-                points = 50 - (abs(days) * 10)
-                if points < 0:
-                    points = 0
-            else:
-                points = 50
-
-        review_score = []
-        review_score.append(review.reviewer.id)
-        review_score.append(review.reviewer.name)
-        review_score.append(review.reviewer.username)
-        review_score.append(user_group_map.get(review.reviewer.id, 0))
-        review_score.append(review.value)
-        review_score.append(review.end_date)
-        review_score.append(deadline)
-        review_score.append(points)
-        review_score.append(0)
-        review_score.append(review.draft)
-        review_score.append(review.ml_rating)
-        review_score.append(review.ml_prob)
-
-        scores.append(review_score)
-
-    first_reviewer_id = scores[0][0]
-    current_reviewer_id = first_reviewer_id
-    current_scores = []
-    scores.append([-1])
-    for score in scores:
-        if current_reviewer_id != score[0] or score[0] == -1:
-            total_score = 0
-            current_scores.sort(reverse=True)
-            for index, c in zip(range(2), current_scores):
-                total_score = c[FB_SCORE_POSITION] + total_score
-
-            for c in current_scores:
-                c[TOTAL_SCORE_POSITION] = total_score
+    def review_rows():
+        for review in reviews:
 
-            current_reviewer_id = score[0]
-            current_scores = []
+            if not settings.intra_group_review and not review.end_date:
+                continue
 
-        current_scores.append(score)
+            points = 0
+            if not settings.intra_group_review:
+                delta = deadline - review.end_date
+                decimal_d = delta / datetime.timedelta(days=1)
+                days = int(decimal_d)
+                if days < 0:
+                    points = 50 - (abs(days) * 10)
+                    if points < 0:
+                        points = 0
+                else:
+                    points = 50
+
+            yield [
+                review.reviewer.id,
+                review.reviewer.name,
+                review.reviewer.username,
+                user_group_map.get(review.reviewer.id, 0),
+                review.value,
+                review.end_date,
+                deadline,
+                points,
+                0,
+                review.draft,
+                review.ml_rating,
+                review.ml_prob,
+            ]
 
-    scores.pop()
+    def scored_rows():
+        # the total score of a reviewer is the sum of the top two review scores.
+        # The rows are written in the order of the query, only the scores are
+        # picked from the sorted rows.
+        for _, reviewer_scores in itertools.groupby(review_rows(), lambda r: r[0]):
+            current_scores = list(reviewer_scores)
+            top_scores = sorted(current_scores, reverse=True)[:2]
+            total_score = sum(c[FB_SCORE_POSITION] for c in top_scores)
+            for c in current_scores:
+                c[TOTAL_SCORE_POSITION] = total_score
+                yield c
 
     heading = [
         "reviewer_id",
@@ -406,13 +419,15 @@ def export_assignment_data(course_id, assignment_id, user_id):
         "ml prob",
     ]
 
-    csv_data = make_csv(scores, heading)
     today = datetime.date.today()
-    file_url = upload_file_to_s3(
-        csv_data, str(assignment_id) + "_" + str(today) + "_assignment_data_export.csv"
+    file_url = save_export(
+        scored_rows(),
+        heading,
+        str(assignment_id) + "_" + str(today) + "_assignment_data_export.csv",
     )
 
-    send_download_email(user, file_url, course_id)
+    if file_url:
+        send_download_email(user, file_url, course_id)
 
 
 @rq.job("high", timeout=60 * 10)
@@ -439,12 +454,7 @@ def export_student_scores(course_id, assignment_id, user_id):
     course = canvas.get_course(course_id)
     assignment = course.get_assignment(assignment_id)
 
-    criterias = RubricCriteria.query.filter(
-        RubricCriteria.rubric_id == settings.rubric_id
-    ).all()
-    lookup_table = [
-        {l["position"]: l["points"] for l in criteria.levels} for criteria in criterias
-    ]
+    scorer = RubricScorer.for_rubrics([settings.rubric_id])
 
     # Get all the users of the course
     mappings = (
@@ -456,8 +466,6 @@ def export_student_scores(course_id, assignment_id, user_id):
         .all()
     )
 
-    si = io.StringIO()
-    cw = csv.writer(si)
     heading = [
         "Student",
         "ID",
@@ -466,24 +474,25 @@ def export_student_scores(course_id, assignment_id, user_id):
         f"{assignment.name} ({assignment_id})",
         "Std Dev",
     ]
-    cw.writerow(heading)
 
-    # For each user get all the feedback where he is the recipient
-    rows = []
-    for mapping in mappings:
-        student = mapping.user
-        fbs = Feedback.query.filter(
+    # Total score of every feedback, grouped by the recipient
+    received_scores = defaultdict(list)
+    grades = (
+        db.session.query(Feedback.receiver_id, Feedback.grades)
+        .filter(
             Feedback.assignment_id == assignment_id,
-            Feedback.receiver_id == student.id,
             Feedback.draft.is_(False),
             Feedback.pairing.has(Pairing.archived.is_(False)),
-        ).all()
-        scores = []
-        for fb in fbs:
-            total = sum(
-                lookup[grade["level"]] for lookup, grade in zip(lookup_table, fb.grades)
-            )
-            scores.append(total)
+        )
+        .yield_per(EXPORT_BATCH_SIZE)
+    )
+    for receiver_id, fb_grades in grades:
+        received_scores[receiver_id].append(scorer.score(fb_grades, settings.rubric_id))
+
+    rows = []
+    for mapping in mappings:
+        student = mapping.user
+        scores = received_scores.get(student.id, [])
 
         # Calculate the average & std.dev of all the feedback ratings
         count = len(scores)
@@ -491,20 +500,13 @@ def export_student_scores(course_id, assignment_id, user_id):
         stdv = statistics.stdev(scores) if count > 1 else 0
         rows.append([student.name, student.canvas_id, "", count, avg, stdv])
     rows = sorted(rows, key=lambda row: row[-1])
-    cw.writerows(rows)
-
-    if os.getenv("ENV", "prod") == "dev":
-        print("\n")
-        print(si.getvalue())
-        print("\n")
-        return
 
     today = datetime.date.today()
-    file_url = upload_file_to_s3(
-        si, f"assignment_{assignment_id}_student_scores_{today}.csv"
+    file_url = save_export(
+        rows, heading, f"assignment_{assignment_id}_student_scores_{today}.csv"
     )
-    user = User.query.get(user_id)
-    send_download_email(user, file_url, course_id, assignment_id)
+    if file_url:
+        send_download_email(user, file_url, course_id, assignment_id)
 
 
 @rq.job("high", timeout=60 * 10)
@@ -523,10 +525,8 @@ def export_igr_data(course_id, assignment_id, user_id):
     settings = AssignmentSettings.query.filter(
         AssignmentSettings.assignment_id == assignment_id
     ).first()
-    crits = RubricCriteria.query.filter(
-        RubricCriteria.rubric_id == settings.rubric_id
-    ).all()
-    criteria = {}
+    scorer = RubricScorer.for_rubrics([settings.rubric_id])
+    crits = scorer.criteria_for(settings.rubric_id)
     column_names = [
         "Assignment",
         "Project Group",
@@ -541,16 +541,14 @@ def export_igr_data(course_id, assignment_id, user_id):
     course = canvas.get_course(course_id)
     assignment = course.get_assignment(assignment_id)
     group_category = canvas.get_group_category(assignment.group_category_id)
-    groups = group_category.get_groups()
+    groups = fetch_all(group_category.get_groups())
+    members = fetch_group_members(groups)
 
     for group in groups:
-        users = group.get_users()
-        group_members = get_db_users(users, False)
+        group_members = get_db_users(members[group.id], False)
         group_map.update({m.id: group.id for m in group_members})
 
     for c in crits:
-        points = [i["points"] for i in c.levels]
-        criteria[c.id] = {"name": c.name, "points": points}
         column_names.append(c.name)
 
     column_names += ["Feedback", "Total Points"]
@@ -563,53 +561,40 @@ def export_igr_data(course_id, assignment_id, user_id):
         )
         .order_by(Feedback.reviewer_id, Feedback.receiver_id)
         .options(joinedload(Feedback.reviewer), joinedload(Feedback.receiver))
-        .all()
+        .yield_per(EXPORT_BATCH_SIZE)
     )
 
-    rows = []
-    for fb in fbs:
-        try:
-            row = [
-                assignment_id,
-                group_map[fb.reviewer_id],
-                fb.reviewer.name,
-                fb.reviewer.username,
-                fb.receiver.username,
-            ]
-        except KeyError:
+    def igr_rows():
+        for fb in fbs:
+            if len(fb.grades) == 0:
+                continue
+
             row = [
                 assignment_id,
-                0,
+                group_map.get(fb.reviewer_id, 0),
                 fb.reviewer.name,
                 fb.reviewer.username,
                 fb.receiver.username,
             ]
 
-        points = []
+            # grades without a level selected are scored as the first level
+            grades = [dict(g, level=g["level"] or 0) for g in fb.grades]
+            points = scorer.grade_points(grades, settings.rubric_id)
 
-        if len(fb.grades) == 0:
-            continue
+            assert len(crits) == len(points)
+            row += points
+            row.append(fb.value)
+            row.append(scorer.score(grades, settings.rubric_id))
+            yield row
 
-        for g in fb.grades:
-            level = 0
-            if g["level"]:
-                level = g["level"]
-
-            points.append(criteria[g["criteria_id"]]["points"][level])
-
-        assert len(crits) == len(points)
-        row += points
-        row.append(fb.value)
-        row.append(sum(points))
-        rows.append(row)
-
-    csv_data = make_csv(rows, column_names)
     today = datetime.date.today()
-    logger.info("Uploading output file to S3 Bucket")
-    file_url = upload_file_to_s3(
-        csv_data, str(assignment_id) + "_" + str(today) + "_intra_group_review_data.csv"
+    file_url = save_export(
+        igr_rows(),
+        column_names,
+        str(assignment_id) + "_" + str(today) + "_intra_group_review_data.csv",
     )
 
-    logger.info("Sending download email")
-    send_download_email(user, file_url, course_id)
-    logger.info("Data Export for IGR %d completed.", user_id)
+    if file_url:
+        logger.info("Sending download email")
+        send_download_email(user, file_url, course_id)
+    logger.info("Data Export for IGR %d completed.", assignment_id)
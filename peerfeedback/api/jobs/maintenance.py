@@ -1,9 +1,14 @@
 from random import choice
 
-from peerfeedback.api import errors
-from peerfeedback.api.jobs.sendmail import send_pairing_email
-from peerfeedback.api.utils import (create_pairing, get_canvas_client,
-                                    get_course_teacher, proper_email)
+from peerfeedback.api import canvas_cache, errors
+from peerfeedback.api.jobs.sendmail import send_pairing_emails
+from peerfeedback.api.utils import (
+    SubmissionIndex,
+    create_pairing,
+    get_canvas_client,
+    get_course_teacher,
+    proper_email,
+)
 from peerfeedback.extensions import db, rq
 from peerfeedback.models import Feedback, Pairing, User
 from sqlalchemy import Text
@@ -48,18 +53,12 @@ def replace_unsubmitted_pairs(course_id, assignment_id, pairs):
         return
 
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    assignment = course.get_assignment(assignment_id)
-    submissions = assignment.get_submissions()
-    unsubmitted = []
-    submitted = []
-    for s in submissions:
-        if s.workflow_state == "unsubmitted":
-            unsubmitted.append(s)
-        else:
-            submitted.append(s)
-
-    unsubmitted_users = [u.user_id for u in unsubmitted]
+    course = canvas_cache.get_course(canvas, course_id)
+    assignment = canvas_cache.get_assignment(canvas, course_id, assignment_id)
+    submissions = SubmissionIndex.for_assignment(assignment)
+    unsubmitted_users = set(
+        submissions.user_ids(lambda s: s.workflow_state == "unsubmitted")
+    )
 
     pairings = (
         Pairing.query.filter(
@@ -98,6 +97,7 @@ def replace_unsubmitted_pairs(course_id, assignment_id, pairs):
 
     # create new pairings
     pairs_created = 0
+    pairing_ids = []
     for grader in submitted_users:
         if feedback_user_gives[grader.id] >= pairs:
             continue
@@ -143,11 +143,12 @@ def replace_unsubmitted_pairs(course_id, assignment_id, pairs):
                 pair = create_pairing(teacher, grader, recipient, course, assignment)
             except (errors.PairingExists, errors.PairingToSelf):
                 continue
-            send_pairing_email.queue(pair.id)
+            pairing_ids.append(pair.id)
             feedback_user_gets[recipient.id] += 1
             feedback_user_gives[grader.id] += 1
             pairs_created += 1
 
+    send_pairing_emails.queue(pairing_ids)
     print("Created {0} new pairings.".format(pairs_created))
 
 
@@ -170,12 +171,13 @@ def add_missing_pairings(course_id, assignment_id, min_pairs):
     """
     teacher = get_course_teacher(course_id)
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    assignment = course.get_assignment(assignment_id)
-    submissions = assignment.get_submissions()
-    submitted = [sub for sub in submissions if sub.workflow_state != "unsubmitted"]
-    all_canvas_ids = [s.user_id for s in submissions]
-    submitted_canvas_ids = [s.user_id for s in submitted]
+    course = canvas_cache.get_course(canvas, course_id)
+    assignment = canvas_cache.get_assignment(canvas, course_id, assignment_id)
+    submissions = SubmissionIndex.for_assignment(assignment)
+    all_canvas_ids = submissions.user_ids()
+    submitted_canvas_ids = set(
+        submissions.user_ids(lambda s: s.workflow_state != "unsubmitted")
+    )
 
     pairs = Pairing.query.filter(
         Pairing.course_id == course_id,
@@ -191,6 +193,7 @@ def add_missing_pairings(course_id, assignment_id, min_pairs):
         feedback_user_gets[pair.recipient_id] += 1
 
     pairs_created = 0
+    pairing_ids = []
     for grader in all_students:
         already_paired_users = [
             pair.recipient_id for pair in pairs if pair.grader_id == grader.id
@@ -227,10 +230,11 @@ def add_missing_pairings(course_id, assignment_id, min_pairs):
             except (errors.PairingToSelf, errors.PairingExists):
                 continue
             unpaired_users.remove(recipient)
-            send_pairing_email.queue(pair.id)
+            pairing_ids.append(pair.id)
             feedback_user_gets[recipient.id] += 1
             pairs_created += 1
 
+    send_pairing_emails.queue(pairing_ids)
     print("Created {0} new pairs".format(pairs_created))
 
 
@@ -2,7 +2,8 @@ from sentry_sdk import capture_message
 from sqlalchemy.orm import joinedload
 
 from peerfeedback.models import Pairing, Feedback, Task, Notification, Comment, Medal
-from peerfeedback.extensions import rq
+from peerfeedback.extensions import db, rq
+from peerfeedback.api.notifications import context_of, fan_out
 
 
 @rq.job("low")
@@ -15,20 +16,10 @@ def award_super_commentator(comment_id):
     if len(comment.likes) < 10:
         return
 
-    medal = Medal.create(name="Super Commentator", user_id=comment.commenter_id)
-    medal.save()
-
-    notification = Notification.create(
-        read=False,
-        item=Notification.MEDAL,
-        item_id=medal.id,
-        course_name=comment.course_name,
-        course_id=comment.course_id,
-        assignment_id=comment.assignment_id,
-        assignment_name=comment.assignment_name,
-        recipient_id=comment.recipient_id,
-    )
-    notification.save()
+    medal = Medal(name="Super Commentator", user_id=comment.commenter_id)
+    medal.save(commit=False)
+    db.session.flush()
+    fan_out(Notification.MEDAL, medal.id, [comment.recipient_id], **context_of(comment))
 
 
 @rq.job("low")
@@ -44,21 +35,16 @@ def award_contributor_medal(feedback_id):
     if awarded:
         return
 
-    medal = Medal.create(name="Contributor", user_id=feed.reviewer_id)
-    medal.save()
-
-    notification = Notification.create(
-        read=False,
-        item=Notification.MEDAL,
-        item_id=medal.id,
-        course_name=feed.course_name,
-        course_id=feed.course_id,
-        assignment_id=feed.assignment_id,
-        assignment_name=feed.assignment_name,
-        recipient_id=feed.reviewer_id,
+    medal = Medal(name="Contributor", user_id=feed.reviewer_id)
+    medal.save(commit=False)
+    db.session.flush()
+    fan_out(
+        Notification.MEDAL,
+        medal.id,
+        [feed.reviewer_id],
         user_id=feed.receiver_id,
+        **context_of(feed),
     )
-    notification.save()
 
 
 @rq.job("low")
@@ -79,10 +65,7 @@ def award_generous_reviewer_medal(user_id):
     if not all_complete:
         return
 
-    medal = Medal.create(name="Generous Reviewer", user_id=user_id)
-    medal.save()
-
-    notification = Notification.create(
-        read=False, item=Notification.MEDAL, item_id=medal.id, user_id=user_id
-    )
-    notification.save()
+    medal = Medal(name="Generous Reviewer", user_id=user_id)
+    medal.save(commit=False)
+    db.session.flush()
+    fan_out(Notification.MEDAL, medal.id, [user_id], user_id=user_id)
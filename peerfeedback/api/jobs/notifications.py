@@ -1,7 +1,6 @@
-from sqlalchemy.orm import joinedload
-
 from peerfeedback.models import Feedback, Notification, Comment
-from peerfeedback.extensions import rq
+from peerfeedback.extensions import db, rq
+from peerfeedback.api.notifications import context_of, fan_out
 
 
 @rq.job("default")
@@ -14,32 +13,22 @@ def notify_discussion_participants(comment_id):
     comment = Comment.query.get(comment_id)
     if not comment:
         return
-    feedbacks = (
-        Feedback.query.filter(
-            Feedback.course_id == comment.course_id,
-            Feedback.assignment_id == comment.assignment_id,
-            Feedback.receiver_id == comment.recipient_id,
-            Feedback.draft.is_(False),
-        )
-        .options(joinedload(Feedback.reviewer))
-        .all()
+    reviewer_ids = db.session.query(Feedback.reviewer_id).filter(
+        Feedback.course_id == comment.course_id,
+        Feedback.assignment_id == comment.assignment_id,
+        Feedback.receiver_id == comment.recipient_id,
+        Feedback.draft.is_(False),
     )
-    participants = [
-        f.reviewer for f in feedbacks if f.reviewer_id != comment.commenter_id
-    ]
+    participants = [r_id for r_id, in reviewer_ids if r_id != comment.commenter_id]
 
     if comment.recipient_id != comment.commenter_id:
-        participants.append(comment.recipient)
+        participants.append(comment.recipient_id)
 
-    for p in participants:
-        Notification.create(
-            item=Notification.COMMENT,
-            item_id=comment.id,
-            course_name=comment.course_name,
-            course_id=comment.course_id,
-            assignment_name=comment.assignment_name,
-            assignment_id=comment.assignment_id,
-            user_id=comment.recipient_id,
-            recipient_id=p.id,
-            notifier_id=comment.commenter_id,
-        )
+    fan_out(
+        Notification.COMMENT,
+        comment.id,
+        participants,
+        user_id=comment.recipient_id,
+        notifier_id=comment.commenter_id,
+        **context_of(comment),
+    )
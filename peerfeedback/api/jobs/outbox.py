@@ -0,0 +1,299 @@
+"""Durable outbox of the emails.
+
+The mail producers don't call SendGrid themselves. `enqueue_mail` adds the
+email to the `outbox_email` table and the `dispatch_outbox` job, run by a
+dedicated worker on the "mail" queue, sends them in the background:
+
+* one dispatcher runs at a time, guarded by a Redis lock
+* up to `MAIL_CONCURRENCY` emails are sent in parallel
+* the sends are throttled by a token bucket to `MAIL_RATE_LIMIT` per second
+* the failed emails are retried with an exponential backoff, upto
+  `MAX_ATTEMPTS` times
+* an email given a deduplication key is added to the outbox only once
+
+The emails are sent through a pluggable transport, selected by the
+`MAIL_TRANSPORT` config.
+
+The payloads contain the addresses and the content of the emails, so the sent
+and failed emails are deleted by the `prune_outbox` job after
+`OUTBOX_RETENTION_DAYS`.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import sendgrid
+from flask import current_app as app
+from redis.exceptions import LockError
+from sentry_sdk import capture_message, push_scope
+from sqlalchemy.dialects.postgresql import insert
+
+from peerfeedback.extensions import cache, db, rq
+from peerfeedback.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+sg = sendgrid.SendGridAPIClient(os.environ.get("SENDGRID_API_KEY"))
+
+MAX_ATTEMPTS = 6
+# Delay before the first retry, doubled for every following attempt
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+# Time for which the claimed emails are reserved for the dispatcher. If the
+# dispatcher dies, the emails are picked up again after this time.
+CLAIM_LEASE = timedelta(minutes=10)
+BATCH_SIZE = 100
+# Time (in seconds) after which a dispatcher stops claiming new batches
+DISPATCH_TIME_BUDGET = 60 * 8
+DISPATCH_LOCK = "outbox:dispatch-lock"
+DISPATCH_QUEUED_KEY = "outbox:dispatch-queued"
+# Days for which the sent and failed emails are kept
+RETENTION_DAYS = 30
+
+
+class SendGridTransport(object):
+    """Sends the emails through the SendGrid API."""
+
+    def send(self, mail):
+        return sg.send(mail)
+
+
+class LocalResponse(object):
+    status_code = 202
+
+
+class LocalTransport(object):
+    """Stand-in for SendGrid which keeps the request bodies of the emails in
+    the `outbox` instead of sending them. Used by the tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.outbox = []
+
+    def send(self, mail):
+        self.outbox.append(mail if isinstance(mail, dict) else mail.get())
+        return LocalResponse()
+
+
+mail_transports = {"sendgrid": SendGridTransport(), "local": LocalTransport()}
+
+
+def get_mail_transport():
+    """Return the transport selected by the `MAIL_TRANSPORT` config."""
+    return mail_transports[app.config.get("MAIL_TRANSPORT", "sendgrid")]
+
+
+class TokenBucket(object):
+    """Thread safe token bucket limiting the rate of the sends.
+
+    :param rate: no.of tokens added per second
+    :param capacity: OPTIONAL - maximum no.of tokens, allows bursts of this size
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one to be added if the bucket is empty."""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def enqueue_mail(mail, dedup_key=None):
+    """Add an email to the outbox and wake up the dispatcher.
+
+    The email is added in a transaction of its own, the session of the caller
+    is not committed or rolled back.
+
+    :param mail: sendgrid Mail object or its request body
+    :param dedup_key: OPTIONAL - unique key of the email, the email is ignored
+        if the key has been used already. Emails without a key are always added.
+    :return: True if the email was added to the outbox
+    """
+    payload = mail if isinstance(mail, dict) else mail.get()
+    statement = (
+        insert(OutboxEmail.__table__)
+        .values(
+            dedup_key=dedup_key,
+            payload=payload,
+            status=OutboxEmail.PENDING,
+            attempts=0,
+            next_attempt_at=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["dedup_key"])
+    )
+    with db.engine.begin() as connection:
+        added = connection.execute(statement).rowcount > 0
+
+    if added:
+        wake_dispatcher()
+    else:
+        logger.info("Email with the dedup key %s is already in the outbox", dedup_key)
+    return added
+
+
+def wake_dispatcher():
+    """Queue the dispatcher unless it has been queued recently."""
+    if cache.add(DISPATCH_QUEUED_KEY, True, timeout=5):
+        dispatch_outbox.queue()
+
+
+def retry_delay(attempts):
+    """Return the delay before the next attempt of an email.
+
+    :param attempts: no.of attempts made so far
+    """
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def claim_emails(limit):
+    """Reserve the emails that are due for the current dispatcher.
+
+    :param limit: maximum no.of emails to be claimed
+    :return: list of (id, payload) tuples
+    """
+    now = datetime.utcnow()
+    emails = (
+        OutboxEmail.query.filter(
+            OutboxEmail.status == OutboxEmail.PENDING,
+            OutboxEmail.next_attempt_at <= now,
+        )
+        .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    claimed = [(email.id, email.payload) for email in emails]
+    for email in emails:
+        email.next_attempt_at = now + CLAIM_LEASE
+    db.session.commit()
+    return claimed
+
+
+def send_payload(transport, bucket, payload):
+    """Send an email, run in the dispatcher's thread pool.
+
+    :return: the error message, None if the email was sent
+    """
+    bucket.acquire()
+    try:
+        response = transport.send(payload)
+    except Exception as e:
+        return repr(e)
+    if response.status_code >= 400:
+        return f"HTTP {response.status_code}: {getattr(response, 'body', '')}"
+    return None
+
+
+def record_result(email, error):
+    """Mark the email as sent or schedule its next attempt.
+
+    :param email: OutboxEmail object
+    :param error: the error of the attempt, None if it succeeded
+    :return: the status of the email
+    """
+    now = datetime.utcnow()
+    email.attempts += 1
+    if error is None:
+        email.status = OutboxEmail.SENT
+        email.sent_at = now
+        email.last_error = None
+        return OutboxEmail.SENT
+
+    email.last_error = error
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+        with push_scope() as scope:
+            scope.set_extra("outbox_email_id", email.id)
+            scope.set_extra("error", error)
+            capture_message("Email sending failed.", "error")
+        return OutboxEmail.FAILED
+
+    email.next_attempt_at = now + retry_delay(email.attempts)
+    return OutboxEmail.PENDING
+
+
+@rq.job("mail", timeout=60 * 10)
+def dispatch_outbox(batch_size=BATCH_SIZE):
+    """Send the emails waiting in the outbox.
+
+    :param batch_size: no.of emails claimed at a time
+    :return: no.of emails sent, retried and failed, None if another
+        dispatcher is running
+    """
+    lock = rq.connection.lock(DISPATCH_LOCK, timeout=60 * 10)
+    if not lock.acquire(blocking=False):
+        return None
+
+    stats = {OutboxEmail.SENT: 0, OutboxEmail.PENDING: 0, OutboxEmail.FAILED: 0}
+    transport = get_mail_transport()
+    bucket = TokenBucket(app.config.get("MAIL_RATE_LIMIT", 10))
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(app.config.get("MAIL_CONCURRENCY", 4)) as pool:
+            while time.monotonic() - started < DISPATCH_TIME_BUDGET:
+                claimed = claim_emails(batch_size)
+                if not claimed:
+                    break
+                errors = pool.map(
+                    lambda item: send_payload(transport, bucket, item[1]), claimed
+                )
+                results = dict(zip((email_id for email_id, _ in claimed), errors))
+                emails = OutboxEmail.query.filter(OutboxEmail.id.in_(results)).all()
+                for email in emails:
+                    stats[record_result(email, results[email.id])] += 1
+                db.session.commit()
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
+
+    logger.info(
+        "Outbox dispatched. Sent: %d  Retrying: %d  Failed: %d",
+        stats[OutboxEmail.SENT],
+        stats[OutboxEmail.PENDING],
+        stats[OutboxEmail.FAILED],
+    )
+    return {
+        "sent": stats[OutboxEmail.SENT],
+        "retrying": stats[OutboxEmail.PENDING],
+        "failed": stats[OutboxEmail.FAILED],
+    }
+
+
+@rq.job("low", timeout=60 * 30)
+def prune_outbox(days=None):
+    """Delete the sent and failed emails older than `OUTBOX_RETENTION_DAYS`.
+
+    :param days: OPTIONAL - no.of days for which the emails are kept
+    :return: no.of emails deleted
+    """
+    days = days or app.config.get("OUTBOX_RETENTION_DAYS", RETENTION_DAYS)
+    before = datetime.now(tz=timezone.utc) - timedelta(days=days)
+    deleted = OutboxEmail.query.filter(
+        OutboxEmail.status.in_((OutboxEmail.SENT, OutboxEmail.FAILED)),
+        OutboxEmail.updated_on < before,
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info("Deleted %d emails from the outbox", deleted)
+    return deleted
@@ -1,32 +1,41 @@
 import itertools
 import logging
 from collections import defaultdict
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 
 from canvasapi.exceptions import InvalidAccessToken, ResourceDoesNotExist
 from flask_jwt_extended import get_current_user, jwt_required
-from peerfeedback.api import errors
+from peerfeedback.api import canvas_cache, errors
+from peerfeedback.api.canvas_fetch import fetch_all, fetch_group_members
+from peerfeedback.api.jobs.progress import ProgressReporter
 from peerfeedback.api.jobs.sendmail import (
     send_auto_pairing_notification_to_teachers,
     send_pairing_email,
+    send_pairing_emails,
     send_ta_allocation_email,
 )
+from peerfeedback.api.jobs.tokens import ensure_canvas_token
 from peerfeedback.api.schemas import pairing_with_task, real_pairing, real_user_schema
 from peerfeedback.api.utils import (
     assign_students_to_tas,
     create_pairing,
+    create_pairings,
     create_user,
     generate_non_group_pairs,
     generate_review_matches,
     get_canvas_client,
     get_course_teacher,
     get_db_users,
+    is_valid_submission,
+    PairingHistory,
+    reduce_repeated_pairs,
+    SubmissionIndex,
     validate_csv_input,
 )
 from peerfeedback.api.views import api_blueprint
 from peerfeedback.extensions import db, rq
 from peerfeedback.models import AssignmentSettings, Feedback, Pairing, Study, Task, User
-from peerfeedback.utils import get_pseudo_names, update_canvas_token
+from peerfeedback.utils import get_pseudo_names, refresh_canvas_token
 from rq import get_current_job
 from sqlalchemy.orm import joinedload
 
@@ -43,6 +52,7 @@ class AutomaticPairing(object):
         exclude_defaulters,
         excluded_students,
         send_emails,
+        avoid_repeats=False,
     ):
         self.course_id = course_id
         self.assignment_id = assignment_id
@@ -54,6 +64,7 @@ class AutomaticPairing(object):
         ]
         logger.debug("Excluding %d students from pairing", len(excluded_students))
         self.send_emails = send_emails
+        self.avoid_repeats = avoid_repeats
 
         # Other variables
         self.canvas = None
@@ -62,24 +73,27 @@ class AutomaticPairing(object):
         self.assignment_settings = None
         self.all_students = []
 
-    def init_canvas(self, job):
+    def init_canvas(self, progress):
         logger.info("Loading information from Canvas")
 
+        ensure_canvas_token(self.user)
         while True:
             try:
-                update_canvas_token(self.user)
                 self.canvas = get_canvas_client(self.user.canvas_access_token)
                 self.course = self.canvas.get_course(self.course_id)
                 self.assignment = self.course.get_assignment(self.assignment_id)
                 self.assignment_settings = AssignmentSettings.query.filter(
                     AssignmentSettings.assignment_id == self.assignment_id
                 ).first()
-                self.all_students = self.course.get_users(
-                    include=["email"],
-                    enrollment_type=["student"],
-                    enrollment_state=["active"],
+                self.all_students = fetch_all(
+                    self.course.get_users(
+                        include=["email"],
+                        enrollment_type=["student"],
+                        enrollment_state=["active"],
+                    )
                 )
             except InvalidAccessToken:
+                refresh_canvas_token(self.user, force=True)
                 continue
             break
 
@@ -88,35 +102,27 @@ class AutomaticPairing(object):
                 s.id for s in self.all_students if s.login_id in self.excluded_students
             ]
 
-        job.meta["progress"] = 8
-        job.save_meta()
+        progress.update(8)
 
-    def pair_for_assignment(self, job):
+    def pair_for_assignment(self, progress):
         """Carry out pairing for a normal assignment based on student submissions
 
-        :param job: Redis queue job to update the progress status
+        :param progress: ProgressReporter to update the progress status
         """
         # Select all the users who have submitted the assignment
         logger.info("Loading student submissions")
-        submissions = self.assignment.get_submissions()
+        submissions = SubmissionIndex.for_assignment(self.assignment)
+        excluded = set(self.excluded_students)
         grader_canvas_ids = [
-            sub.user_id
-            for sub in submissions
-            if sub.user_id not in self.excluded_students
+            user_id for user_id in submissions.user_ids() if user_id not in excluded
         ]
         logger.debug("No. of Graders: %d", len(grader_canvas_ids))
         logger.debug("Graders: %s", grader_canvas_ids)
 
         submitter_canvas_ids = [
-            submission.user_id
-            for submission in submissions
-            if submission.workflow_state != "unsubmitted"
-            and not (
-                submission.workflow_state == "graded"
-                and submission.score
-                and int(submission.score) == 0
-            )
-            and submission.user_id not in self.excluded_students
+            user_id
+            for user_id in submissions.user_ids(is_valid_submission)
+            if user_id not in excluded
         ]
         logger.debug("No.of Submitters: %d", len(submitter_canvas_ids))
         logger.debug("Submitters: %s", submitter_canvas_ids)
@@ -130,11 +136,12 @@ class AutomaticPairing(object):
             logger.error(errors.REVIEWS_EXCEED_STUDENTS)
             return {"status": "error", "message": errors.REVIEWS_EXCEED_STUDENTS}
 
-        job.meta["progress"] = 15
-        job.save_meta()
+        progress.update(15)
 
         all_users = get_db_users(self.all_students, True)
         usermap = dict((u.id, u) for u in all_users)
+        grader_canvas_ids = set(grader_canvas_ids)
+        submitter_canvas_ids = set(submitter_canvas_ids)
         graders = [u.id for u in all_users if u.canvas_id in grader_canvas_ids]
         recipients = [u.id for u in all_users if u.canvas_id in submitter_canvas_ids]
 
@@ -156,8 +163,6 @@ class AutomaticPairing(object):
                 logger.info("No. of participants: %d", len(study_participants))
                 break
 
-        possible_pairs = len(all_users) * self.review_rounds
-        pair_count = 0
         group_map = {}
 
         if (
@@ -168,64 +173,67 @@ class AutomaticPairing(object):
             group_category = self.canvas.get_group_category(
                 self.assignment.group_category_id
             )
-            groups = group_category.get_groups()
+            groups = fetch_all(group_category.get_groups())
+            members = fetch_group_members(groups)
             for group in groups:
-                users = group.get_users()
-                group_members = get_db_users(users, False)
+                group_members = get_db_users(members[group.id], False)
                 group_map[group.id] = [u.id for u in group_members if u.id in graders]
 
         logger.info("Generating matches for pairing")
         if group_map:
             _pairs = generate_non_group_pairs(group_map, recipients, self.review_rounds)
-            matchings = _pairs.items()
         else:
-            matchings = generate_review_matches(graders, recipients, self.review_rounds)
+            _pairs = dict(
+                generate_review_matches(graders, recipients, self.review_rounds)
+            )
 
-        logger.info("Creating Pairs")
+        if self.avoid_repeats:
+            logger.info("Reducing the pairs repeated from the earlier assignments")
+            history = PairingHistory.for_course(self.course_id, self.assignment_id)
+            group_of = {u: gid for gid in group_map for u in group_map[gid]}
+            repeated = reduce_repeated_pairs(_pairs, history, group_of)
+            logger.info("%d pairs are repeated from the earlier assignments", repeated)
+        matchings = _pairs.items()
+
+        progress.update(30)
+
+        matches = []
+        pair_names = {}
         for grader_id, recipient_ids in matchings:
-            logger.debug("Creating pairs for Grader: %d", grader_id)
             grader = usermap[grader_id]
             for recipient_id in recipient_ids:
                 recipient = usermap[recipient_id]
-                pair_count += 1
-                job.meta["progress"] = 30 + int(pair_count / possible_pairs * 70)
-                job.save_meta()
-                submission = next(
-                    (s for s in submissions if s.user_id == recipient.canvas_id), None
-                )
-                if not submission:
+                if recipient.canvas_id not in submissions:
                     continue
-                pseudo_name = None
                 if (
                     grader_id in study_participants
                     and recipient_id in study_participants
                 ):
-                    pseudo_name = next(pseudo_names)
-                try:
-                    pair = create_pairing(
-                        self.user,
-                        grader,
-                        recipient,
-                        self.course,
-                        self.assignment,
-                        study=active_study,
-                        pseudo_name=pseudo_name,
-                    )
-                    if self.send_emails:
-                        send_pairing_email.queue(pair.id)
-                except (errors.PairingToSelf, errors.PairingExists):
-                    logger.warning(
-                        "Grader %d and Recipient %d are already paired",
-                        grader_id,
-                        recipient_id,
-                    )
+                    pair_names[(grader_id, recipient_id)] = next(pseudo_names)
+                matches.append((grader, recipient))
+
+        logger.info("Creating %d Pairs", len(matches))
+        pairing_ids = create_pairings(
+            self.user,
+            matches,
+            self.course,
+            self.assignment,
+            study=active_study,
+            pseudo_names=pair_names,
+            callback=lambda done, total: progress.track(done, total, 30, 100),
+        )
+        logger.info("Created %d Pairs", len(pairing_ids))
+        progress.complete()
 
-    def pair_for_igr(self, job):
+        if self.send_emails:
+            send_pairing_emails.queue(pairing_ids)
+
+    def pair_for_igr(self, progress):
         """Carry out pairing for Intra Group Review assignments. These are single
         blind reviews of group members. More details at:
         https://gitlab.com/gabrieljoel/peerfeedback-ng/-/issues/378
 
-        :params job: Redis queue job to track the progress the of the process
+        :params progress: ProgressReporter to track the progress the of the process
         """
         logger.info("Performing Pairing for Intra Group Review")
         if not self.assignment.group_category_id:
@@ -234,65 +242,51 @@ class AutomaticPairing(object):
         group_category = self.canvas.get_group_category(
             self.assignment.group_category_id
         )
-        groups = group_category.get_groups()
+        groups = fetch_all(group_category.get_groups())
+        members = fetch_group_members(groups)
 
         all_users = get_db_users(self.all_students, True)
         usermap = dict((u.id, u) for u in all_users)
-        matchings = []
-        total_pairs = 0
+        matches = []
 
         for group in groups:
-            users = group.get_users()
-
-            group_members = get_db_users(users, False)
+            group_members = get_db_users(members[group.id], False)
 
             if len(group_members) == 2:
                 continue
 
             group_ids = [m.id for m in group_members]
 
-            for grader in group_ids:
-                matching = (grader, [r for r in group_ids if r != grader])
-                matchings.append(matching)
-                total_pairs += len(matching[1])
+            for grader_id in group_ids:
+                matches.extend(
+                    (usermap[grader_id], usermap[r])
+                    for r in group_ids
+                    if r != grader_id
+                )
 
-        job.meta["progress"] = 15
-        job.save_meta()
+        progress.update(30)
 
-        pair_count = 0
-        logger.info("Creating Pairings")
-        for grader_id, recipients in matchings:
-            logger.debug("Creating pairs for Grader: %d", grader_id)
-            grader = usermap[grader_id]
-            for recipient_id in recipients:
-                recipient = usermap[recipient_id]
-                pair_count += 1
-                job.meta["progress"] = 30 + int(pair_count / total_pairs * 70)
-                job.save_meta()
-                try:
-                    pair = create_pairing(
-                        self.user,
-                        grader,
-                        recipient,
-                        self.course,
-                        self.assignment,
-                        pair_type=Pairing.IGR,
-                    )
-                    if self.send_emails:
-                        send_pairing_email.queue(pair.id)
-                except (errors.PairingToSelf, errors.PairingExists):
-                    logger.warning(
-                        "Grader %d and Recipient are already paired",
-                        grader_id,
-                        recipient_id,
-                    )
+        logger.info("Creating %d Pairings", len(matches))
+        pairing_ids = create_pairings(
+            self.user,
+            matches,
+            self.course,
+            self.assignment,
+            pair_type=Pairing.IGR,
+            callback=lambda done, total: progress.track(done, total, 30, 100),
+        )
+        logger.info("Created %d Pairings", len(pairing_ids))
+        progress.complete()
 
-    def process(self, job):
-        self.init_canvas(job)
+        if self.send_emails:
+            send_pairing_emails.queue(pairing_ids)
+
+    def process(self, progress):
+        self.init_canvas(progress)
         if self.assignment_settings.intra_group_review:
-            self.pair_for_igr(job)
+            self.pair_for_igr(progress)
         else:
-            self.pair_for_assignment(job)
+            self.pair_for_assignment(progress)
 
         if self.send_emails:
             logger.info("Sending pairing completed notification to teachers")
@@ -311,6 +305,7 @@ def pair_automatically(
     exclude_defaulters,
     excluded_students,
     send_emails,
+    avoid_repeats=False,
 ):
     """RedisQueue job that does automatic pairing
 
@@ -323,6 +318,10 @@ def pair_automatically(
     :param excluded_students: comma-seperated string of usernames who shouldn't
         be a part of the pairing process
     :param send_emails: should the emails be sent
+    :param avoid_repeats: should the graders be kept from reviewing the students
+        they have reviewed on the earlier assignments of the course, where
+        possible. Passed as a keyword argument, so that the positional arguments
+        of the scheduled jobs stay the same.
     """
     logger.info(
         "Automatic Pairing started with params (%d, %d, %d, %d, %s, '%s', %s)",
@@ -336,7 +335,7 @@ def pair_automatically(
     )
 
     user = User.query.get(user_id)
-    job = get_current_job()
+    progress = ProgressReporter(get_current_job(), user_id=user_id)
     if not user:
         logger.error("Pairing Stopped: " + errors.INVALID_USER_ID)
         return {"status": "error", "message": errors.INVALID_USER_ID}
@@ -349,9 +348,10 @@ def pair_automatically(
         exclude_defaulters,
         excluded_students,
         send_emails,
+        avoid_repeats,
     )
     try:
-        message = processor.process(job)
+        message = processor.process(progress)
     except Exception as e:
         logger.exception(e)
         return {
@@ -395,14 +395,12 @@ def pair_using_csv(
     if not user:
         return {"status": "error", "message": errors.INVALID_USER_ID}
 
-    if run_as_job:
-        job = get_current_job()
-        job.meta["progress"] = 5
-        job.save_meta()
+    progress = ProgressReporter(
+        get_current_job() if run_as_job else None, user_id=user_id
+    )
+    progress.update(5)
 
-    token_expiry = datetime.now(tz=timezone.utc) + timedelta(minutes=15)
-    if token_expiry > user.canvas_expiration_time:
-        update_canvas_token(user)
+    ensure_canvas_token(user)
 
     validation = validate_csv_input(course_id, pairs, grader_type)
 
@@ -415,9 +413,7 @@ def pair_using_csv(
     course = validation["course"]
     assignment = course.get_assignment(assignment_id)
 
-    if run_as_job:
-        job.meta["progress"] = 20
-        job.save_meta()
+    progress.update(20)
 
     # Ensure all the users are present
     users = User.query.filter(User.canvas_id.in_(course_ids)).all()
@@ -434,43 +430,35 @@ def pair_using_csv(
         db.session.commit()
         user_map.update({user.username: user for user in new_users})
 
-    if run_as_job:
-        job.meta["progress"] = 30
-        job.save_meta()
+    progress.update(30)
 
-    submissions = assignment.get_submissions()
+    submissions = SubmissionIndex.for_assignment(assignment)
     missing_submissions = []
-    total_pairs = len(pairs)
-    paired = 0
+    matches = []
 
     for pair in pairs:
         grader = user_map[pair["grader"]]
         for r_username in pair["recipients"]:
             recipient = user_map[r_username]
-            submission = next(
-                (s for s in submissions if s.user_id == recipient.canvas_id), None
-            )
-            # Conditions under which we consider submission is missing
-            submission_is_missing = (
-                submission is None
-                or submission.workflow_state == "unsubmitted"
-                or (
-                    submission.workflow_state == "graded" and int(submission.score) == 0
-                )
+            submission_is_missing = not submissions.has_valid_submission(
+                recipient.canvas_id
             )
             if submission_is_missing and not allow_missing:
                 missing_submissions.append(r_username)
                 continue
-            try:
-                pair = create_pairing(user, grader, recipient, course, assignment)
-                if send_emails:
-                    send_pairing_email.queue(pair.id)
-            except (errors.PairingExists, errors.PairingToSelf):
-                continue
+            matches.append((grader, recipient))
+
+    pairing_ids = create_pairings(
+        user,
+        matches,
+        course,
+        assignment,
+        callback=lambda done, total: progress.track(done, total, 30, 100),
+    )
+    if send_emails:
+        send_pairing_emails.queue(pairing_ids)
 
-        paired += 1
-        if run_as_job:
-            job.meta["progress"] = 30 + paired / total_pairs * 70
+    progress.complete()
 
     if missing_submissions:
         message = "Pairing was done. Some were skipped due to missing submissions: "
@@ -494,7 +482,7 @@ def allocate_students_to_tas(
     :param send_email: boolen flag indicating if emails need to be sent or not
     :return: dict with "status" and "message"
     """
-    job = get_current_job()
+    progress = ProgressReporter(get_current_job(), user_id=user_id)
 
     # validate the json format before making any costly network calls
     properly_formatted = all(
@@ -516,53 +504,55 @@ def allocate_students_to_tas(
 
     if len(existing):
         return reassign_ta_pairings(
-            job, course_id, assignment_id, user, allocations, send_email
+            progress, course_id, assignment_id, user, allocations, send_email
         )
 
     canvas = get_canvas_client(user.canvas_access_token)
     course = canvas.get_course(course_id)
     assignment = course.get_assignment(assignment_id)
     students = course.get_users(enrollment_type=["student"])
-    job.meta["progress"] = 5
-    job.save_meta()
+    progress.update(5)
     student_users = get_db_users(students, create_missing=True)
     student_users = sorted(student_users, key=lambda x: x.id)
-    job.meta["progress"] = 10
-    job.save_meta()
+    progress.update(10)
 
     tas = [a["ta_id"] for a in allocations]
     ta_users = User.query.filter(User.id.in_(tas)).all()
     student_ids = [a.id for a in student_users]
 
     allotted = assign_students_to_tas(allocations, student_ids)
-    job.meta["progress"] = 15
-    job.save_meta()
-
-    possible_pairs = len(student_ids)
-    pairs_created = 0
-
-    for ta in allotted:
-        grader_id = int(ta["ta_id"])
-        grader = next((u for u in ta_users if u.id == grader_id), 0)
-        for stu in ta["student_ids"]:
-            recipient = student_users[student_ids.index(stu)]
-            pairs_created += 1
-            job.meta["progress"] = 15 + int(pairs_created / possible_pairs * 85)
-            job.save_meta()
-            try:
-                create_pairing(user, grader, recipient, course, assignment, Pairing.TA)
-            except (errors.PairingToSelf, errors.PairingExists):
-                continue
-        if send_email:
-            send_ta_allocation_email.queue(course_id, assignment_id, grader_id)
+    progress.update(15)
+
+    ta_map = {u.id: u for u in ta_users}
+    student_map = {u.id: u for u in student_users}
+    matches = [
+        (ta_map[int(ta["ta_id"])], student_map[stu])
+        for ta in allotted
+        for stu in ta["student_ids"]
+    ]
+    create_pairings(
+        user,
+        matches,
+        course,
+        assignment,
+        pair_type=Pairing.TA,
+        callback=lambda done, total: progress.track(done, total, 15, 100),
+    )
+    progress.complete()
+
+    if send_email:
+        for ta in allotted:
+            send_ta_allocation_email.queue(course_id, assignment_id, int(ta["ta_id"]))
 
     return {"status": "success", "message": "Students have been allocated to the TAs"}
 
 
-def reassign_ta_pairings(job, course_id, assignment_id, user, allocations, send_email):
+def reassign_ta_pairings(
+    progress, course_id, assignment_id, user, allocations, send_email
+):
     """Function that reassigns the students to the TAs
 
-    :param job: the original job that calls the function
+    :param progress: ProgressReporter of the original job that calls the function
     :param course_id: canvas id of the course
     :param assignment_id: canvas id of the assignment
     :param user: user making the request
@@ -589,8 +579,7 @@ def reassign_ta_pairings(job, course_id, assignment_id, user, allocations, send_
         elif difference < 0:
             shortage[ta] = abs(difference)
 
-    job.meta["progress"] = 15
-    job.save_meta()
+    progress.update(15)
 
     try:
         assert sum(extras.values()) == sum(shortage.values())
@@ -620,32 +609,37 @@ def reassign_ta_pairings(job, course_id, assignment_id, user, allocations, send_
         unallocated_students.append(pair.recipient_id)
         pair.delete()
 
-    job.meta["progress"] = 50
-    job.save_meta()
+    progress.update(50)
 
     canvas = get_canvas_client(user.canvas_access_token)
     course = canvas.get_course(course_id)
     assignment = course.get_assignment(assignment_id)
+    users = User.query.filter(
+        User.id.in_(list(shortage.keys()) + unallocated_students)
+    ).all()
+    user_map = {u.id: u for u in users}
+
     start = 0
-    total_tas = len(shortage)
-    ta_count = 1
+    matches = []
     for ta, required in shortage.items():
         student_ids = unallocated_students[start : start + required]
-        ta_user = User.query.get(ta)
-        for sid in student_ids:
-            student = User.query.get(sid)
-            try:
-                create_pairing(user, ta_user, student, course, assignment, Pairing.TA)
-            except (errors.PairingToSelf, errors.PairingExists):
-                continue
+        matches.extend((user_map[ta], user_map[sid]) for sid in student_ids)
+        start += required
+
+    create_pairings(
+        user,
+        matches,
+        course,
+        assignment,
+        pair_type=Pairing.TA,
+        callback=lambda done, total: progress.track(done, total, 50, 100),
+    )
 
-        if send_email:
+    if send_email:
+        for ta in shortage.keys():
             send_ta_allocation_email.queue(course_id, assignment_id, ta)
-        job.meta["progress"] = 50 + (ta_count / total_tas * 50)
-        job.save_meta()
 
-    job.meta["progress"] = 100
-    job.save_meta()
+    progress.complete()
     return {"status": "success", "message": "Re-allotment of TA tasks is complete."}
 
 
@@ -662,18 +656,17 @@ def replace_task_and_generate_new_pairing(task_id, send_emails):
     task = Task.query.get(task_id)
     if not task:
         return None
-    job = get_current_job()
+    progress = ProgressReporter(get_current_job(), user_id=task.user_id)
     task.status = Task.ARCHIVED
     task.save()
 
-    job.meta["progress"] = 20
-    job.save_meta()
+    progress.update(20)
 
     grader = creator = task.user
     teacher = get_course_teacher(task.course_id)
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(task.course_id)
-    assignment = course.get_assignment(task.assignment_id)
+    course = canvas_cache.get_course(canvas, task.course_id)
+    assignment = canvas_cache.get_assignment(canvas, task.course_id, task.assignment_id)
 
     # pick the user with a valid submission who is receiving the least amount
     # of reviews
@@ -700,8 +693,7 @@ def replace_task_and_generate_new_pairing(task_id, send_emails):
         ):
             break
 
-    job.meta["progress"] = 50
-    job.save_meta()
+    progress.update(50)
 
     if not submission:
         return {"status": "error", "message": "No submissions found"}
@@ -712,8 +704,7 @@ def replace_task_and_generate_new_pairing(task_id, send_emails):
     if send_emails:
         send_pairing_email.queue(pair.id)
 
-    job.meta["progress"] = 100
-    job.save_meta()
+    progress.complete()
     return {
         "status": "success",
         "message": "Task replaced and new pairing created.",
@@ -732,8 +723,9 @@ def get_all_groups(course_id, assignment_id):
     """
     user = get_current_user()
     canvas = get_canvas_client(user.canvas_access_token)
-    course = canvas.get_course(course_id)
-    assignment = course.get_assignment(assignment_id)
+    assignment = canvas_cache.get_assignment(
+        canvas, course_id, assignment_id, scope=user.id
+    )
     group_map = {}
     pair_query = Pairing.query.filter(
         Pairing.course_id == course_id,
@@ -743,11 +735,14 @@ def get_all_groups(course_id, assignment_id):
 
     if assignment.group_category_id and not assignment.intra_group_peer_reviews:
         # prepare a dictionary of group id with the graders
-        group_category = canvas.get_group_category(assignment.group_category_id)
-        groups = group_category.get_groups()
+        groups = canvas_cache.get_groups(
+            canvas, course_id, assignment.group_category_id, scope=user.id
+        )
+        members = canvas_cache.get_groups_users(
+            canvas, course_id, groups, scope=user.id
+        )
         for group in groups:
-            users = group.get_users()
-            group_members = get_db_users(users, False)
+            group_members = get_db_users(members[group.id], False)
             grader_ids = [u.id for u in group_members]
             pairs = pair_query.filter(Pairing.grader_id.in_(grader_ids)).all()
             pair_table = defaultdict(list)
@@ -0,0 +1,111 @@
+import time
+
+from peerfeedback.api.events import JOB_PROGRESS, publish
+
+
+class ProgressReporter(object):
+    """Reports the progress of a Redis Queue job through the job's meta data.
+
+    Every write to the meta data is a round trip to Redis, so the updates are
+    throttled: the meta is saved only when the progress has advanced by at least
+    `step` percent, when `interval` seconds have passed since the last save, or
+    when the message changes. The `progress` and `message` keys are read by the
+    `job_status` view.
+
+    Every save is also pushed as an event to the user who started the job, if
+    one is given, so that the clients don't have to poll the job status.
+
+    When there is no job (e.g. the job function is called from the flask shell)
+    the reporter just keeps track of the values without saving anything.
+
+    :param job: the rq job whose meta has to be updated, usually the value of
+        `rq.get_current_job()`
+    :param step: the minimum change in percentage between two saves
+    :param interval: the maximum no.of seconds an update can be held back
+    :param user_id: OPTIONAL - local id of the user to push the progress to
+    """
+
+    def __init__(self, job, step=5, interval=2.0, user_id=None):
+        self.job = job
+        self.user_id = user_id
+        self.step = step
+        self.interval = interval
+        self.progress = 0
+        self.message = None
+        self._saved_progress = 0
+        self._saved_at = time.monotonic()
+        self._dirty = False
+
+        if job:
+            self.progress = job.meta.get("progress", 0)
+            self.message = job.meta.get("message")
+            self._saved_progress = self.progress
+
+    def update(self, progress=None, message=None, force=False):
+        """Update the progress and/or the message of the job. The values are
+        saved to the job meta only if the throttling limits allow it.
+
+        :param progress: the progress of the job in percentage
+        :param message: a status message describing the current stage
+        :param force: save the values irrespective of the throttling
+        """
+        if progress is not None:
+            progress = min(int(progress), 100)
+            self._dirty = self._dirty or progress != self.progress
+            self.progress = progress
+
+        if message is not None and message != self.message:
+            self.message = message
+            self._dirty = True
+            force = True
+
+        if not self._dirty:
+            return
+
+        now = time.monotonic()
+        if (
+            force
+            or self.progress >= 100
+            or self.progress - self._saved_progress >= self.step
+            or now - self._saved_at >= self.interval
+        ):
+            self.flush()
+
+    def track(self, done, total, start=0, end=100):
+        """Update the progress based on the no.of items processed, scaled to fit
+        the range `start` - `end` of the job's overall progress.
+
+        :param done: no.of items processed
+        :param total: total no.of items to be processed
+        :param start: the progress percentage when no items are processed
+        :param end: the progress percentage when all the items are processed
+        """
+        if total:
+            self.update(start + int(done / total * (end - start)))
+        else:
+            self.update(end)
+
+    def flush(self):
+        """Save the pending progress and message to the job's meta data."""
+        self._dirty = False
+        self._saved_progress = self.progress
+        self._saved_at = time.monotonic()
+        if not self.job:
+            return
+
+        self.job.meta["progress"] = self.progress
+        if self.message is not None:
+            self.job.meta["message"] = self.message
+        self.job.save_meta()
+        publish(
+            self.user_id,
+            JOB_PROGRESS,
+            {"job_id": self.job.id, "progress": self.progress, "message": self.message},
+        )
+
+    def complete(self, message=None):
+        """Mark the job as completed and save the meta immediately.
+
+        :param message: the final status message of the job
+        """
+        self.update(100, message, force=True)
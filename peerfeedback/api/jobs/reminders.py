@@ -0,0 +1,164 @@
+"""Reminder emails for the pending review tasks.
+
+The users and their pending tasks are read with a single query, grouped by the
+user and the assignment. The emails share the body rendered once from the
+`pending_tasks.html` template, with the per-user values filled in by SendGrid
+substitutions, so that up to `MAX_PERSONALIZATIONS` reminders are sent in one
+request.
+"""
+import logging
+from collections import namedtuple
+
+from sendgrid import Email
+from sendgrid.helpers.mail import Content, Mail, Personalization, Substitution
+
+from peerfeedback.api.jobs.sendmail import (
+    HOSTNAME,
+    MAX_PERSONALIZATIONS,
+    SENDER_HOSTNAME,
+    deliver_mail,
+    email_templates,
+)
+from peerfeedback.api.utils import proper_email
+from peerfeedback.extensions import db, rq
+from peerfeedback.models import Task, User
+from peerfeedback.utils import chunked
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATES = (Task.PENDING, Task.IN_PROGRESS)
+
+PendingReminder = namedtuple(
+    "PendingReminder",
+    [
+        "user_id",
+        "name",
+        "username",
+        "email",
+        "course_id",
+        "course_name",
+        "assignment_id",
+        "assignment_name",
+        "pending",
+        "due_date",
+    ],
+)
+
+# Values substituted per email in the shared body
+SUBSTITUTIONS = {
+    "user": "-name-",
+    "pending_count": "-count-",
+    "assignment": "-assignment-",
+    "course": "-course-",
+    "due_date": "-due-",
+    "url": "-url-",
+}
+
+
+def get_pending_reminders(*criteria):
+    """Return the number of pending tasks of every user in each assignment.
+
+    :param criteria: SQLAlchemy filters on the `Task` selecting the tasks
+    :return: list of PendingReminder, one per user and assignment
+    """
+    rows = (
+        db.session.query(
+            User.id,
+            User.name,
+            User.username,
+            User.email,
+            Task.course_id,
+            db.func.max(Task.course_name),
+            Task.assignment_id,
+            db.func.max(Task.assignment_name),
+            db.func.count(Task.id),
+            db.func.min(Task.due_date),
+        )
+        .join(User, User.id == Task.user_id)
+        .filter(Task.status.in_(PENDING_STATES), *criteria)
+        .group_by(User.id, Task.course_id, Task.assignment_id)
+        .order_by(User.id, Task.assignment_id)
+    )
+    return [PendingReminder(*row) for row in rows]
+
+
+def reminder_personalization(reminder):
+    """Build the personalization of the reminder email of a user.
+
+    :param reminder: PendingReminder of the user
+    """
+    personalization = Personalization()
+    personalization.add_to(Email(proper_email(reminder), reminder.name))
+    personalization.subject = "Alert! {0} feedback tasks pending in {1}".format(
+        reminder.pending, reminder.assignment_name
+    )
+    values = {
+        "user": reminder.name,
+        "pending_count": str(reminder.pending),
+        "assignment": reminder.assignment_name,
+        "course": reminder.course_name,
+        "due_date": str(reminder.due_date) if reminder.due_date else "the deadline",
+        "url": "https://{0}/app/course/{1}/assignment/{2}".format(
+            HOSTNAME, reminder.course_id, reminder.assignment_id
+        ),
+    }
+    for field, tag in SUBSTITUTIONS.items():
+        personalization.add_substitution(Substitution(tag, values[field] or ""))
+    return personalization
+
+
+def send_reminders(reminders):
+    """Send the reminder emails in batches of `MAX_PERSONALIZATIONS`.
+
+    :param reminders: list of PendingReminder
+    :return: dict with the no.of emails and requests that succeeded and failed
+    """
+    stats = dict(total=len(reminders), succeeded=0, failed=0, requests=0)
+    if not reminders:
+        return stats
+
+    template = email_templates.get_template("pending_tasks.html")
+    body = template.render(hostname=HOSTNAME, **SUBSTITUTIONS)
+
+    for batch in chunked(reminders, MAX_PERSONALIZATIONS):
+        mail = Mail()
+        mail.from_email = Email("notification@" + SENDER_HOSTNAME, "Peer Feedback")
+        # the subject of the mail is overridden by the personalizations
+        mail.subject = "Feedback tasks pending"
+        for reminder in batch:
+            mail.add_personalization(reminder_personalization(reminder))
+        mail.add_content(Content("text/html", body))
+
+        stats["requests"] += 1
+        if deliver_mail(mail):
+            stats["succeeded"] += len(batch)
+        else:
+            stats["failed"] += len(batch)
+            logger.warning(
+                "Sending %d reminders failed for users #%s",
+                len(batch),
+                ",".join(str(r.user_id) for r in batch),
+            )
+    return stats
+
+
+@rq.job("default", timeout=60 * 15)
+def send_pending_review_reminder(course_id, assignment_id, user_id=None):
+    """Send a reminder email to the complete pending reviews of for an assignment.
+    If the use id is given, the email is only sent to that user. If the user_id
+    is not given, then reminder is sent to all the users who have a pending reviews.
+
+    :param course_id: canvas id of the course
+    :param assignment_id: canvas id of the assignment
+    :param user_id: user id of the grader who has to be notified
+    :return: the sending stats, see `send_reminders`
+    """
+    criteria = [Task.course_id == course_id, Task.assignment_id == assignment_id]
+    if user_id:
+        criteria.append(Task.user_id == user_id)
+
+    stats = send_reminders(get_pending_reminders(*criteria))
+    logger.info(
+        "Sent pending review reminders for assignment #%s: %s", assignment_id, stats
+    )
+    return stats
@@ -1,26 +1,51 @@
 import base64
 import os
+from collections import OrderedDict
 from pathlib import Path
 
 import jinja2
-import sendgrid
+from peerfeedback.api import canvas_cache
+from peerfeedback.api.jobs.outbox import enqueue_mail
 from peerfeedback.api.utils import (fetch_emailable_users, get_canvas_client,
                                     get_course_teacher, proper_email)
 from peerfeedback.extensions import db, rq
 from peerfeedback.models import (Comment, CourseUserMap, Feedback, Pairing,
                                  Task, User, UserSettings)
+from peerfeedback.utils import chunked
 from sendgrid import Email
-from sendgrid.helpers.mail import Content, Mail, Personalization
-from sentry_sdk import capture_exception, capture_message, push_scope
+from sendgrid.helpers.mail import Content, Mail, Personalization, Substitution
+from sentry_sdk import capture_exception, capture_message
 from sqlalchemy.orm import joinedload
 
-sg = sendgrid.SendGridAPIClient(os.environ.get("SENDGRID_API_KEY"))
 HOSTNAME = "peerfeedback.gatech.edu"
 SENDER_HOSTNAME = "peerfeedback.io"
-
-
-def get_email_template(name):
-    return os.path.join(Path(__file__).parents[2], "templates", "email", name)
+# Maximum number of personalizations SendGrid accepts in a single request
+MAX_PERSONALIZATIONS = 1000
+# Maximum size (in bytes) of the substitutions of a personalization
+MAX_SUBSTITUTIONS_SIZE = 10000
+
+
+EMAIL_TEMPLATES_DIR = os.path.join(Path(__file__).parents[2], "templates", "email")
+
+# Environment shared by all the email senders. The compiled templates are kept
+# in memory and the bytecode is cached on disk, so the templates are compiled
+# only once instead of for every email. Autoescaping is off, like for the
+# plain `jinja2.Template`s used before, as the templates render trusted HTML.
+email_templates = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(EMAIL_TEMPLATES_DIR),
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+    auto_reload=False,
+    autoescape=False,
+)
+
+
+def preload_email_templates():
+    """Compile all the email templates. Called when the app is created, so that
+    the RQ workers' work horses, forked for every job, inherit the compiled
+    templates.
+    """
+    for name in email_templates.list_templates():
+        email_templates.get_template(name)
 
 
 @rq.job("default")
@@ -72,31 +97,20 @@ def send_feedback_notification(feedback_id):
             feedback.reviewer.name, feedback.assignment_name, feedback.course_name
         )
 
-    template = get_email_template("new_feedback.html")
-    with open(template) as f:
-        template = jinja2.Template(f.read())
-        content = Content(
-            "text/html",
-            template.render(
-                heading=mail.subject,
-                comment=feedback.value,
-                feedback_url=feedback_url,
-                meta_url=meta_url,
-                hostname=HOSTNAME,
-            ),
-        )
-        mail.add_content(content)
-
-    try:
-        response = sg.send(mail)
-    except Exception as e:
-        capture_exception(e)
-        return
+    template = email_templates.get_template("new_feedback.html")
+    content = Content(
+        "text/html",
+        template.render(
+            heading=mail.subject,
+            comment=feedback.value,
+            feedback_url=feedback_url,
+            meta_url=meta_url,
+            hostname=HOSTNAME,
+        ),
+    )
+    mail.add_content(content)
 
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.")
+    deliver_mail(mail)
 
 
 @rq.job("default")
@@ -167,32 +181,22 @@ def send_discussion_notification(comment_id):
         )
     )
     comment_url = discussion_url + "#comment_{0}".format(comment_id)
-    template = get_email_template("new_comment.html")
-    with open(template) as f:
-        heading = comment.commenter.name + " commented:"
-        template = jinja2.Template(f.read())
-        content = Content(
-            "text/html",
-            template.render(
-                heading=heading,
-                comment=comment.value,
-                comment_url=comment_url,
-                discussion_url=discussion_url,
-                hostname=HOSTNAME,
-            ),
-        )
-        mail.add_content(content)
+    template = email_templates.get_template("new_comment.html")
+    heading = comment.commenter.name + " commented:"
+    content = Content(
+        "text/html",
+        template.render(
+            heading=heading,
+            comment=comment.value,
+            comment_url=comment_url,
+            discussion_url=discussion_url,
+            hostname=HOSTNAME,
+        ),
+    )
+    mail.add_content(content)
 
     if len(to_users):
-        response = sg.send(mail)
-
-        if response.status_code >= 400:
-            capture_message(
-                "Email sending failed. Response code: {0}, Body:"
-                " {1}, Headers: {2}".format(
-                    response.status_code, response.body, response.headers
-                )
-            )
+        deliver_mail(mail)
 
     # Notify the user whose assignment is being commented upon
     if comment.recipient.settings.comment_emails:
@@ -220,89 +224,153 @@ def send_comment_notification(comment, assignment, course, reply_to):
         assignment=assignment, course=course
     )
 
-    template = get_email_template("new_comment.html")
+    template = email_templates.get_template("new_comment.html")
+    heading = comment.commenter.name + " says:"
+    comment_url = discussion_url + "#comment_{0}".format(comment.id)
+    content = Content(
+        "text/html",
+        template.render(
+            heading=heading,
+            comment=comment.value,
+            discussion_url=discussion_url,
+            comment_url=comment_url,
+            hostname=HOSTNAME,
+        ),
+    )
+    mail.add_content(content)
 
-    with open(template) as f:
-        template = jinja2.Template(f.read())
-        heading = comment.commenter.name + " says:"
-        comment_url = discussion_url + "#comment_{0}".format(comment.id)
-        content = Content(
-            "text/html",
-            template.render(
-                heading=heading,
-                comment=comment.value,
-                discussion_url=discussion_url,
-                comment_url=comment_url,
-                hostname=HOSTNAME,
-            ),
-        )
-        mail.add_content(content)
+    deliver_mail(mail)
 
-    try:
-        response = sg.send(mail)
-    except Exception:
-        capture_exception()
-        return
 
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.", response=response)
+def pairing_url(pairing):
+    """Return the URL of the page where the grader reviews the submission."""
+    return "https://{0}/app/feedback/course/{1}/assignment/{2}/user/{3}/".format(
+        HOSTNAME, pairing.course_id, pairing.assignment_id, pairing.recipient_id
+    )
 
 
-@rq.job("default")
-def send_pairing_email(pairing_id):
-    """Sends an email to the grader of the pairing, intimating them that an
-    submission has been assigned to them for evaluation and review.
+def pairing_email_subject(pairings):
+    """Return the subject of the pairing email of a grader.
 
-    :param pairing_id: the pairing whose grader the email is being sent
+    :param pairings: list of the pairings of the grader in an assignment
     """
-    pairing = Pairing.query.options(
-        joinedload(Pairing.recipient),
-        joinedload(Pairing.grader),
-        joinedload(Pairing.task),
-    ).get(pairing_id)
-    if not pairing:
-        return False
+    pairing = pairings[0]
+    if len(pairings) > 1:
+        subject = "Give feedback to {0} submissions".format(len(pairings))
+        if pairing.task:
+            subject += " for " + pairing.task.assignment_name
+        return subject
+    if pairing.type == Pairing.IGR:
+        return f"Give anonymous feedback to {pairing.recipient.name}"
+    return f"Give feedback to {pairing.recipient.name}'s submission"
+
 
+def new_pairing_mail():
     mail = Mail()
-    personalization = Personalization()
-    discussion_url = (
-        "https://{0}/app/feedback/course/{1}/assignment/{2}/user/{3}/".format(
-            HOSTNAME, pairing.course_id, pairing.assignment_id, pairing.recipient_id
-        )
-    )
     mail.from_email = Email("notification@" + SENDER_HOSTNAME, "Peer Feedback")
     mail.reply_to = Email("no-reply@" + SENDER_HOSTNAME, "No Reply")
-    personalization.add_to(Email(proper_email(pairing.grader), pairing.grader.name))
-    mail.subject = f"Give feedback to {pairing.recipient.name}'s submission"
-    if pairing.type == Pairing.IGR:
-        mail.subject = f"Give anonymous feedback to {pairing.recipient.name}"
-    mail.add_personalization(personalization)
-    template_file = get_email_template("new_pairing.html")
-    with open(template_file) as f:
-        template = jinja2.Template(f.read())
-        content = Content(
-            "text/html",
-            template.render(
-                heading=mail.subject,
-                discussion_url=discussion_url,
-                pairing=pairing,
-                hostname=HOSTNAME,
-            ),
-        )
-        mail.add_content(content)
+    return mail
+
+
+def deliver_mail(mail, dedup_key=None):
+    """Add the mail to the outbox, from where it is sent in the background by
+    the dispatcher. See `peerfeedback.api.jobs.outbox`.
 
+    :param mail: sendgrid Mail object
+    :param dedup_key: OPTIONAL - unique key of the mail, see `enqueue_mail`
+    :return: True if the mail was added to the outbox
+    """
     try:
-        response = sg.send(mail)
+        return enqueue_mail(mail, dedup_key)
     except Exception:
         capture_exception()
-        return
+        return False
+
+
+@rq.job("default", timeout=60 * 15)
+def send_pairing_emails(pairing_ids):
+    """Sends one email to every grader of the given pairings, listing all the
+    submissions assigned to them in an assignment.
+
+    The emails share the same body. The subject and the list of the
+    submissions are set per grader through the personalizations, so that up to
+    `MAX_PERSONALIZATIONS` emails are sent with a single SendGrid request.
+
+    :param pairing_ids: ids of the pairings whose graders the emails are sent
+    :return: the number of emails sent
+    """
+    if not pairing_ids:
+        return 0
+
+    pairings = (
+        Pairing.query.filter(Pairing.id.in_(pairing_ids))
+        .options(
+            joinedload(Pairing.recipient),
+            joinedload(Pairing.grader),
+            joinedload(Pairing.task),
+        )
+        .order_by(Pairing.id)
+        .all()
+    )
+    graders = OrderedDict()
+    for pairing in pairings:
+        graders.setdefault((pairing.grader_id, pairing.assignment_id), []).append(
+            pairing
+        )
+
+    layout = email_templates.get_template("new_pairings.html")
+    pairing_list = email_templates.get_template("pairing_list.html")
+    body = layout.render(heading="-heading-", pairings="-pairings-", hostname=HOSTNAME)
+
+    personalizations = []
+    sent = 0
+    for grader_pairings in graders.values():
+        grader = grader_pairings[0].grader
+        subject = pairing_email_subject(grader_pairings)
+        items = pairing_list.render(
+            pairings=[(p, pairing_url(p)) for p in grader_pairings]
+        )
+
+        if len(subject.encode()) + len(items.encode()) > MAX_SUBSTITUTIONS_SIZE:
+            # too large for the shared body, send the grader a mail of their own
+            mail = new_pairing_mail()
+            mail.subject = subject
+            personalization = Personalization()
+            personalization.add_to(Email(proper_email(grader), grader.name))
+            mail.add_personalization(personalization)
+            content = layout.render(heading=subject, pairings=items, hostname=HOSTNAME)
+            mail.add_content(Content("text/html", content))
+            sent += deliver_mail(mail)
+            continue
+
+        personalization = Personalization()
+        personalization.add_to(Email(proper_email(grader), grader.name))
+        personalization.subject = subject
+        personalization.add_substitution(Substitution("-heading-", subject))
+        personalization.add_substitution(Substitution("-pairings-", items))
+        personalizations.append(personalization)
+
+    for batch in chunked(personalizations, MAX_PERSONALIZATIONS):
+        mail = new_pairing_mail()
+        # the subject of the mail is overridden by the personalizations
+        mail.subject = "You have been assigned submissions for peer review"
+        for personalization in batch:
+            mail.add_personalization(personalization)
+        mail.add_content(Content("text/html", body))
+        if deliver_mail(mail):
+            sent += len(batch)
+    return sent
+
+
+@rq.job("default")
+def send_pairing_email(pairing_id):
+    """Sends an email to the grader of the pairing, intimating them that an
+    submission has been assigned to them for evaluation and review. Kept for
+    the single pairings, see `send_pairing_emails`.
 
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.")
+    :param pairing_id: the pairing whose grader the email is being sent
+    """
+    return send_pairing_emails([pairing_id]) > 0
 
 
 @rq.job("default")
@@ -342,33 +410,22 @@ def send_ta_allocation_email(course_id, assignment_id, ta_id):
     mail.subject = "Evaluate submissions for assignment: " + assignment_name
     personalization.add_to(Email(proper_email(ta), ta.name))
     mail.add_personalization(personalization)
-    template_file = get_email_template("ta_allocation.html")
-    with open(template_file) as f:
-        template = jinja2.Template(f.read())
-        content = Content(
-            "text/html",
-            template.render(
-                heading=mail.subject,
-                pairs=pairs,
-                hostname=HOSTNAME,
-                course_id=course_id,
-                assignment_id=assignment_id,
-                course_name=course_name,
-                assignment_name=assignment_name,
-            ),
-        )
-        mail.add_content(content)
-
-    try:
-        response = sg.send(mail)
-    except Exception:
-        capture_exception()
-        return
+    template = email_templates.get_template("ta_allocation.html")
+    content = Content(
+        "text/html",
+        template.render(
+            heading=mail.subject,
+            pairs=pairs,
+            hostname=HOSTNAME,
+            course_id=course_id,
+            assignment_id=assignment_id,
+            course_name=course_name,
+            assignment_name=assignment_name,
+        ),
+    )
+    mail.add_content(content)
 
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.")
+    deliver_mail(mail)
 
 
 def send_redo_rubric_emails(fb):
@@ -400,16 +457,7 @@ Or you can use the link below to submit grades using the new rubric:
 Thank You."""
     mail.add_content(content)
     assert mail.get()
-    try:
-        response = sg.send(mail)
-    except:
-        capture_exception()
-        return
-
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.")
+    deliver_mail(mail)
 
 
 def send_download_email(user, file_url, course_id, assignment_id=None):
@@ -422,8 +470,10 @@ def send_download_email(user, file_url, course_id, assignment_id=None):
     """
     teacher = get_course_teacher(course_id)
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    assignment = course.get_assignment(assignment_id) if assignment_id else None
+    course = canvas_cache.get_course(canvas, course_id)
+    assignment = None
+    if assignment_id:
+        assignment = canvas_cache.get_assignment(canvas, course_id, assignment_id)
 
     mail = Mail()
     mail.from_email = Email("notification@" + SENDER_HOSTNAME, "Peer Feedback")
@@ -434,31 +484,20 @@ def send_download_email(user, file_url, course_id, assignment_id=None):
     if assignment:
         mail.subject = "Your data export for {0} is ready!".format(assignment.name)
     mail.add_personalization(personalization)
-    template_file = get_email_template("download_data.html")
-    with open(template_file, "r") as f:
-        template = jinja2.Template(f.read())
-        content = Content(
-            "text/html",
-            template.render(
-                course=course.name,
-                assignment=assignment,
-                user_name=user.name,
-                download_url=file_url,
-                hostname=HOSTNAME,
-            ),
-        )
-        mail.add_content(content)
-
-    try:
-        response = sg.send(mail)
-    except Exception:
-        capture_exception()
-        return
+    template = email_templates.get_template("download_data.html")
+    content = Content(
+        "text/html",
+        template.render(
+            course=course.name,
+            assignment=assignment,
+            user_name=user.name,
+            download_url=file_url,
+            hostname=HOSTNAME,
+        ),
+    )
+    mail.add_content(content)
 
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.")
+    deliver_mail(mail)
 
 
 @rq.job("low")
@@ -483,16 +522,7 @@ def send_support_email(user_id, subject, message):
     mail.subject = subject
     mail.add_content(Content("text/plain", message))
 
-    try:
-        response = sg.send(mail)
-    except Exception as e:
-        capture_exception(e)
-        return
-
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Support Email Sending failed")
+    deliver_mail(mail)
 
 
 def send_export_request_received_email(user, course_id, assignment_id=None):
@@ -503,10 +533,12 @@ def send_export_request_received_email(user, course_id, assignment_id=None):
     :param assignment_id: Assignment ID
     """
     canvas = get_canvas_client(user.canvas_access_token)
-    course = canvas.get_course(course_id)
+    course = canvas_cache.get_course(canvas, course_id, scope=user.id)
     assignment = None
     if assignment_id:
-        assignment = course.get_assignment(assignment_id)
+        assignment = canvas_cache.get_assignment(
+            canvas, course_id, assignment_id, scope=user.id
+        )
 
     mail = Mail()
     mail.from_email = Email("notification@" + SENDER_HOSTNAME, "Peer Feedback")
@@ -522,93 +554,19 @@ def send_export_request_received_email(user, course_id, assignment_id=None):
         )
 
     mail.add_personalization(personalization)
-    template_file = get_email_template("export_request_received.html")
-    with open(template_file, "r") as f:
-        template = jinja2.Template(f.read())
-        content = Content(
-            "text/html",
-            template.render(
-                course=course.name,
-                user_name=user.name,
-                hostname=HOSTNAME,
-                assignment=assignment,
-            ),
-        )
-        mail.add_content(content)
-
-    try:
-        response = sg.send(mail)
-    except Exception:
-        capture_exception()
-        return
-
-    if response.status_code >= 400:
-        with push_scope() as scope:
-            scope.set_extra("response", response)
-            capture_message("Email sending failed.")
-
-
-@rq.job("low")
-def send_pending_review_reminder(course_id, assignment_id, user_id=None):
-    """Send a reminder email to the complete pending reviews of for an assignment.
-    If the use id is given, the email is only sent to that user. If the user_id
-    is not given, then reminder is sent to all the users who have a pending reviews.
-
-    :param course_id: canvas id of the course
-    :param assignment_id: canvas id of the assignment
-    :param user_id: user id of the grader who has to be notified
-    """
-    if user_id:
-        user_ids = [user_id]
-    else:
-        user_ids = (
-            db.session.query(Task.user_id)
-            .filter(
-                Task.course_id == course_id,
-                Task.assignment_id == assignment_id,
-                Task.status.in_([Task.PENDING, Task.IN_PROGRESS]),
-            )
-            .distinct()
-        )
-
-    users = User.query.filter(User.id.in_(user_ids)).all()
-    if not users:
-        return
-
-    ref_task = Task.query.filter_by(
-        course_id=course_id, assignment_id=assignment_id
-    ).first()
-    for user in users:
-        content = f"""Hi {user.name},
-
-This is a gentle reminder to inform, you still have some reviews pending in
-Assignment: {ref_task.assignment_name}
-Course: {ref_task.course_name}
-
-You can see the pending items under "Your Feedback to other" section in the following page
-https://{HOSTNAME}/app/course/{course_id}/assignment/{assignment_id}
-
-Kindly complete your evaluation in time.
-
-Regards,
-PeerFeedback
-"""
-        mail = Mail(
-            from_email="notification@" + SENDER_HOSTNAME,
-            to_emails=proper_email(user),
-            subject="Reviews pending for assignment " + ref_task.assignment_name,
-            plain_text_content=content,
-        )
-        try:
-            response = sg.send(mail)
-        except:
-            capture_exception()
-            return
+    template = email_templates.get_template("export_request_received.html")
+    content = Content(
+        "text/html",
+        template.render(
+            course=course.name,
+            user_name=user.name,
+            hostname=HOSTNAME,
+            assignment=assignment,
+        ),
+    )
+    mail.add_content(content)
 
-        if response.status_code >= 400:
-            with push_scope() as scope:
-                scope.set_extra("response", response)
-                capture_message("Sending Reminder Emails failed.", "error")
+    deliver_mail(mail)
 
 
 @rq.job("default")
@@ -637,9 +595,7 @@ def send_auto_pairing_notification_to_teachers(course_id, assignment_id):
     ).first()
     subject = "Automatic Pairing complete for " + ref_task.assignment_name
     url = f"https://{HOSTNAME}/app/course/{course_id}/assignment/{assignment_id}/pairing-table"
-    template_file = get_email_template("auto_pairing_complete.html")
-    with open(template_file) as f:
-        template = jinja2.Template(f.read())
+    template = email_templates.get_template("auto_pairing_complete.html")
 
     for user in users:
         content = Content(
@@ -658,13 +614,4 @@ def send_auto_pairing_notification_to_teachers(course_id, assignment_id):
             subject=subject,
         )
         mail.add_content(content)
-        try:
-            response = sg.send(mail)
-        except:
-            capture_exception()
-            continue
-
-        if response.status_code >= 400:
-            with push_scope() as scope:
-                scope.set_extra("response", response)
-                capture_message("Sending pairing Notification failed.", "error")
+        deliver_mail(mail)
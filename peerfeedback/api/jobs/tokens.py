@@ -0,0 +1,112 @@
+"""Background refreshing of the Canvas access tokens.
+
+Canvas tokens are valid for an hour. Instead of refreshing the tokens in the
+middle of a request, the tokens of the active users and the teachers of the
+active courses (whose tokens are used for the course wide operations) are
+refreshed ahead of their expiry by a scheduled job. `ensure_canvas_token` is
+used by the callers that need a valid token. It refreshes the token
+synchronously only when the token can't be used anymore and queues a
+background refresh otherwise.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_
+
+from peerfeedback.extensions import cache, db, rq
+from peerfeedback.models import (
+    AssignmentSettings,
+    CourseUserMap,
+    JWTToken,
+    Pairing,
+    User,
+)
+from peerfeedback.utils import refresh_canvas_token, token_expires_within
+
+logger = logging.getLogger(__name__)
+
+# Tokens expiring within this time are refreshed in the background
+TOKEN_REFRESH_MARGIN = timedelta(minutes=20)
+# Tokens expiring within this time are refreshed before they are used
+TOKEN_MIN_VALIDITY = timedelta(minutes=2)
+# Tokens which expired long ago can't be refreshed anymore, the user has to
+# login again
+TOKEN_MAX_AGE = timedelta(days=30)
+# Courses without new pairings or assignment settings changes for this long are
+# inactive. The tokens of their teachers are refreshed only when they are used.
+ACTIVE_COURSE_PERIOD = timedelta(days=30)
+
+
+@rq.job("high", timeout=60)
+def refresh_user_token(user_id):
+    """Refresh the canvas token of the user if it is about to expire.
+
+    :param user_id: ID of the user
+    """
+    user = User.query.get(user_id)
+    if user and user.canvas_refresh_token:
+        refresh_canvas_token(user, TOKEN_REFRESH_MARGIN)
+
+
+def ensure_canvas_token(user):
+    """Return a usable canvas token of the user.
+
+    The token is refreshed right away only if it has expired or is about to.
+    If it is only nearing its expiry, a background refresh is queued and the
+    current token is returned.
+
+    :param user: User object
+    :return: the canvas access token
+    """
+    if not user.canvas_refresh_token:
+        return user.canvas_access_token
+
+    if token_expires_within(user, TOKEN_MIN_VALIDITY):
+        refresh_canvas_token(user, TOKEN_MIN_VALIDITY)
+    elif token_expires_within(user, TOKEN_REFRESH_MARGIN):
+        # queue only one refresh per user at a time
+        if cache.add(f"canvas-token-refresh-queued:{user.id}", True, timeout=60):
+            refresh_user_token.queue(user.id)
+    return user.canvas_access_token
+
+
+@rq.job("default", timeout=60 * 10)
+def refresh_expiring_tokens():
+    """Refresh the tokens of the active users and the teachers of the active
+    courses before they expire. Scheduled to run more often than
+    `TOKEN_REFRESH_MARGIN`.
+    """
+    now = datetime.now(tz=timezone.utc)
+    active_users = db.session.query(JWTToken.user_identity).filter(
+        JWTToken.expires > datetime.now(), JWTToken.revoked.is_(False)
+    )
+    active_since = now - ACTIVE_COURSE_PERIOD
+    active_courses = (
+        db.session.query(Pairing.course_id)
+        .filter(Pairing.created_on > active_since)
+        .union(
+            db.session.query(AssignmentSettings.course_id).filter(
+                AssignmentSettings.updated_on > active_since
+            )
+        )
+    )
+    teachers = db.session.query(CourseUserMap.user_id).filter(
+        CourseUserMap.role == CourseUserMap.TEACHER,
+        CourseUserMap.course_id.in_(active_courses),
+    )
+    users = User.query.filter(
+        User.canvas_refresh_token.isnot(None),
+        User.canvas_expiration_time < now + TOKEN_REFRESH_MARGIN,
+        User.canvas_expiration_time > now - TOKEN_MAX_AGE,
+        or_(User.username.in_(active_users), User.id.in_(teachers)),
+    ).all()
+
+    refreshed = 0
+    for user in users:
+        try:
+            refresh_canvas_token(user, TOKEN_REFRESH_MARGIN)
+            refreshed += 1
+        except Exception:
+            db.session.rollback()
+            logger.exception("Failed to refresh the canvas token of %s", user)
+    logger.info("Refreshed the canvas tokens of %d/%d users", refreshed, len(users))
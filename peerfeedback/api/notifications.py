@@ -0,0 +1,149 @@
+"""Creation of the notifications.
+
+An event like a comment on a discussion notifies every participant of the
+discussion. Instead of creating and committing the `Notification` rows one at
+a time, `fan_out` builds the rows of all the recipients of the event and adds
+them with a multi-row INSERT in a single transaction. An event is pushed to
+each recipient once the transaction is committed (see `peerfeedback.api.events`),
+so the recipients are never told about notifications which are rolled back.
+
+The number of unread notifications of every user is kept in the application
+`cache` (Redis), so that the frontend can poll it without counting the rows.
+The counter is loaded from the DB when it is missing and dropped when the
+notifications of the user are added or read, to be counted again on the next
+read. The loaded count is only added when the key is missing, so a count made
+before a change never replaces the drop that follows the change.
+"""
+from sqlalchemy import event, func
+
+from peerfeedback.api.events import NOTIFICATION, publish
+from peerfeedback.extensions import cache, db
+from peerfeedback.models import Notification
+from peerfeedback.utils import chunked
+
+# Maximum number of rows added by a single INSERT statement
+BULK_INSERT_SIZE = 500
+CONTEXT_FIELDS = ("course_id", "course_name", "assignment_id", "assignment_name")
+# Fields of the notification sent with the push event
+EVENT_FIELDS = ("item", "item_id", "course_id", "assignment_id")
+# Number of notifications returned per page by the notifications API
+NOTIFICATIONS_PAGE_SIZE = 50
+MAX_NOTIFICATIONS_PAGE_SIZE = 100
+KEY_PREFIX = "notifications-unread"
+# Time (in seconds) for which the unread counters are kept. Bounds the drift of
+# a counter if an adjustment is ever lost.
+UNREAD_TIMEOUT = 60 * 60 * 24
+
+
+def unread_key(user_id):
+    return f"{KEY_PREFIX}:{user_id}"
+
+
+def get_unread_count(user_id):
+    """Return the number of unread notifications of the user.
+
+    :param user_id: local id of the user
+    """
+    key = unread_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = (
+            db.session.query(func.count(Notification.id))
+            .filter(Notification.recipient_id == user_id, Notification.read.is_(False))
+            .scalar()
+        )
+        cache.add(key, count, timeout=UNREAD_TIMEOUT)
+    return max(int(count), 0)
+
+
+def invalidate_unread_count(user_id):
+    """Drop the unread counter of the user after the notifications of the user
+    are added, read or cleared. It is counted from the DB on the next read.
+
+    :param user_id: local id of the user
+    """
+    cache.delete(unread_key(user_id))
+
+
+def context_of(item):
+    """Return the course and assignment fields of the notification from the
+    object the notification is about, like a Comment or a Feedback.
+
+    :param item: object with the course and assignment fields
+    :return: dict of the notification fields
+    """
+    return {field: getattr(item, field) for field in CONTEXT_FIELDS}
+
+
+def build_notifications(item, item_id, recipient_ids, **fields):
+    """Build the notification rows of an event, one per recipient.
+
+    :param item: one of the `Notification.items`
+    :param item_id: id of the feedback/comment/medal of the notification
+    :param recipient_ids: ids of the users receiving the notification. Empty ids
+        and the duplicates are skipped.
+    :param fields: the other columns of the notification, same for all the rows
+    :return: list of dicts of the notification columns
+    """
+    rows = []
+    seen = set()
+    for recipient_id in recipient_ids:
+        if recipient_id is None or recipient_id in seen:
+            continue
+        seen.add(recipient_id)
+        row = dict(fields, item=item, item_id=item_id, recipient_id=recipient_id)
+        row.setdefault("read", False)
+        rows.append(row)
+    return rows
+
+
+def fan_out(item, item_id, recipient_ids, commit=True, **fields):
+    """Create the notifications of an event for all the recipients in one
+    transaction. The recipients are updated when the transaction is committed.
+
+    :param item: one of the `Notification.items`
+    :param item_id: id of the feedback/comment/medal of the notification
+    :param recipient_ids: ids of the users receiving the notification
+    :param commit: OPTIONAL - commit the transaction, set to False to leave the
+        notifications in the open transaction of the caller
+    :param fields: the other columns of the notification, see
+        `build_notifications`
+    :return: the number of notifications created
+    """
+    rows = build_notifications(item, item_id, recipient_ids, **fields)
+    table = Notification.__table__
+    try:
+        for chunk in chunked(rows, BULK_INSERT_SIZE):
+            db.session.execute(table.insert().values(chunk))
+        _pending_notifications(db.session).extend(rows)
+        if commit:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+
+def _pending_notifications(session):
+    return session.info.setdefault("pending_notifications", [])
+
+
+@event.listens_for(db.session, "after_commit")
+def _notify_committed_recipients(session):
+    # the event fires for the savepoints too, wait for the outermost commit
+    if session.transaction.parent is not None:
+        return
+    for row in session.info.pop("pending_notifications", []):
+        if not row["read"]:
+            invalidate_unread_count(row["recipient_id"])
+        publish(
+            row["recipient_id"],
+            NOTIFICATION,
+            {key: row.get(key) for key in EVENT_FIELDS},
+        )
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_rolled_back_notifications(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("pending_notifications", None)
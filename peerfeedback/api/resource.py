@@ -7,12 +7,19 @@ from flask_jwt_extended import jwt_required, get_current_user
 from dateutil.parser import parse as parse_date
 
 from peerfeedback.extensions import db
-from peerfeedback.api import errors
+from peerfeedback.api import canvas_cache, errors
 from peerfeedback.api.jobs.sendmail import (
     send_feedback_notification,
     send_discussion_notification,
 )
 from peerfeedback.api.jobs.notifications import notify_discussion_participants
+from peerfeedback.api.notifications import (
+    MAX_NOTIFICATIONS_PAGE_SIZE,
+    NOTIFICATIONS_PAGE_SIZE,
+    context_of,
+    fan_out,
+    invalidate_unread_count,
+)
 from peerfeedback.api.jobs.medals import (
     award_contributor_medal,
     award_super_commentator,
@@ -124,7 +131,7 @@ class FeedbackResource(Resource):
         if (
             user.id != feedback.reviewer_id
             and user.id != feedback.receiver_id
-            and not user_is_ta_or_teacher(user.id, feedback.course_id)
+            and not user_is_ta_or_teacher(user, feedback.course_id)
         ):
             abort(403)
 
@@ -175,21 +182,16 @@ class FeedbackResource(Resource):
         if json["draft"]:
             return feedback_schema.jsonify(feedback)
 
-        task.update(status=Task.COMPLETE, done_date=datetime.utcnow())
-        notification = Notification.create(
-            item=Notification.FEEDBACK,
-            item_id=feedback.id,
-            course_name=feedback.course_name,
-            course_id=feedback.course_id,
-            assignment_name=feedback.assignment_name,
-            assignment_id=feedback.assignment_id,
+        task.update(status=Task.COMPLETE, done_date=datetime.utcnow(), commit=False)
+        fan_out(
+            Notification.FEEDBACK,
+            feedback.id,
+            [feedback.receiver_id],
             user_id=feedback.receiver_id,
-            notifier_id=user.id,
-            recipient_id=feedback.receiver_id,
+            # the reviewers of the instructor graded rubrics are not revealed
+            notifier_id=None if feedback.type == Feedback.IGR else user.id,
+            **context_of(feedback),
         )
-        if feedback.type == Feedback.IGR:
-            notification.notifier_id = None
-        notification.save()
         award_contributor_medal.queue(feedback.id)
         award_generous_reviewer_medal.queue(user.id)
 
@@ -412,6 +414,7 @@ class AssignSettingsResource(Resource):
             args["feedback_suggestion"] = ""
 
         settings.update(**args)
+        canvas_cache.invalidate_course(settings.course_id)
 
         if deadline_changed:
             update_task_deadline.queue(settings.assignment_id, user.id)
@@ -446,13 +449,28 @@ class NotificationResource(Resource):
         super(NotificationResource, self).__init__()
 
     def get(self):
+        """Return the unread notifications of the user, newest first.
+
+        The notifications are paginated by their id. The `before` query
+        parameter takes the id of the last notification of the previous page.
+        Up to `limit` (default 50, at most 100) notifications are returned.
+        """
         user = get_current_user()
+        before = request.args.get("before", type=int)
+        limit = request.args.get("limit", NOTIFICATIONS_PAGE_SIZE, type=int)
+        limit = min(max(limit, 1), MAX_NOTIFICATIONS_PAGE_SIZE)
+
+        query = Notification.query.filter(
+            Notification.recipient_id == user.id, Notification.read.is_(False)
+        )
+        if before:
+            query = query.filter(Notification.id < before)
         notes = (
-            Notification.query.filter(
-                Notification.recipient_id == user.id, Notification.read.is_(False)
+            query.options(
+                joinedload(Notification.user), joinedload(Notification.notifier)
             )
-            .options(joinedload(Notification.user), joinedload(Notification.notifier))
             .order_by(Notification.id.desc())
+            .limit(limit)
             .all()
         )
         return notification_schema.jsonify(notes, many=True)
@@ -463,7 +481,10 @@ class NotificationResource(Resource):
         if not notification:
             abort(404)
 
+        was_read = bool(notification.read)
         notification.update(**args)
+        if notification.read != was_read:
+            invalidate_unread_count(notification.recipient_id)
         return notification_schema.jsonify(notification)
 
 
@@ -603,18 +624,14 @@ class CommentLikeResource(Resource):
         like.save()
         # Award Medal if possible
         award_super_commentator.queue(args["comment_id"])
-        notification = Notification.create(
-            item=Notification.LIKE,
-            item_id=args["comment_id"],
-            course_id=comment.course_id,
-            course_name=comment.course_name,
-            assignment_id=comment.assignment_id,
-            assignment_name=comment.assignment_name,
+        fan_out(
+            Notification.LIKE,
+            args["comment_id"],
+            [comment.commenter_id],
             user_id=comment.recipient_id,
-            recipient_id=comment.commenter_id,
             notifier_id=user.id,
+            **context_of(comment),
         )
-        notification.save()
 
         return like_schema.dump(like), 201
 
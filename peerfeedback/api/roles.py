@@ -0,0 +1,131 @@
+"""Resolution of the roles of the users in the courses.
+
+Every request to a course endpoint checks the role of the user through
+`allowed_roles` and often again in the view through `user_is_ta_or_teacher`.
+The roles are read from the `CourseUserMap` table once and kept in the
+application `cache` (Redis) for the following requests, and in `flask.g` for
+the rest of the current request.
+
+Any change to a user's mapping drops the cached roles of the user once the
+change is committed. Like the
+Canvas cache, the keys also contain a per-course version so that all the
+cached roles of a course can be dropped at once when the course's users are
+imported again.
+"""
+from uuid import uuid4
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from peerfeedback.extensions import cache, db
+from peerfeedback.models import CourseUserMap
+
+KEY_PREFIX = "roles"
+# Time (in seconds) for which the roles are cached
+ROLES_TIMEOUT = 60 * 30
+
+
+def get_course_version(course_id):
+    """Return the current version of the cached roles of the course.
+
+    :param course_id: canvas id of the course
+    """
+    return cache.get(f"{KEY_PREFIX}:version:{course_id}") or 0
+
+
+def make_key(user_id, course_id):
+    """Build the cache key of the roles of a user in a course."""
+    return f"{KEY_PREFIX}:{get_course_version(course_id)}:{course_id}:{user_id}"
+
+
+def _request_memo():
+    if not has_app_context():
+        return {}
+    if "course_roles" not in g:
+        g.course_roles = {}
+    return g.course_roles
+
+
+def get_roles(user_id, course_id):
+    """Return the roles of the user in the course as recorded in the
+    `CourseUserMap` table.
+
+    :param user_id: local id of the user
+    :param course_id: canvas id of the course
+    :return: list of roles, empty if the user is not mapped to the course
+    """
+    memo = _request_memo()
+    memo_key = (user_id, int(course_id))
+    if memo_key in memo:
+        return memo[memo_key]
+
+    key = make_key(user_id, course_id)
+    roles = cache.get(key)
+    if roles is None:
+        roles = [
+            role
+            for role, in db.session.query(CourseUserMap.role).filter(
+                CourseUserMap.user_id == user_id, CourseUserMap.course_id == course_id
+            )
+        ]
+        cache.set(key, roles, timeout=ROLES_TIMEOUT)
+
+    memo[memo_key] = roles
+    return roles
+
+
+def invalidate_user(user_id, course_id):
+    """Drop the cached roles of a user in a course. Called when the user is
+    mapped to the course.
+
+    :param user_id: local id of the user
+    :param course_id: canvas id of the course
+    """
+    cache.delete(make_key(user_id, course_id))
+    _request_memo().pop((user_id, int(course_id)), None)
+
+
+def invalidate_course(course_id):
+    """Drop the cached roles of all the users of a course. Called when the users
+    of the course are imported.
+
+    :param course_id: canvas id of the course
+    """
+    cache.set(f"{KEY_PREFIX}:version:{course_id}", uuid4().hex, timeout=0)
+    memo = _request_memo()
+    for key in [k for k in memo if k[1] == int(course_id)]:
+        del memo[key]
+
+
+def _pending_changes(session):
+    return session.info.setdefault("changed_course_users", set())
+
+
+@event.listens_for(CourseUserMap, "after_insert")
+@event.listens_for(CourseUserMap, "after_update")
+@event.listens_for(CourseUserMap, "after_delete")
+def _mapping_changed(mapper, connection, target):
+    if target.user_id is None or target.course_id is None:
+        return
+    # the cache is cleared only when the change is committed, so that the
+    # readers don't cache the uncommitted roles in the meantime
+    _request_memo().pop((target.user_id, int(target.course_id)), None)
+    session = object_session(target)
+    if session is not None:
+        _pending_changes(session).add((target.user_id, target.course_id))
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_committed_changes(session):
+    # the event fires for the savepoints too, wait for the outermost commit
+    if session.transaction.parent is not None:
+        return
+    for user_id, course_id in session.info.pop("changed_course_users", set()):
+        invalidate_user(user_id, course_id)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_rolled_back_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("changed_course_users", None)
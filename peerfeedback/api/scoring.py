@@ -0,0 +1,92 @@
+"""Scoring of the rubric grades of feedback.
+
+The grades of a feedback are stored as a list of `{"criteria_id", "level"}`
+items where the level is the position of the selected level in the criteria.
+`RubricScorer` loads the criteria of all the rubrics needed by an export or a
+report in a single query and builds a `(criteria_id, position) -> points`
+table, so that every grade is scored with a dict lookup instead of scanning
+the levels of the criteria.
+"""
+from collections import defaultdict
+
+from peerfeedback.models import RubricCriteria
+
+
+class RubricScorer(object):
+    """Lookup tables of the points of the rubric levels.
+
+    :param criteria: iterable of RubricCriteria objects
+    """
+
+    def __init__(self, criteria):
+        self.points = {}
+        self.criteria = {}
+        self.rubrics = defaultdict(list)
+
+        for c in sorted(criteria, key=lambda c: c.id):
+            self.criteria[c.id] = c
+            self.rubrics[c.rubric_id].append(c)
+            for level in c.levels or []:
+                self.points[(c.id, level["position"])] = level["points"]
+
+    @classmethod
+    def for_rubrics(cls, rubric_ids):
+        """Load the criteria of the given rubrics from the DB.
+
+        :param rubric_ids: iterable of rubric ids, `None` values are ignored
+        :return: RubricScorer
+        """
+        rubric_ids = {r for r in rubric_ids if r}
+        if not rubric_ids:
+            return cls([])
+        return cls(
+            RubricCriteria.query.filter(RubricCriteria.rubric_id.in_(rubric_ids))
+        )
+
+    def criteria_for(self, rubric_id):
+        """Return the criteria of the rubric in the order of creation.
+
+        :param rubric_id: ID of the rubric
+        :return: list of RubricCriteria
+        """
+        return self.rubrics.get(rubric_id, [])
+
+    def level_points(self, criteria_id, level):
+        """Return the points of a level of the criteria.
+
+        :param criteria_id: ID of the criteria
+        :param level: position of the level
+        :return: the points or None when the level is None or not in the criteria
+        """
+        if level is None:
+            return None
+        return self.points.get((criteria_id, level))
+
+    def grade_points(self, grades, rubric_id=None):
+        """Return the points of each of the grades of a feedback.
+
+        Grades whose criteria are not known (like grades saved before the
+        criteria were recreated, or legacy grades without a `criteria_id`) are
+        matched to the criteria of the rubric by their position when the
+        `rubric_id` is given.
+
+        :param grades: list of grades of the feedback
+        :param rubric_id: OPTIONAL - ID of the rubric used by the feedback
+        :return: list of points, with None for the grades without a level
+        """
+        rubric_criteria = self.criteria_for(rubric_id)
+        points = []
+        for i, grade in enumerate(grades):
+            criteria_id = grade.get("criteria_id")
+            if criteria_id not in self.criteria and i < len(rubric_criteria):
+                criteria_id = rubric_criteria[i].id
+            points.append(self.level_points(criteria_id, grade["level"]))
+        return points
+
+    def score(self, grades, rubric_id=None):
+        """Return the total points of the grades of a feedback.
+
+        :param grades: list of grades of the feedback
+        :param rubric_id: OPTIONAL - ID of the rubric used by the feedback
+        """
+        return sum(p for p in self.grade_points(grades, rubric_id) if p is not None)
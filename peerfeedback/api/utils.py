@@ -3,10 +3,13 @@ import dateutil.parser
 import csv
 import io
 import boto3
+import heapq
+import itertools
 import logging
 
+from collections import deque
 from functools import wraps
-from datetime import datetime, timezone, timedelta
+from datetime import timedelta
 from canvasapi import Canvas
 from flask import request, jsonify
 from flask import current_app as app
@@ -14,7 +17,7 @@ from flask import current_app as app
 from flask_jwt_extended import get_current_user, get_jwt_identity, verify_jwt_in_request
 from sqlalchemy.orm import joinedload
 
-from peerfeedback.utils import is_valid_email, update_canvas_token
+from peerfeedback.utils import chunked, is_valid_email
 from peerfeedback.extensions import db
 from peerfeedback.models import (
     User,
@@ -27,11 +30,20 @@ from peerfeedback.models import (
     CourseUserMap,
 )
 from peerfeedback.api import errors
+from peerfeedback.api.canvas_fetch import fetch_all
+from peerfeedback.api.credentials import CredentialPool, track_quota
+from peerfeedback.api.jobs.tokens import ensure_canvas_token
+from peerfeedback.api.roles import get_roles
 
 logger = logging.getLogger(__name__)
 
+# No.of rows inserted by a single multi-row INSERT statement in bulk operations
+BULK_INSERT_SIZE = 500
+# Size of each part of the multipart uploads to S3
+S3_PART_SIZE = 5 * 1024 * 1024
 
-def generate_review_matches(graders, recipients, rounds):
+
+def generate_review_matches(graders, recipients, rounds, seed=None):
     """A generator that provides unique peers for reviewing.
     The generated matches follow the following rules:
         1. The no.of reviews/rounds of review is less than total no.of users.
@@ -40,9 +52,15 @@ def generate_review_matches(graders, recipients, rounds):
         4. Each user will have equal no.of reviews to give
         5. The users may or may not receive equal no.of reviews
 
+    The shuffled recipients are kept in a deque and every grader takes the next
+    `rounds` of them, so that the matching takes O(graders * rounds) time. The
+    matches can be checked with `verify_review_matches`.
+
     :param graders: list of ids for whom the matching is to be done.
     :param recipients: list of ids who have submitted the assignments
     :param rounds: The no.of reviews each student is supposed to receive.
+    :param seed: OPTIONAL - seed of the shuffle, the same seed generates the same
+        matches for the same input
     :yields: a tuple of the format (user_index, [index of peers])
     """
     if rounds >= len(graders) or rounds >= len(recipients):
@@ -51,14 +69,40 @@ def generate_review_matches(graders, recipients, rounds):
             "the total number of students."
         )
 
-    random.shuffle(recipients)
+    recipients = list(recipients)
+    if seed is None:
+        random.shuffle(recipients)
+    else:
+        random.Random(seed).shuffle(recipients)
+    queue = deque(recipients)
 
     for grader in graders:
-        if grader in recipients[:rounds]:
-            recipients.remove(grader)
-            recipients.insert(rounds, grader)
-        yield (grader, recipients[:rounds])
-        recipients = recipients[rounds:] + recipients[:rounds]
+        peers = [queue.popleft() for _ in range(rounds)]
+        if grader in peers:
+            # skip the grader's own submission, it is reviewed by the next grader
+            peers.remove(grader)
+            peers.append(queue.popleft())
+            queue.appendleft(grader)
+        yield (grader, peers)
+        queue.extend(peers)
+
+
+def verify_review_matches(matches, rounds):
+    """Check that the matches follow the rules of `generate_review_matches`.
+
+    :param matches: list of (grader, [peers]) tuples
+    :param rounds: the no.of peers each grader should have
+    :raises ValueError: if any of the rules is broken
+    """
+    for grader, peers in matches:
+        if grader in peers:
+            raise ValueError(f"Grader {grader} is reviewing their own submission.")
+        if len(set(peers)) != len(peers):
+            raise ValueError(f"Grader {grader} is assigned a peer more than once.")
+        if len(peers) != rounds:
+            raise ValueError(
+                f"Grader {grader} has {len(peers)} peers instead of {rounds}."
+            )
 
 
 def create_user(canvas_user, save=True):
@@ -227,14 +271,7 @@ def create_pairing(
         pairing.pseudo_name = pseudo_name
     pairing.save()
 
-    due_date = None
-    if assignment.due_at:
-        if settings.deadline_format == "canvas" and settings.feedback_deadline:
-            due_date = dateutil.parser.parse(assignment.due_at) + timedelta(
-                days=settings.feedback_deadline
-            )
-        elif settings.deadline_format == "custom" and settings.custom_deadline:
-            due_date = settings.custom_deadline
+    due_date = get_task_due_date(settings, assignment)
 
     task = Task.create(
         status=Task.PENDING,
@@ -269,30 +306,200 @@ def create_pairing(
     return pairing
 
 
+def get_task_due_date(settings, assignment):
+    """Calculate the due date of the review tasks of an assignment.
+
+    :param settings: AssignmentSettings object of the assignment
+    :param assignment: the canvas assignment object
+    :return: datetime of the due date or None if no deadline applies
+    """
+    if not assignment.due_at:
+        return None
+    if settings.deadline_format == "canvas" and settings.feedback_deadline:
+        return dateutil.parser.parse(assignment.due_at) + timedelta(
+            days=settings.feedback_deadline
+        )
+    if settings.deadline_format == "custom" and settings.custom_deadline:
+        return settings.custom_deadline
+    return None
+
+
+def create_pairings(
+    creator,
+    matches,
+    course,
+    assignment,
+    pair_type=Pairing.STUDENT,
+    study=None,
+    pseudo_names=None,
+    callback=None,
+):
+    """Bulk version of `create_pairing`. Creates the Pairing, Task and Feedback
+    rows for all the given matches using a handful of multi-row INSERT
+    statements in a single transaction.
+
+    Unlike `create_pairing`, the matches which pair a user to self or which
+    already exist are skipped instead of raising an error.
+
+    :param creator: User object of the person creating the pairings
+    :param matches: iterable of (grader, recipient) tuples of User objects
+    :param course: the canvas Course object
+    :param assignment: the canvas assignment object
+    :param pair_type: the type of the pairings, refer Pairing model for types
+    :param study: an object of model Study
+    :param pseudo_names: dict of (grader_id, recipient_id) -> pseudo name for
+        the pairs which are a part of the study
+    :param callback: function called as `callback(done, total)` after every
+        batch of pairings is written, used for reporting the progress
+    :return: list of ids of the created pairings
+    """
+    settings = AssignmentSettings.query.filter_by(assignment_id=assignment.id).first()
+    if not settings:
+        raise errors.CourseNotSetup()
+
+    matches = list(matches)
+    if not matches:
+        return []
+
+    pseudo_names = pseudo_names or {}
+    grader_ids = {grader.id for grader, _ in matches}
+    existing = set(
+        db.session.query(Pairing.grader_id, Pairing.recipient_id).filter(
+            Pairing.course_id == course.id,
+            Pairing.assignment_id == assignment.id,
+            Pairing.grader_id.in_(grader_ids),
+            Pairing.archived.is_(False),
+            Pairing.view_only.is_(False),
+        )
+    )
+
+    pairing_rows = []
+    for grader, recipient in matches:
+        key = (grader.id, recipient.id)
+        if grader.id == recipient.id or grader.canvas_id == recipient.canvas_id:
+            logger.warning("Skipping pairing user %d to self", grader.id)
+            continue
+        if key in existing:
+            logger.warning("Grader %d and Recipient %d are already paired", *key)
+            continue
+        existing.add(key)
+
+        pseudo_name = pseudo_names.get(key) if study else None
+        pairing_rows.append(
+            dict(
+                type=pair_type,
+                course_id=course.id,
+                assignment_id=assignment.id,
+                grader_id=grader.id,
+                recipient_id=recipient.id,
+                creator_id=creator.id,
+                archived=False,
+                view_only=False,
+                study_id=study.id if pseudo_name else None,
+                pseudo_name=pseudo_name,
+            )
+        )
+
+    if not pairing_rows:
+        return []
+
+    due_date = get_task_due_date(settings, assignment)
+    pairing_table = Pairing.__table__
+    pairing_ids = {}
+    total = len(pairing_rows)
+    done = 0
+    try:
+        for rows in chunked(pairing_rows, BULK_INSERT_SIZE):
+            result = db.session.execute(
+                pairing_table.insert()
+                .values(rows)
+                .returning(
+                    pairing_table.c.id,
+                    pairing_table.c.grader_id,
+                    pairing_table.c.recipient_id,
+                )
+            )
+            pairing_ids.update(((g_id, r_id), p_id) for p_id, g_id, r_id in result)
+            done += len(rows)
+            if callback:
+                # pairings are a third of the rows written
+                callback(done // 3, total)
+
+        task_rows = []
+        feedback_rows = []
+        for row in pairing_rows:
+            pairing_id = pairing_ids[(row["grader_id"], row["recipient_id"])]
+            task_rows.append(
+                dict(
+                    status=Task.PENDING,
+                    course_id=course.id,
+                    course_name=course.name,
+                    assignment_id=assignment.id,
+                    assignment_name=assignment.name,
+                    user_id=row["grader_id"],
+                    pairing_id=pairing_id,
+                    due_date=due_date,
+                    view_only=False,
+                )
+            )
+            feedback_rows.append(
+                dict(
+                    type=pair_type,
+                    draft=True,
+                    assignment_name=assignment.name,
+                    assignment_id=assignment.id,
+                    course_name=course.name,
+                    course_id=course.id,
+                    read_time=0,
+                    write_time=0,
+                    grades=[],
+                    receiver_id=row["recipient_id"],
+                    reviewer_id=row["grader_id"],
+                    pairing_id=pairing_id,
+                    rubric_id=settings.rubric_id,
+                )
+            )
+
+        for rows in chunked(task_rows, BULK_INSERT_SIZE):
+            db.session.execute(Task.__table__.insert().values(rows))
+            done += len(rows)
+            if callback:
+                callback(done // 3, total)
+        for rows in chunked(feedback_rows, BULK_INSERT_SIZE):
+            db.session.execute(Feedback.__table__.insert().values(rows))
+            done += len(rows)
+            if callback:
+                callback(done // 3, total)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return [pairing_ids[(r["grader_id"], r["recipient_id"])] for r in pairing_rows]
+
+
 def emails_are_not_valid(all_emails):
     return False in [is_valid_email(email) for email in all_emails]
 
 
-def get_course_teacher(course_id):
-    """Function that finds the teacher in the DB for the given course so that
+def get_course_teacher(course_id, primary=False):
+    """Function that finds a staff member in the DB for the given course so that
     things like fetching the submissions can be done for other users.
 
+    The staff member whose Canvas token has the most rate limit quota left is
+    picked, so that the Canvas calls are spread across the course staff.
+
     :param course_id: canvas course id
+    :param primary: OPTIONAL - return the first teacher of the course instead,
+        for operations that should always be run as the same teacher
     :return: teacher object of class `peerfeedback.users.models.User` or None
         if no teacher associated with a particular course is found
     """
-    teacher_maps = (
-        CourseUserMap.query.filter(CourseUserMap.course_id == course_id)
-            .filter(CourseUserMap.role == CourseUserMap.TEACHER)
-            .all()
-    )
-    teacher = next(
-        (t.user for t in teacher_maps if t.user.canvas_expiration_time), None
-    )
+    pool = CredentialPool(course_id)
+    teacher = pool.primary() if primary else pool.least_loaded()
 
-    twenty_minutes_forward = datetime.now(tz=timezone.utc) + timedelta(minutes=20)
-    if teacher and twenty_minutes_forward > teacher.canvas_expiration_time:
-        update_canvas_token(teacher)
+    if teacher:
+        ensure_canvas_token(teacher)
 
     return teacher
 
@@ -302,7 +509,9 @@ def get_canvas_client(canvas_token=None):
         user = get_current_user()
         canvas_token = user.canvas_access_token
 
-    return Canvas(app.config.get("CANVAS_API_URL"), canvas_token)
+    canvas = Canvas(app.config.get("CANVAS_API_URL"), canvas_token)
+    track_quota(canvas, canvas_token)
+    return canvas
 
 
 def post_reply_to_comment(old_id, user_email, content):
@@ -403,6 +612,80 @@ def get_db_users(users, create_missing):
     return existing + new_users
 
 
+def is_valid_submission(submission):
+    """Check if a canvas submission has actual work that could be reviewed. A
+    submission is considered empty when it is not submitted or when it has been
+    graded with a score of zero.
+
+    :param submission: the canvas Submission object
+    :return: boolean
+    """
+    if submission is None or submission.workflow_state == "unsubmitted":
+        return False
+    return not (
+        submission.workflow_state == "graded"
+        and submission.score is not None
+        and int(submission.score) == 0
+    )
+
+
+class SubmissionIndex(object):
+    """The submissions of an assignment indexed by the canvas id of the user.
+    The paginated submissions are fetched from Canvas exactly once, so that the
+    lookups during pairing don't have to iterate through the list every time.
+    """
+
+    def __init__(self, submissions):
+        self.submissions = {}
+        for submission in submissions:
+            self.submissions[submission.user_id] = submission
+
+    @classmethod
+    def for_assignment(cls, assignment):
+        """Fetch the submissions of the assignment and build the index.
+
+        :param assignment: the canvas Assignment object
+        :return: SubmissionIndex of the assignment's submissions
+        """
+        return cls(fetch_all(assignment.get_submissions()))
+
+    def __len__(self):
+        return len(self.submissions)
+
+    def __iter__(self):
+        return iter(self.submissions.values())
+
+    def __contains__(self, canvas_id):
+        return canvas_id in self.submissions
+
+    def get(self, canvas_id):
+        """Return the submission of the user or None when there isn't one.
+
+        :param canvas_id: canvas id of the user
+        """
+        return self.submissions.get(canvas_id)
+
+    def user_ids(self, predicate=None):
+        """Return the canvas ids of the users whose submissions satisfy the
+        predicate, or all the users when no predicate is given.
+
+        :param predicate: function that takes a submission and returns a bool
+        :return: list of canvas user ids
+        """
+        return [
+            user_id
+            for user_id, submission in self.submissions.items()
+            if predicate is None or predicate(submission)
+        ]
+
+    def has_valid_submission(self, canvas_id):
+        """Check if the user has submitted some work that can be reviewed.
+
+        :param canvas_id: canvas id of the user
+        """
+        return is_valid_submission(self.submissions.get(canvas_id))
+
+
 def fetch_emailable_users(user_ids, email_type):
     """Return a list of email-able users based on their preferences
 
@@ -444,11 +727,8 @@ def user_is_ta_or_teacher(user, course_id, course=None):
     :param course: course object of the CanvasAPI obtained using the canvas client
     :return: true to specify if the user is either TA or teacher
     """
-    maps = CourseUserMap.query.filter(
-        CourseUserMap.user_id == user.id, CourseUserMap.course_id == course_id
-    ).all()
-    if maps:
-        roles = [m.role for m in maps]
+    roles = get_roles(user.id, course_id)
+    if roles:
         return CourseUserMap.TEACHER in roles or CourseUserMap.TA in roles
 
     # If nothing is found in the mapping, then use the Canvas API
@@ -492,16 +772,13 @@ def allowed_roles(*args):
                 "course_id"
             )
             identity = get_jwt_identity()
-            course_map = CourseUserMap.query.filter(
-                CourseUserMap.course_id == course_id,
-                CourseUserMap.user_id == identity["id"],
-            ).first()
+            roles = get_roles(identity["id"], course_id)
 
-            if not course_map:
+            if not roles:
                 msg = errors.COURSE_NOT_SETUP + " or " + errors.NOT_ENROLLED
                 return jsonify(dict(message=msg)), 400
 
-            if course_map.role not in acceptable_roles:
+            if not any(role in acceptable_roles for role in roles):
                 return jsonify(dict(message=errors.NOT_AUTHORISED)), 403
             return fn(*args, **kwargs)
 
@@ -510,36 +787,88 @@ def allowed_roles(*args):
     return decorator
 
 
-def make_csv(rows, heading):
+def iter_csv(rows, heading):
+    """Write the rows as CSV one at a time and yield the CSV text, so that the
+    whole file is never held in the memory.
+
+    :param rows: iterable of rows, each row being a list of values
+    :param heading: list of column names
+    :yields: CSV formatted text for each row
+    """
     si = io.StringIO()
     cw = csv.writer(si)
-    cw.writerow(heading)
-    cw.writerows(rows)
-    return si
+    for row in itertools.chain([heading], rows):
+        cw.writerow(row)
+        yield si.getvalue()
+        si.seek(0)
+        si.truncate(0)
 
 
-def upload_file_to_s3(file_obj, name):
-    s3 = boto3.client(
+def get_s3_client():
+    return boto3.client(
         "s3",
         aws_access_key_id=app.config.get("S3_KEY"),
         aws_secret_access_key=app.config.get("S3_SECRET"),
     )
 
+
+def upload_stream_to_s3(chunks, name, part_size=S3_PART_SIZE):
+    """Upload the text generated by `chunks` to S3 using a multipart upload.
+    The text is encoded and sent in parts of `part_size` bytes as it is
+    generated. The upload is aborted if anything fails midway, so no incomplete
+    parts are left behind in the bucket.
+
+    :param chunks: iterable of strings, like the one returned by `iter_csv`
+    :param name: the key of the file in the S3 bucket
+    :param part_size: size of each part in bytes. S3 requires at least 5MB for
+        all the parts except the last one.
+    :return: a presigned url to download the uploaded file
+    """
+    s3 = get_s3_client()
     bucket_name = app.config.get("S3_BUCKET")
 
-    s3.put_object(
-        Bucket=bucket_name,
-        Key=name,
-        Body=file_obj.getvalue(),
-        ContentType="application/csv",
+    upload = s3.create_multipart_upload(
+        Bucket=bucket_name, Key=name, ContentType="application/csv"
     )
+    upload_id = upload["UploadId"]
+    parts = []
+
+    def upload_part(body):
+        number = len(parts) + 1
+        response = s3.upload_part(
+            Bucket=bucket_name,
+            Key=name,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=body,
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+    try:
+        buffer = io.BytesIO()
+        for chunk in chunks:
+            buffer.write(chunk.encode("utf-8"))
+            if buffer.tell() >= part_size:
+                upload_part(buffer.getvalue())
+                buffer = io.BytesIO()
+        if buffer.tell() or not parts:
+            upload_part(buffer.getvalue())
+
+        s3.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=name,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        logger.exception("Upload of %s to S3 failed. Aborting.", name)
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=name, UploadId=upload_id)
+        raise
 
-    url = s3.generate_presigned_url(
+    return s3.generate_presigned_url(
         ClientMethod="get_object", Params={"Bucket": bucket_name, "Key": name}
     )
 
-    return url
-
 
 def proper_email(user):
     """Checks the email field of the user and returns a usable email for the
@@ -586,22 +915,115 @@ def required_params(*args):
     return decorator
 
 
-def generate_non_group_pairs(groups, recipients, rounds):
+class PairingHistory(object):
+    """The no.of times each grader has reviewed each recipient on the earlier
+    assignments of a course, loaded with a single query over the pairings.
+    """
+
+    def __init__(self, pair_counts):
+        self.pair_counts = pair_counts
+
+    @classmethod
+    def for_course(cls, course_id, exclude_assignment_id=None):
+        """Load the pairing history of the course.
+
+        :param course_id: canvas id of the course
+        :param exclude_assignment_id: OPTIONAL - canvas id of the assignment
+            whose pairings are to be left out, usually the one being paired
+        :return: PairingHistory of the course
+        """
+        query = db.session.query(
+            Pairing.grader_id, Pairing.recipient_id, db.func.count(Pairing.id)
+        ).filter(Pairing.course_id == course_id, Pairing.archived.is_(False))
+        if exclude_assignment_id:
+            query = query.filter(Pairing.assignment_id != exclude_assignment_id)
+        rows = query.group_by(Pairing.grader_id, Pairing.recipient_id)
+        return cls({(grader, recipient): count for grader, recipient, count in rows})
+
+    def __len__(self):
+        return len(self.pair_counts)
+
+    def count(self, grader_id, recipient_id):
+        """Return the no.of times the grader has reviewed the recipient.
+
+        :param grader_id: local id of the grader
+        :param recipient_id: local id of the recipient
+        """
+        return self.pair_counts.get((grader_id, recipient_id), 0)
+
+
+def reduce_repeated_pairs(matches, history, group_of=None):
+    """Swap the peers between the graders so that fewer graders review someone
+    they have reviewed before. A swap exchanges one peer each between two
+    graders, so the no.of reviews given and received by every user is
+    unchanged, and it follows the rules of `generate_review_matches`.
+
+    :param matches: dictionary of graders and their peers, updated in place
+    :param history: PairingHistory of the course
+    :param group_of: OPTIONAL - dictionary of the users and their group ids,
+        the graders are not given a peer from their own group
+    :return: no.of repeated pairs left in the matches
+    """
+    group_of = group_of or {}
+
+    def can_review(grader, peer):
+        return (
+            peer != grader
+            and peer not in matches[grader]
+            and not history.count(grader, peer)
+            and (grader not in group_of or group_of.get(peer) != group_of[grader])
+        )
+
+    graders = list(matches)
+    repeated = 0
+    for position, grader in enumerate(graders):
+        for peer in [p for p in matches[grader] if history.count(grader, p)]:
+            # look for a partner among the graders after this one first, so
+            # that the swaps are spread across the course
+            partners = graders[position + 1 :] + graders[:position]
+            swap = next(
+                (
+                    (other, other_peer)
+                    for other in partners
+                    for other_peer in matches[other]
+                    if can_review(grader, other_peer) and can_review(other, peer)
+                ),
+                None,
+            )
+            if swap is None:
+                repeated += 1
+                continue
+            other, other_peer = swap
+            peers = matches[grader]
+            peers[peers.index(peer)] = other_peer
+            other_peers = matches[other]
+            other_peers[other_peers.index(other_peer)] = peer
+
+    return repeated
+
+
+def generate_non_group_pairs(groups, recipients, rounds, seed=None):
     """Algorithm to create pairing without any student getting paired with
     another student from the same group. This algorithm follows all the rules
     of `generate_review_matches` with an extra rule:
         - A student cannot be paired to another student from the same group
 
+    The recipients are kept in a min-heap keyed by the no.of reviews they have
+    received, with a random tiebreak, and every grader is assigned the least
+    reviewed recipients outside their group. The groups are paired in a single
+    pass, followed by `cover_unassessed_recipients` for the rare recipients who
+    are left without a reviewer.
+
     :param groups: a dictionary of group ids as keys and a list of grader ids
         as values
     :param recipients: a list of user IDs who are to be assigned as peers to
         the graders
     :param rounds: the no.of peers a grader should be assigned for review
+    :param seed: OPTIONAL - seed of the tiebreaks, the same seed generates the
+        same pairs for the same input
     :returns: a dictionary of graders and a list of peers who are assigned to
         them
     """
-    # Create a map of how many times a user is assessed. This will help in
-    # prioritising those who receive least amount of reviews to be picked first
     if not groups:
         logger.error("Cannot generate Group based pairs. Groups empty.")
         raise Exception(
@@ -613,44 +1035,100 @@ def generate_non_group_pairs(groups, recipients, rounds):
         logger.error("Cannot generate group based pairs. Recipients empty.")
         raise Exception("There are no recipients to pair.")
 
+    rand = random.Random(seed)
+    # user -> group lookup table
+    group_of = {user: gid for gid in groups for user in groups[gid]}
     assessed = {user: 0 for user in recipients}
     pairing = {user: [] for gid in groups for user in groups[gid]}
+    heap = [(0, rand.random(), user) for user in assessed]
+    heapq.heapify(heap)
+
+    # The graders of the bigger groups have the fewest recipients to choose
+    # from, so they are paired first, while everyone is still unreviewed.
+    for gid in sorted(groups, key=lambda g: len(groups[g]), reverse=True):
+        members = set(groups[gid])
+        if len(assessed) - len(members.intersection(assessed)) < rounds:
+            raise ValueError(
+                "No. of reviews cannot be greater than the number of students "
+                "outside the group {0}.".format(gid)
+            )
 
-    # The actual algorithm involves a factor of randomness for shuffling the
-    # students so that Group A doesn't get matched to Group B directly. This
-    # randomness also results in some student being left out without any reviews
-    # under rare conditions. This while loop ensures that everyone is assessed
-    while not all(assessed.values()):
-        group_list = [gid for gid in groups]
-        # user -> group lookup table
-        group_of = {user: gid for gid in groups for user in groups[gid]}
-        # Keep track of how many students have been selected from the group
-        chosen_from_group = {gid: 0 for gid in groups}
-        assessed = {user: 0 for user in recipients}
-
-        # The actual pairing logic. Move group by group, assigning pairs to
-        # each student in the group.
-        while len(group_list):
-            # By choosing the groups who are reviewed the least and assigning them
-            # reviewers first, we increase the chance of this group being picked in
-            # the next round
-            group_list.sort(key=lambda g: chosen_from_group[g])
-            current_group = group_list.pop(0)
-            graders = groups[current_group]
-            available = [s for s in recipients if s not in graders]
-            for grader in graders:
-                # sort the available students such that the ones who aren't
-                # reviewed gets preferred. In case the reviews are the same,
-                # then just randomize their position.
-                available.sort(key=lambda s: (assessed[s], random.randint(1, 10)))
-                peers = available[:rounds]
-                pairing[grader] = peers
-                for peer in peers:
-                    chosen_from_group[group_of[peer]] += 1
-                    assessed[peer] += 1
+        # recipients of the group, held out of the heap while it is paired
+        held = []
+        for grader in groups[gid]:
+            peers = []
+            while len(peers) < rounds:
+                entry = heapq.heappop(heap)
+                if entry[2] in members:
+                    held.append(entry)
+                else:
+                    peers.append(entry[2])
+            for peer in peers:
+                assessed[peer] += 1
+                heapq.heappush(heap, (assessed[peer], rand.random(), peer))
+            pairing[grader] = peers
+
+        for entry in held:
+            heapq.heappush(heap, entry)
+
+    cover_unassessed_recipients(pairing, group_of, assessed)
     return pairing
 
 
+def cover_unassessed_recipients(pairing, group_of, assessed):
+    """Assign a reviewer to the recipients who haven't got any.
+
+    For every such recipient, a chain of graders is searched in which each
+    grader hands over one of their peers to the next one, ending at a peer who
+    has more than one reviewer. Shifting the reviews along the chain gives the
+    recipient a reviewer without changing the no.of peers of any grader.
+
+    :param pairing: dictionary of graders and their peers, updated in place
+    :param group_of: dictionary of the users and their group ids
+    :param assessed: dictionary of the recipients and their no.of reviews,
+        updated in place
+    :return: list of the recipients who couldn't be assigned a reviewer
+    """
+    uncovered = []
+    for recipient in [r for r, count in assessed.items() if count == 0]:
+        # peer -> (the recipient it is replaced with, grader reviewing it)
+        parents = {recipient: None}
+        queue = deque([recipient])
+        found = None
+        while queue and found is None:
+            current = queue.popleft()
+            for grader, peers in pairing.items():
+                if group_of[grader] == group_of.get(current) or current in peers:
+                    continue
+                for peer in peers:
+                    if peer in parents:
+                        continue
+                    parents[peer] = (current, grader)
+                    if assessed[peer] > 1:
+                        found = peer
+                        break
+                    queue.append(peer)
+                if found is not None:
+                    break
+
+        if found is None:
+            uncovered.append(recipient)
+            continue
+
+        assessed[found] -= 1
+        assessed[recipient] += 1
+        peer = found
+        while parents[peer] is not None:
+            current, grader = parents[peer]
+            peers = pairing[grader]
+            peers[peers.index(peer)] = current
+            peer = current
+
+    if uncovered:
+        logger.warning("No reviewer available for %d recipients", len(uncovered))
+    return uncovered
+
+
 def validate_csv_input(course_id, pairs, grader_type):
     """Validates the input for the CSV pairing
 
@@ -48,5 +48,6 @@ from .exports import *
 from .email import *
 from .task import *
 from .jobs import *
+from .events import *
 from .ml import *
 from .analytics import *
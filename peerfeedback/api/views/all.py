@@ -19,8 +19,14 @@ from peerfeedback.models import (
     Study,
 )
 from peerfeedback.extensions import db, cache
-from peerfeedback.api.utils import get_canvas_client, get_course_teacher, allowed_roles
-from peerfeedback.api import errors
+from peerfeedback.api.utils import (
+    get_canvas_client,
+    get_course_teacher,
+    allowed_roles,
+    SubmissionIndex,
+)
+from peerfeedback.api import canvas_cache, errors
+from peerfeedback.api.notifications import get_unread_count, invalidate_unread_count
 from peerfeedback.api.schemas import medal_schema, user_schema
 
 
@@ -32,16 +38,14 @@ def get_submissions_users(course_id, assignment_id):
         raise errors.TeacherNotFoundException("Course teacher not found")
 
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    assignment = course.get_assignment(assignment_id)
-    submissions = assignment.get_submissions()
-    ids = [
-        s.user_id
-        for s in submissions
-        if s.workflow_state == "submitted"
+    submissions = SubmissionIndex(
+        canvas_cache.get_submissions(canvas, course_id, assignment_id)
+    )
+    ids = submissions.user_ids(
+        lambda s: s.workflow_state == "submitted"
         or (s.workflow_state == "graded" and s.score != None and int(s.score) != 0)
         and not s.missing
-    ]
+    )
     users = User.query.filter(User.canvas_id.in_(ids)).all()
 
     return users
@@ -165,4 +169,13 @@ def clear_notifications():
         dict(read=True)
     )
     db.session.commit()
+    invalidate_unread_count(user.id)
     return "OK"
+
+
+@api_blueprint.route("/notifications/unread_count/")
+@jwt_required
+def unread_notifications_count():
+    """Return the number of unread notifications of the user"""
+    user = get_current_user()
+    return jsonify(unread=get_unread_count(user.id))
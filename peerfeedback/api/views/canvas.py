@@ -5,7 +5,7 @@ from flask_jwt_extended import jwt_required, get_current_user
 from sqlalchemy import text
 from sqlalchemy.orm import joinedload
 
-from peerfeedback.api import errors
+from peerfeedback.api import canvas_cache, errors, roles
 from peerfeedback.api.jobs.course import import_course_information
 from peerfeedback.api.schemas import real_user_schema, user_schema
 from peerfeedback.api.schemas import CourseSchema, AssignmentSchema, SubmissionSchema
@@ -76,8 +76,7 @@ def get_assignments(course_id):
         return jsonify({"message": errors.NOT_ENROLLED}), 400
 
     canvas = get_canvas_client(user.canvas_access_token)
-    course = canvas.get_course(course_id)
-    assignments = course.get_assignments()
+    assignments = canvas_cache.get_assignments(canvas, course_id, scope=user.id)
     if teacher_or_ta:
         settings = AssignmentSettings.query.filter(
             AssignmentSettings.assignment_id.in_([a.id for a in assignments])
@@ -167,9 +166,12 @@ def get_students(course_id):
     """
     teacher = get_course_teacher(course_id)
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    students = course.get_users(
-        include=["email"], enrollment_type=["student"], enrollment_state=["active"]
+    students = canvas_cache.get_users(
+        canvas,
+        course_id,
+        include=["email"],
+        enrollment_type=["student"],
+        enrollment_state=["active"],
     )
     student_list = [
         dict(name=s.name, email=getattr(s, "email", ""), id=s.id, user_id=s.login_id)
@@ -188,9 +190,12 @@ def get_tas(course_id):
     """
     teacher = get_course_teacher(course_id)
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    tas = course.get_users(
-        include=["email"], enrollment_type=["ta"], enrollment_state=["active"]
+    tas = canvas_cache.get_users(
+        canvas,
+        course_id,
+        include=["email"],
+        enrollment_type=["ta"],
+        enrollment_state=["active"],
     )
     ta_list = [
         dict(
@@ -222,8 +227,7 @@ def get_paired_tas(course_id, assignment_id):
         return jsonify({"message": errors.CANNOT_FIND_TEACHER}), 503
 
     canvas = get_canvas_client(teacher.canvas_access_token)
-    course = canvas.get_course(course_id)
-    tas = course.get_users(enrollment_type=["ta"])
+    tas = canvas_cache.get_users(canvas, course_id, enrollment_type=["ta"])
     ta_users = get_db_users(tas, create_missing=True)
     tasks = (
         db.session.query(Task.user_id, Task.status)
@@ -291,8 +295,8 @@ def get_submission(course_id, assignment_id, user_id):
 
     pairing = (
         Pairing.query.filter(
-            Pairing.grader == current_user,
-            Pairing.recipient == recipient,
+            Pairing.grader_id == current_user.id,
+            Pairing.recipient_id == recipient.id,
             Pairing.assignment_id == assignment_id,
         )
         .options(joinedload(Pairing.task))
@@ -392,6 +396,7 @@ def retry_fetching_submission(course_id):
     new_mapping = CourseUserMap.create(course_id=course_id, user_id=user.id, role=role)
     db.session.add(new_mapping)
     db.session.commit()
+    roles.invalidate_user(user.id, course_id)
 
     return Response("OK", headers={"Content-Type": "text/plain"})
 
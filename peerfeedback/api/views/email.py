@@ -7,10 +7,8 @@ from flask import request, abort, jsonify, current_app as app
 from flask_jwt_extended import jwt_required, get_current_user
 from sentry_sdk import capture_exception
 
-from peerfeedback.api.jobs.sendmail import (
-    send_support_email,
-    send_pending_review_reminder,
-)
+from peerfeedback.api.jobs.reminders import send_pending_review_reminder
+from peerfeedback.api.jobs.sendmail import send_support_email
 from peerfeedback.api.utils import (
     post_comment_to_feedback,
     post_reply_to_comment,
@@ -0,0 +1,65 @@
+from flask import Response, jsonify, request, stream_with_context
+from flask_jwt_extended import (
+    get_current_user,
+    get_jwt_identity,
+    jwt_required,
+    verify_jwt_in_request,
+)
+
+from peerfeedback.api.events import (
+    STREAM_TOKEN_TIMEOUT,
+    create_stream_token,
+    redeem_stream_token,
+    stream,
+)
+from peerfeedback.api.views import api_blueprint
+from peerfeedback.extensions import db
+from peerfeedback.user.identity import get_user_record
+
+
+def get_stream_user_id():
+    """Return the id of the user opening the event stream.
+
+    The browsers' `EventSource` can't set the Authorization header, so a stream
+    token from `/api/events/token/` can be passed in the `token` query
+    parameter instead.
+
+    :return: local id of the user or None if the token is invalid or the user
+        doesn't exist
+    """
+    token = request.args.get("token")
+    if token:
+        user_id = redeem_stream_token(token)
+    else:
+        verify_jwt_in_request()
+        user_id = get_jwt_identity()["id"]
+
+    if not user_id or not get_user_record(user_id):
+        return None
+    return user_id
+
+
+@api_blueprint.route("/events/token/", methods=["POST"])
+@jwt_required
+def event_stream_token():
+    """Return a single use token for opening the event stream of the user"""
+    user = get_current_user()
+    return jsonify(token=create_stream_token(user.id), expires_in=STREAM_TOKEN_TIMEOUT)
+
+
+@api_blueprint.route("/events/")
+def event_stream():
+    """Stream the notification and job progress events of the user as
+    server-sent events.
+    """
+    user_id = get_stream_user_id()
+    if not user_id:
+        return "Invalid token", 401
+
+    # the stream stays open for minutes, don't hold on to a DB connection
+    db.session.remove()
+    return Response(
+        stream_with_context(stream(user_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -26,6 +26,8 @@ def job_status(job_id):
         data = {"status": "in_progress"}
         if job.meta.get("progress", 0):
             data["progress"] = job.meta["progress"]
+        if job.meta.get("message"):
+            data["message"] = job.meta["message"]
         return jsonify(data)
     elif job.is_queued:
         return jsonify({"status": "pending"})
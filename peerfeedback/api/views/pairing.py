@@ -143,7 +143,7 @@ def schedule_csv_pairing():
 def automatic_pairing():
     params = request.get_json()
 
-    teacher = get_course_teacher(params["course_id"])
+    teacher = get_course_teacher(params["course_id"], primary=True)
     if not teacher:
         return jsonify({"message": errors.CANNOT_FIND_TEACHER}), 400
 
@@ -173,7 +173,8 @@ def automatic_pairing():
         teacher.id,
         bool(params.get("excludeDefaulters")),
         params.get("excludedStudents"),
-        app.config.get("SEND_NOTIFICATION_EMAILS", False),        
+        app.config.get("SEND_NOTIFICATION_EMAILS", False),
+        avoid_repeats=bool(params.get("avoidRepeats")),
         job_id=job_id,
     )
     return jsonify(dict(id=job.id))
@@ -214,6 +215,7 @@ def schedule_automatic_pairing():
         bool(params.get("excludeDefaulters")),
         params.get("excludedStudents"),
         app.config.get("SEND_NOTIFICATION_EMAILS", False),
+        avoid_repeats=bool(params.get("avoidRepeats")),
         queue="scheduled" if custom_time else "high",
         timeout=60 * 30,
     )
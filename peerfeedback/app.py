@@ -11,6 +11,9 @@ from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 
 import peerfeedback.models
 from peerfeedback import admin, api, commands, models, public, user
+from peerfeedback.api.jobs.outbox import dispatch_outbox, prune_outbox
+from peerfeedback.api.jobs.sendmail import preload_email_templates
+from peerfeedback.api.jobs.tokens import refresh_expiring_tokens
 from peerfeedback.api.views import api_blueprint
 from peerfeedback.crons import (
     award_ml_grade,
@@ -31,8 +34,8 @@ from peerfeedback.extensions import (
     rq,
     sslify,
 )
-from peerfeedback.models import User
 from peerfeedback.settings import ProdConfig
+from peerfeedback.user.identity import load_identity
 from peerfeedback.user.jwt_helpers import is_token_revoked
 
 
@@ -50,6 +53,7 @@ def create_app(config_object=ProdConfig):
     register_shellcontext(app)
     register_commands(app)
     start_cron_jobs(app)
+    preload_email_templates()
 
     sentry_sdk.init(
         dsn=app.config.get("SENTRY_DSN"),
@@ -140,6 +144,9 @@ def register_commands(app):
     app.cli.add_command(commands.add_rubric)
     app.cli.add_command(commands.setup_study)
     app.cli.add_command(commands.preview_pairing)
+    app.cli.add_command(commands.canvas_cache_stats)
+    app.cli.add_command(commands.explain_indexes)
+    app.cli.add_command(commands.benchmark_pairing)
 
 
 def start_cron_jobs(app):
@@ -150,9 +157,16 @@ def start_cron_jobs(app):
         app.config["CRON_PATTERN"], "update-pairing-schedules"
     )
     update_user_reputation.cron(
-        app.config["CRON_PATTERN"],
-        "update-user-reputation",
+        app.config["CRON_PATTERN"], "update-user-reputation", incremental=True
     )
+    update_user_reputation.cron(
+        app.config["DAILY_CRON_PATTERN"], "update-user-reputation-full"
+    )
+    refresh_expiring_tokens.cron(
+        app.config["TOKEN_REFRESH_CRON_PATTERN"], "refresh-canvas-tokens"
+    )
+    dispatch_outbox.cron(app.config["OUTBOX_CRON_PATTERN"], "dispatch-outbox")
+    prune_outbox.cron(app.config["DAILY_CRON_PATTERN"], "prune-outbox")
 
 
 # --------------------------------------------------------------------------- #
@@ -165,9 +179,9 @@ def check_if_token_revoked(decoded_token):
 
 @jwt.user_loader_callback_loader
 def get_jwt_user(identity):
-    return User.query.get(identity["id"])
+    return load_identity(identity["id"])
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return load_identity(user_id)
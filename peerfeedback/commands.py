@@ -5,6 +5,7 @@ import logging
 import os
 import random
 import sys
+import time
 from datetime import datetime
 from glob import glob
 from re import T
@@ -20,8 +21,9 @@ from rq import get_current_job
 from werkzeug.exceptions import MethodNotAllowed, NotFound
 from yaml import safe_load
 
-from peerfeedback.api import errors
-from peerfeedback.api.jobs.sendmail import send_pairing_email
+from peerfeedback.api import canvas_cache, errors
+from peerfeedback.api.jobs.sendmail import send_pairing_emails
+from peerfeedback.api.jobs.tokens import ensure_canvas_token
 from peerfeedback.api.utils import (
     create_pairing,
     generate_non_group_pairs,
@@ -30,8 +32,18 @@ from peerfeedback.api.utils import (
 )
 from peerfeedback.database import db
 from peerfeedback.extensions import rq
-from peerfeedback.models import AssignmentSettings, Rubric, RubricCriteria, Study, User
-from peerfeedback.utils import update_canvas_token
+from peerfeedback.models import (
+    AssignmentSettings,
+    CourseUserMap,
+    Feedback,
+    Notification,
+    Pairing,
+    Rubric,
+    RubricCriteria,
+    Study,
+    Task,
+    User,
+)
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
@@ -574,7 +586,7 @@ def preview_pairing(
         return
 
     user = User.query.get(userid)
-    update_canvas_token(user)
+    ensure_canvas_token(user)
 
     canvas = get_canvas_client(user.canvas_access_token)
     course = canvas.get_course(courseid)
@@ -714,6 +726,7 @@ def preview_pairing(
                     )
 
             if pair:
+                pairing_ids = []
                 for grader_id, recipient_ids in matchings:
                     logger.debug("Creating pairs for Grader: %d", grader_id)
                     grader = usermap[grader_id]
@@ -739,14 +752,14 @@ def preview_pairing(
                                 course,
                                 assignment,
                             )
-
-                            send_pairing_email.queue(pair.id)
+                            pairing_ids.append(pair.id)
                         except (errors.PairingToSelf, errors.PairingExists):
                             logger.warning(
                                 "Grader %d and Recipient %d are already paired",
                                 grader_id,
                                 recipient_id,
                             )
+                send_pairing_emails.queue(pairing_ids)
 
     else:
         click.secho(
@@ -766,3 +779,166 @@ def preview_pairing(
 
     click.secho("\nDONE", bg="green", fg="black", nl=False)
     click.secho("")
+
+
+@click.command("canvas-cache-stats")
+@with_appcontext
+def canvas_cache_stats():
+    """Show the hit/miss counters of the Canvas data cache."""
+    click.secho("\n\u2139 Canvas cache statistics", fg="cyan", bold=True)
+    for resource, counts in canvas_cache.get_stats().items():
+        total = counts["hits"] + counts["misses"]
+        ratio = counts["hits"] / total * 100 if total else 0
+        click.secho(
+            f"{resource:<12} hits: {counts['hits']:<8} misses: {counts['misses']:<8}"
+            f" hit ratio: {ratio:.1f}%"
+        )
+
+
+def index_check_queries(course_id, assignment_id, user_id, pairing_id):
+    """Return the frequently run queries along with the index expected to be
+    used by each of them.
+    """
+    return [
+        (
+            "ix_pairing_grader",
+            Pairing.query.filter(
+                Pairing.course_id == course_id,
+                Pairing.assignment_id == assignment_id,
+                Pairing.grader_id == user_id,
+                Pairing.archived.is_(False),
+            ),
+        ),
+        (
+            "ix_pairing_recipient",
+            Pairing.query.filter(
+                Pairing.course_id == course_id,
+                Pairing.assignment_id == assignment_id,
+                Pairing.recipient_id == user_id,
+                Pairing.archived.is_(False),
+            ),
+        ),
+        (
+            "ix_feedback_receiver",
+            Feedback.query.filter(
+                Feedback.assignment_id == assignment_id,
+                Feedback.receiver_id == user_id,
+                Feedback.draft.is_(False),
+            ),
+        ),
+        (
+            "ix_feedback_reviewer",
+            Feedback.query.filter(
+                Feedback.assignment_id == assignment_id,
+                Feedback.reviewer_id == user_id,
+                Feedback.draft.is_(False),
+            ),
+        ),
+        (
+            "ix_feedback_submitted",
+            Feedback.query.filter(
+                Feedback.assignment_id == assignment_id, Feedback.draft.is_(False)
+            ),
+        ),
+        (
+            "ix_task_user_status",
+            Task.query.filter(Task.user_id == user_id, Task.status == Task.PENDING),
+        ),
+        ("ix_task_pairing_id", Task.query.filter(Task.pairing_id == pairing_id)),
+        (
+            "ix_notification_recipient_read_id",
+            Notification.query.filter(
+                Notification.recipient_id == user_id, Notification.read.is_(False)
+            )
+            .order_by(Notification.id.desc())
+            .limit(50),
+        ),
+        (
+            "ix_course_usermap_course_user",
+            CourseUserMap.query.filter(
+                CourseUserMap.course_id == course_id, CourseUserMap.user_id == user_id
+            ),
+        ),
+    ]
+
+
+@click.command("explain-indexes")
+@click.option("-cid", "--courseid", default=1, help="Course id", type=int)
+@click.option("-aid", "--assignmentid", default=1, help="Assignment id", type=int)
+@click.option("-uid", "--userid", default=1, help="User id", type=int)
+@click.option("-pid", "--pairingid", default=1, help="Pairing id", type=int)
+@click.option(
+    "--no-seqscan",
+    is_flag=True,
+    help="Discourage sequential scans, useful when the tables are too small for "
+    "the planner to pick an index",
+)
+@click.option("-v", "--verbose", is_flag=True, help="Print the query plans")
+@with_appcontext
+def explain_indexes(courseid, assignmentid, userid, pairingid, no_seqscan, verbose):
+    """Check that the query plans of the frequent queries use the indexes."""
+    if no_seqscan:
+        db.session.execute("SET LOCAL enable_seqscan = off")
+
+    failed = 0
+    for index, query in index_check_queries(courseid, assignmentid, userid, pairingid):
+        sql = query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+        plan = [row[0] for row in db.session.execute(f"EXPLAIN {sql}")]
+        used = any(index in line for line in plan)
+        failed += not used
+        click.secho(
+            f"{'OK' if used else 'NOT USED':<9} {index}", fg="green" if used else "red"
+        )
+        if verbose or not used:
+            click.echo("\n".join(f"    {line}" for line in plan))
+
+    db.session.rollback()
+    if failed:
+        sys.exit(1)
+
+
+@click.command("benchmark-pairing")
+@click.option(
+    "-n",
+    "--students",
+    default=[100, 1000, 10000],
+    multiple=True,
+    help="No.of students, can be repeated",
+    type=int,
+)
+@click.option(
+    "-g",
+    "--groups",
+    default=[5, 50, 500],
+    multiple=True,
+    help="No.of groups, can be repeated",
+    type=int,
+)
+@click.option("-rr", "--reviewrounds", default=3, help="Review rounds", type=int)
+@click.option("-s", "--seed", default=0, help="Seed of the random data", type=int)
+def benchmark_pairing(students, groups, reviewrounds, seed):
+    """Time the group based pairing on random courses of the given sizes."""
+    rand = random.Random(seed)
+    click.secho(
+        f"{'students':>9} {'groups':>7} {'seconds':>9} {'unreviewed':>11}", bold=True
+    )
+    for count in students:
+        for group_count in groups:
+            if count < group_count * 2:
+                continue
+            users = list(range(1, count + 1))
+            rand.shuffle(users)
+            group_map = {g: users[g::group_count] for g in range(group_count)}
+
+            started = time.perf_counter()
+            pairs = generate_non_group_pairs(group_map, users, reviewrounds, seed=seed)
+            elapsed = time.perf_counter() - started
+
+            reviewed = {peer for peers in pairs.values() for peer in peers}
+            unreviewed = count - len(reviewed)
+            click.secho(
+                f"{count:>9} {group_count:>7} {elapsed:>9.3f} {unreviewed:>11}",
+                fg="red" if unreviewed else "green",
+            )
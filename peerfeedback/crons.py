@@ -5,35 +5,34 @@ maintenance
 import datetime
 import json
 import logging
-from collections import defaultdict
 from datetime import timedelta, timezone
 
-import jinja2
 import requests
 from dateutil.parser import parse as parse_date
-from sendgrid.helpers.mail import Content, Mail
-from sentry_sdk import capture_exception, capture_message, push_scope
 from sqlalchemy.sql import func
 
 from peerfeedback.api.jobs.pairing import pair_automatically
-from peerfeedback.api.jobs.sendmail import (HOSTNAME, SENDER_HOSTNAME,
-                                            get_email_template, sg)
-from peerfeedback.api.utils import (get_canvas_client, get_course_teacher,
-                                    proper_email)
-from peerfeedback.extensions import db, rq
-from peerfeedback.models import (Feedback, JWTToken, MetaFeedback, Pairing,
-                                 Task, User)
+from peerfeedback.api.jobs.reminders import get_pending_reminders, send_reminders
+from peerfeedback.api.utils import get_canvas_client, get_course_teacher
+from peerfeedback.extensions import cache, db, rq
+from peerfeedback.models import Feedback, MetaFeedback, Pairing, Task, User
 from peerfeedback.settings import Config
+from peerfeedback.user.jwt_helpers import prune_database
 
 logger = logging.getLogger(__name__)
 
+REPUTATION_LAST_RUN_KEY = "crons:update-user-reputation:last-run"
 
-@rq.job("default")
+
+@rq.job("default", timeout=60 * 30)
 def clear_expired_tokens():
-    now = datetime.datetime.now()
-    expired_tokens = JWTToken.query.filter(JWTToken.expires < now).all()
-    for token in expired_tokens:
-        token.delete()
+    result = prune_database()
+    logger.info(
+        "Deleted %d expired JWT tokens in %.2f seconds",
+        result["deleted"],
+        result["duration"],
+    )
+    return result
 
 
 @rq.job("low", timeout=60 * 30)
@@ -128,6 +127,7 @@ def update_pairing_schedules():
             ex_students,
             email,
             timeout=60 * 30,
+            **job.kwargs,
         )
         logger.info(
             f"Schedule for assignment #{assignment.id} {assignment.name} changed to {expected_schedule.isoformat()}"
@@ -157,45 +157,91 @@ def anonymize_users():
     logger.info(f"Anonymized {len(users)} users")
 
 
-@rq.job("cron", timeout=60 * 500)
-def update_user_reputation():
+def get_reputation_metrics(user_ids):
+    """Calculate the feedback metrics of the given users with one aggregate
+    query per metric.
+
+    :param user_ids: a query of the ids of the users
+    :return: list of dicts with the user id and the values of the metrics, that
+        can be passed to `bulk_update_mappings`
+    """
+    oldest_reviews = dict(
+        db.session.query(Feedback.reviewer_id, func.min(Feedback.end_date))
+        .filter(Feedback.draft.is_(False), Feedback.reviewer_id.in_(user_ids))
+        .group_by(Feedback.reviewer_id)
+    )
+    feedback_counts = dict(
+        db.session.query(Feedback.reviewer_id, func.count(Feedback.id))
+        .join(Pairing, Feedback.pairing_id == Pairing.id)
+        .filter(
+            Feedback.draft.is_(False),
+            Feedback.reviewer_id.in_(user_ids),
+            Pairing.archived.is_(False),
+        )
+        .group_by(Feedback.reviewer_id)
+    )
+    scores = dict(
+        db.session.query(MetaFeedback.receiver_id, func.avg(MetaFeedback.points))
+        .filter(MetaFeedback.receiver_id.in_(user_ids))
+        .group_by(MetaFeedback.receiver_id)
+    )
+
+    return [
+        dict(
+            id=uid,
+            oldest_review=oldest_reviews.get(uid),
+            feedback_given=feedback_counts.get(uid, 0),
+            reputation=float(scores[uid]) if scores.get(uid) else 0,
+        )
+        for uid, in user_ids
+    ]
+
+
+@rq.job("cron", timeout=60 * 60)
+def update_user_reputation(incremental=False):
     """Calculates the feedback metrics of a student. The following fields of
     the user model are updated in this cron job:
 
     1. feedback_given - No of feedback that the user has completed
     2. reputation - The average rating he has received for those feedback
     3. oldest_review - The oldest review the user has given
+
+    :param incremental: update only the users whose feedback, meta feedback or
+        pairings have changed since the last run. A full update is done if there
+        is no record of the last run. The deleted feedback and meta feedback
+        leave no rows to be found, so they are only accounted for by the daily
+        full run, which is the source of truth for the metrics.
     """
+    started = datetime.datetime.now(tz=timezone.utc)
     last_year = datetime.datetime.now() - timedelta(days=365)
-    students = User.query.filter(User.canvas_expiration_time > last_year).all()
+    user_ids = db.session.query(User.id).filter(User.canvas_expiration_time > last_year)
 
-    for student in students:
-        fb = (
-            Feedback.query.filter(
-                Feedback.draft.is_(False), Feedback.reviewer_id == student.id
-            )
-            .order_by(Feedback.end_date)
-            .first()
+    last_run = cache.get(REPUTATION_LAST_RUN_KEY) if incremental else None
+    if last_run:
+        reviewers = db.session.query(Feedback.reviewer_id).filter(
+            Feedback.updated_on >= last_run
         )
-        student.oldest_review = fb.end_date if fb else None
-
-        count = Feedback.query.filter(
-            Feedback.reviewer_id == student.id,
-            Feedback.draft.is_(False),
-            Feedback.pairing.has(Pairing.archived.is_(False)),
-        ).count()
-        student.feedback_given = count
-
-        score = (
-            MetaFeedback.query.with_entities(
-                func.avg(MetaFeedback.points).label("average")
-            )
-            .filter(MetaFeedback.receiver_id == student.id)
-            .scalar()
+        receivers = db.session.query(MetaFeedback.receiver_id).filter(
+            MetaFeedback.updated_on >= last_run
         )
-        student.reputation = float(score) if score else 0
+        # the feedback of the archived pairings no longer counts
+        archived = (
+            db.session.query(Feedback.reviewer_id)
+            .join(Pairing, Feedback.pairing_id == Pairing.id)
+            .filter(Pairing.updated_on >= last_run)
+        )
+        user_ids = user_ids.filter(User.id.in_(reviewers.union(receivers, archived)))
+
+    mappings = get_reputation_metrics(user_ids)
+    db.session.bulk_update_mappings(User, mappings)
+    db.session.commit()
+    cache.set(REPUTATION_LAST_RUN_KEY, started, timeout=0)
 
-        student.save()
+    logger.info(
+        "Updated the reputation of %d users (%s)",
+        len(mappings),
+        f"changed since {last_run.isoformat()}" if last_run else "all users",
+    )
 
 
 def send_reminder_emails_for_unfinished_tasks():
@@ -208,83 +254,14 @@ def send_reminder_emails_for_unfinished_tasks():
     now = datetime.datetime.now()
     after_4_days = now + datetime.timedelta(days=4)
     after_5_days = now + datetime.timedelta(days=5)
-    pending_users = (
-        db.session.query(Task.user_id, db.func.count(Task.id))
-        .filter(
-            Task.due_date < after_5_days,
-            Task.due_date > after_4_days,
-            Task.status.in_([Task.PENDING, Task.IN_PROGRESS]),
-        )
-        .group_by(Task.user_id)
+    reminders = get_pending_reminders(
+        Task.due_date < after_5_days, Task.due_date > after_4_days
     )
-
-    template_file = get_email_template("pending_tasks.html")
-    with open(template_file) as f:
-        template = jinja2.Template(f.read())
-
-    total = 0
-    succeeded = 0
-    failed = 0
-
-    for user_id, pending_tasks in pending_users:
-        user = User.query.get(user_id)
-        logger.debug(f"Sending reminders to {user}")
-        tasks = Task.query.filter(
-            Task.user_id == user_id,
-            Task.due_date < after_5_days,
-            Task.due_date > after_4_days,
-            Task.status.in_([Task.PENDING, Task.IN_PROGRESS]),
-        ).all()
-        assignment_tasks = defaultdict(list)
-        for task in tasks:
-            assignment_tasks[task.assignment_id].append(task)
-
-        for aid, a_tasks in assignment_tasks.items():
-            total += 1
-            count = len(a_tasks)
-            assignment = a_tasks[0].assignment_name
-            cid = a_tasks[0].course_id
-            course = a_tasks[0].course_name
-            due = a_tasks[0].due_date
-            mail = Mail(
-                from_email="notification@" + SENDER_HOSTNAME,
-                to_emails=proper_email(user),
-                subject=f"Alert! {count} feedback tasks pending in {assignment}",
-            )
-            url = f"https://{HOSTNAME}/app/course/{cid}/assignment/{aid}"
-            content = Content(
-                "text/html",
-                template.render(
-                    pending_count=count,
-                    user=user.name,
-                    assignment=assignment,
-                    course=course,
-                    due_date=due,
-                    url=url,
-                    hostname=HOSTNAME,
-                ),
-            )
-            mail.add_content(content)
-            try:
-                logger.debug(f"Mailing user #{user.id} for assignment #{aid}")
-                response = sg.send(mail)
-            except:
-                logger.warning(
-                    f"Email FAILED for user #{user.id} for assignment #{aid}"
-                )
-                failed += 1
-                capture_exception()
-                continue
-
-            if response.status_code >= 400:
-                logger.warning(
-                    f"Email FAILED for user #{user.id} for assignment #{aid}"
-                )
-                failed += 1
-                with push_scope() as scope:
-                    scope.set_extra("sendgrid_response", response)
-                    capture_message("Sending Pending Alert Failed", "error")
-            else:
-                succeeded += 1
+    stats = send_reminders(reminders)
     logger.info("Completed sending reminder emails for pending tasks")
-    logger.info(f"Total: {total}    Succeeded: {succeeded}  Failed: {failed}")
+    logger.info(
+        "Total: %(total)d    Succeeded: %(succeeded)d  Failed: %(failed)d  "
+        "Requests: %(requests)d",
+        stats,
+    )
+    return stats
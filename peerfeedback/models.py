@@ -50,11 +50,11 @@ class User(UserMixin, SurrogatePK, Model, TimeData):
 
 class JWTToken(Model):
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(36), nullable=False)
+    jti = db.Column(db.String(36), nullable=False, index=True)
     token_type = db.Column(db.String(10), nullable=False)
     user_identity = db.Column(db.String(80), nullable=False)
     revoked = db.Column(db.Boolean, nullable=False)
-    expires = db.Column(db.DateTime, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
 
     def to_dict(self):
         return {
@@ -93,6 +93,19 @@ class Pairing(TimeData, SurrogatePK, Model):
     """Model storing information about the grader and recipient of a feedback"""
 
     __tablename__ = "pairing"
+    __table_args__ = (
+        db.Index(
+            "ix_pairing_grader", "course_id", "assignment_id", "grader_id", "archived"
+        ),
+        db.Index(
+            "ix_pairing_recipient",
+            "course_id",
+            "assignment_id",
+            "recipient_id",
+            "archived",
+        ),
+        {"extend_existing": True},
+    )
 
     STUDENT = "student"
     TA = "TA"
@@ -135,6 +148,18 @@ class Feedback(TimeData, SurrogatePK, Model):
     """Feedback provided by the grader for an assignment"""
 
     __tablename__ = "feedback"
+    __table_args__ = (
+        db.Index("ix_feedback_receiver", "assignment_id", "receiver_id", "draft"),
+        db.Index("ix_feedback_reviewer", "assignment_id", "reviewer_id", "draft"),
+        # Only the submitted feedback is used by most of the reports
+        db.Index(
+            "ix_feedback_submitted",
+            "assignment_id",
+            postgresql_where=db.text("draft IS false"),
+        ),
+        db.Index("ix_feedback_pairing_id", "pairing_id"),
+        {"extend_existing": True},
+    )
 
     STUDENT = "student"
     TA = "TA"
@@ -215,6 +240,11 @@ class Task(TimeData, SurrogatePK, Model):
     """
 
     __tablename__ = "task"
+    __table_args__ = (
+        db.Index("ix_task_user_status", "user_id", "status"),
+        db.Index("ix_task_pairing_id", "pairing_id"),
+        {"extend_existing": True},
+    )
 
     PENDING = "PENDING"
     IN_PROGRESS = "INPROGRESS"
@@ -257,6 +287,10 @@ class Notification(TimeData, SurrogatePK, Model):
     """
 
     __tablename__ = "notification"
+    __table_args__ = (
+        db.Index("ix_notification_recipient_read_id", "recipient_id", "read", "id"),
+        {"extend_existing": True},
+    )
 
     FEEDBACK = "feedback"
     COMMENT = "comment"
@@ -498,6 +532,10 @@ class CourseUserMap(TimeData, SurrogatePK, Model):
     """Map of users and the courses they are associated with and their roles"""
 
     __tablename__ = "course_usermap"
+    __table_args__ = (
+        db.Index("ix_course_usermap_course_user", "course_id", "user_id"),
+        {"extend_existing": True},
+    )
 
     STUDENT = "student"
     TA = "ta"
@@ -547,3 +585,32 @@ class Study(TimeData, SurrogatePK, Model):
         secondary=study_user_associations,
         backref=backref("studies", lazy="select"),
     )
+
+
+class OutboxEmail(TimeData, SurrogatePK, Model):
+    """An email waiting to be sent by the outbox dispatcher.
+
+    The mail producers only add the emails to the outbox. The dispatcher job
+    sends them in the background and retries the failed ones.
+    """
+
+    __tablename__ = "outbox_email"
+    __table_args__ = (
+        db.Index("ix_outbox_email_status_next_attempt", "status", "next_attempt_at"),
+        {"extend_existing": True},
+    )
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    states = (PENDING, SENT, FAILED)
+
+    # Unique key of the email, the same email is added only once
+    dedup_key = Column(db.String(100), unique=True)
+    # The SendGrid v3 request body of the email
+    payload = Column(db.JSON, nullable=False)
+    status = Column(db.String(10), nullable=False, default=PENDING)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = Column(db.DateTime, nullable=False)
+    sent_at = Column(db.DateTime)
+    last_error = Column(db.Text)
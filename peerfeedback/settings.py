@@ -32,9 +32,15 @@ class Config(object):
     BUNDLE_ERRORS = True
     SEND_NOTIFICATION_EMAILS = True
     RQ_REDIS_URL = os.environ.get("REDIS_URL") + "/0"
-    RQ_QUEUES = ["default", "high", "low", "scheduled", "cron"]
+    RQ_QUEUES = ["default", "high", "low", "scheduled", "cron", "mail"]
     RQ_SCHEDULER_QUEUE = "scheduled"
     CRON_PATTERN = "10 * * * *"  # every hour at XX:10
+    DAILY_CRON_PATTERN = "40 3 * * *"  # every day at 03:40
+    TOKEN_REFRESH_CRON_PATTERN = "*/10 * * * *"  # every 10 minutes
+    # Roles of the course staff whose canvas tokens are used for the course.
+    # TAs can be limited to their sections in Canvas, so their tokens may not
+    # see the whole course. Only add "ta" if the TAs have course wide access.
+    CANVAS_CREDENTIAL_ROLES = ["teacher"]
     LOGIN_TYPE = os.environ.get("LOGIN_TYPE", "canvas_oauth")
     CAS_SERVER = os.environ.get("CAS_SERVER")
     CAS_AFTER_LOGIN = "user.post_login"
@@ -43,6 +49,15 @@ class Config(object):
     S3_SECRET = os.environ.get("S3_SECRET")
     SEND_SUPPORT_EMAILS = True
     MLAPP_URL = os.environ.get("MLAPP_URL")
+    MAIL_TRANSPORT = "sendgrid"  # "local" keeps the emails in memory
+    # Email outbox, see peerfeedback.api.jobs.outbox
+    MAIL_RATE_LIMIT = 10  # emails sent per second
+    MAIL_CONCURRENCY = 4  # emails sent in parallel
+    OUTBOX_CRON_PATTERN = "* * * * *"  # every minute, picks up the retries
+    OUTBOX_RETENTION_DAYS = 30  # days the sent and failed emails are kept
+    # Server-sent events pushed to the browsers, see peerfeedback.api.events
+    PUBLISH_EVENTS = True
+    EVENT_STREAM_DURATION = 60 * 5  # seconds before the browser has to reconnect
 
 
 class ProdConfig(Config):
@@ -85,3 +100,5 @@ class TestConfig(Config):
     SEND_SUPPORT_EMAILS = False
     WTF_CSRF_ENABLED = False
     WTF_CSRF_METHODS = []
+    PUBLISH_EVENTS = False
+    MAIL_TRANSPORT = "local"
@@ -0,0 +1,181 @@
+"""Resolution of the user making the request.
+
+The JWT and the login manager callbacks run on every authenticated request.
+Instead of loading the full `User` row each time, a compact record of the
+user (id, canvas_id, username, name and email) is kept in the application
+`cache` (Redis) and in `flask.g` for the rest of the request. The callbacks
+return a `UserIdentity` which serves these fields from the record and loads
+the full `User` object from the DB only when any other attribute is used.
+
+The cached record is dropped when a transaction which updated or deleted the
+user row is committed. The bulk updates and deletes of the users, whose rows
+are not known, move all the records to a new generation of keys instead.
+"""
+from collections import namedtuple
+
+from flask import g, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from peerfeedback.extensions import cache, db
+from peerfeedback.models import User
+
+KEY_PREFIX = "identity"
+# Counter which is part of every key, incremented to drop all the records
+GENERATION_KEY = f"{KEY_PREFIX}:generation"
+# Time (in seconds) for which the user records are cached
+IDENTITY_TIMEOUT = 60 * 60
+
+UserRecord = namedtuple("UserRecord", ["id", "canvas_id", "username", "name", "email"])
+
+
+class UserIdentity(UserMixin):
+    """Stand-in for the `User` object of the current user.
+
+    The fields of the `UserRecord` are available without a DB query. Accessing
+    or setting any other attribute, or calling a method like `save`, loads the
+    `User` object and passes the call on to it.
+
+    :param record: UserRecord of the user
+    """
+
+    def __init__(self, record):
+        object.__setattr__(self, "_record", record)
+        object.__setattr__(self, "_user", None)
+
+    def get_user(self):
+        """Return the full `User` object, loading it from the DB if needed."""
+        if self._user is None:
+            object.__setattr__(self, "_user", User.query.get(self._record.id))
+        return self._user
+
+    def __getattr__(self, name):
+        if self._user is None and name in UserRecord._fields:
+            return getattr(self._record, name)
+        return getattr(self.get_user(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get_user(), name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, (User, UserIdentity)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash((User, self._record.id))
+
+    def __repr__(self):
+        return f"<UserIdentity ({self._record.username!r})>"
+
+
+def make_key(user_id):
+    generation = cache.get(GENERATION_KEY) or 0
+    return f"{KEY_PREFIX}:{generation}:{user_id}"
+
+
+def _request_memo():
+    if not has_app_context():
+        return {}
+    if "user_records" not in g:
+        g.user_records = {}
+    return g.user_records
+
+
+def get_user_record(user_id):
+    """Return the compact record of the user.
+
+    :param user_id: local id of the user
+    :return: UserRecord or None if the user doesn't exist
+    """
+    user_id = int(user_id)
+    memo = _request_memo()
+    if user_id in memo:
+        return memo[user_id]
+
+    key = make_key(user_id)
+    data = cache.get(key)
+    if data is not None:
+        record = UserRecord(*data)
+    else:
+        user = User.query.get(user_id)
+        if not user:
+            return None
+        record = UserRecord(*(getattr(user, f) for f in UserRecord._fields))
+        cache.set(key, tuple(record), timeout=IDENTITY_TIMEOUT)
+
+    memo[user_id] = record
+    return record
+
+
+def load_identity(user_id):
+    """Return the `UserIdentity` of the user for the JWT and login callbacks.
+
+    :param user_id: local id of the user
+    :return: UserIdentity or None if the user doesn't exist
+    """
+    record = get_user_record(user_id)
+    return UserIdentity(record) if record else None
+
+
+def invalidate_user_record(user_id):
+    """Drop the cached record of the user.
+
+    :param user_id: local id of the user
+    """
+    cache.delete(make_key(user_id))
+    _request_memo().pop(int(user_id), None)
+
+
+def invalidate_all_user_records():
+    """Drop the cached records of all the users."""
+    cache.inc(GENERATION_KEY)
+    _request_memo().clear()
+
+
+def _pending_changes(session):
+    return session.info.setdefault("changed_user_ids", set())
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    # the cache is cleared only when the change is committed, so that the
+    # readers don't cache the uncommitted values in the meantime
+    _request_memo().pop(target.id, None)
+    session = object_session(target)
+    if session is not None:
+        _pending_changes(session).add(target.id)
+
+
+@event.listens_for(db.session, "after_bulk_update")
+@event.listens_for(db.session, "after_bulk_delete")
+def _users_bulk_changed(context):
+    # the changed ids are not known, so all the records are dropped on commit
+    if context.mapper.class_ is User:
+        _request_memo().clear()
+        _pending_changes(context.session).add(None)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_committed_changes(session):
+    # the event fires for the savepoints too, wait for the outermost commit
+    if session.transaction.parent is not None:
+        return
+    user_ids = session.info.pop("changed_user_ids", set())
+    if None in user_ids:
+        invalidate_all_user_records()
+        return
+    for user_id in user_ids:
+        invalidate_user_record(user_id)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_rolled_back_changes(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("changed_user_ids", None)
@@ -1,13 +1,18 @@
+import time
 from datetime import datetime
 
 from sqlalchemy.orm.exc import NoResultFound
 from flask_jwt_extended import decode_token
 
-from peerfeedback.extensions import db
+from peerfeedback.extensions import cache, db
 from peerfeedback.exceptions import TokenNotFound
 from peerfeedback.models import JWTToken
 
 
+# No.of expired tokens deleted by a single statement when pruning
+PRUNE_BATCH_SIZE = 5000
+
+
 def _epoch_utc_to_datetime(epoch_utc):
     """
     Helper function for converting epoch timestamps (as stored in JWTs) into
@@ -16,6 +21,31 @@ def _epoch_utc_to_datetime(epoch_utc):
     return datetime.fromtimestamp(epoch_utc)
 
 
+def _token_key(jti):
+    return f"jwt:revoked:{jti}"
+
+
+def cache_token_state(jti, revoked, expires, overwrite=True):
+    """
+    Writes the revoked state of a token to the cache, so that the token can be
+    checked without querying the database. The entry expires along with the
+    token.
+
+    :param jti: the unique identifier of the token
+    :param revoked: boolean - whether the token is revoked
+    :param expires: expiry time of the token as an epoch timestamp
+    :param overwrite: OPTIONAL - set to False to keep the state already in the
+        cache, like a revocation written after the state was read from the DB
+    """
+    timeout = int(expires - time.time())
+    if timeout <= 0:
+        return
+    if overwrite:
+        cache.set(_token_key(jti), revoked, timeout=timeout)
+    else:
+        cache.add(_token_key(jti), revoked, timeout=timeout)
+
+
 def add_token_to_database(encoded_token, identity_claim):
     """
     Adds a new token to the database. It is not revoked when it is added.
@@ -37,6 +67,7 @@ def add_token_to_database(encoded_token, identity_claim):
     )
     db.session.add(db_token)
     db.session.commit()
+    cache_token_state(jti, revoked, decoded_token["exp"])
 
 
 def is_token_revoked(decoded_token):
@@ -45,13 +76,24 @@ def is_token_revoked(decoded_token):
     tokens that we create into this database, if the token is not present
     in the database we are going to consider it revoked, as we don't know where
     it was created.
+
+    The state of the token is looked up in the cache first and the database
+    is queried only when the token isn't cached.
     """
     jti = decoded_token["jti"]
+    revoked = cache.get(_token_key(jti))
+    if revoked is not None:
+        return revoked
+
     try:
         token = JWTToken.query.filter_by(jti=jti).one()
-        return token.revoked
+        revoked = token.revoked
     except NoResultFound:
-        return True
+        revoked = True
+
+    if "exp" in decoded_token:
+        cache_token_state(jti, revoked, decoded_token["exp"], overwrite=False)
+    return revoked
 
 
 def get_user_tokens(user_identity):
@@ -66,9 +108,11 @@ def clear_token(jti, delete=False):
     try:
         token = JWTToken.query.filter_by(jti=jti).one()
         token.revoked = True
+        expires = token.expires.timestamp()
         if delete:
             db.session.delete(token)
         db.session.commit()
+        cache_token_state(jti, True, expires)
     except NoResultFound:
         raise TokenNotFound("Could not find token {}".format(jti))
 
@@ -85,13 +129,28 @@ def revoke_token(raw_token, remove=False):
         clear_token(refresh_jti, remove)
 
 
-def prune_database():
+def prune_database(batch_size=PRUNE_BATCH_SIZE):
     """
-    Delete tokens that have expired from the database.
-    TODO Setup a automated way to run this
+    Delete tokens that have expired from the database. The tokens are deleted
+    in chunks of `batch_size` rows with a commit after each chunk, so that the
+    locks are held only briefly even when there are a lot of expired tokens.
+
+    :param batch_size: the maximum no.of tokens deleted by a single statement
+    :return: dict with the no.of tokens `deleted` and the `duration` in seconds
     """
+    start = time.monotonic()
     now = datetime.now()
-    expired = JWTToken.query.filter(JWTToken.expires < now).all()
-    for token in expired:
-        db.session.delete(token)
-    db.session.commit()
+    expired_ids = (
+        db.session.query(JWTToken.id).filter(JWTToken.expires < now).limit(batch_size)
+    )
+    deleted = 0
+    while True:
+        count = JWTToken.query.filter(JWTToken.id.in_(expired_ids)).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            break
+
+    return {"deleted": deleted, "duration": time.monotonic() - start}
@@ -13,6 +13,7 @@ from flask_jwt_extended import (create_access_token, create_refresh_token,
                                 decode_token, get_jwt_identity, get_raw_jwt,
                                 jwt_refresh_token_required, jwt_required)
 from flask_restful import Api, marshal
+from peerfeedback.api.jobs.tokens import ensure_canvas_token
 from peerfeedback.api.utils import get_canvas_client
 from peerfeedback.exceptions import TokenNotFound
 from peerfeedback.extensions import canvas_oauth, cas
@@ -21,7 +22,6 @@ from peerfeedback.user.jwt_helpers import (add_token_to_database,
                                            is_token_revoked, revoke_token)
 from peerfeedback.user.resource import (UserResource, UserSettingsResource,
                                         user_fields)
-from peerfeedback.utils import update_canvas_token
 
 blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../static")
 user_api = Api(blueprint)
@@ -81,9 +81,7 @@ def oauth_authorized():
 
 
 def redirect_to_dashboard_with_tokens(user):
-    token_expiry = datetime.now(tz=timezone.utc) + timedelta(minutes=15)
-    if token_expiry > user.canvas_expiration_time:
-        update_canvas_token(user)
+    ensure_canvas_token(user)
     refresh_token = create_refresh_token(identity=user.as_dict())
     identity = user.as_dict()
     identity["refresh_jti"] = decode_token(refresh_token)["jti"]
@@ -109,9 +107,7 @@ def refresh_access_token():
         return abort(401)
     identity["refresh_jti"] = refresh_jwt["jti"]
     user = User.query.get(identity["id"])
-    token_expiry_time = datetime.now(tz=timezone.utc) + timedelta(minutes=15)
-    if token_expiry_time > user.canvas_expiration_time:
-        update_canvas_token(user)
+    ensure_canvas_token(user)
     token = create_access_token(identity=identity)
     return jsonify({"access_token": token})
 
@@ -142,9 +138,7 @@ def user_profile(user_id):
     if not user:
         return abort(404)
 
-    token_expiry_time = datetime.now(tz=timezone.utc) + timedelta(minutes=15)
-    if token_expiry_time > user.canvas_expiration_time:
-        update_canvas_token(user)
+    ensure_canvas_token(user)
 
     canvas = get_canvas_client(user.canvas_access_token)
     canvas_user = canvas.get_user(user.canvas_id)
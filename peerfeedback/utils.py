@@ -6,6 +6,15 @@ from datetime import datetime, timezone, timedelta
 
 import requests
 from flask import current_app as app
+from redis.exceptions import LockError
+
+from peerfeedback.extensions import db, rq
+
+# Seconds after which the lock of a token refresh expires, in case the process
+# holding it dies
+TOKEN_LOCK_TIMEOUT = 60
+# Seconds to wait for a refresh running in another process to complete
+TOKEN_LOCK_WAIT = 15
 
 
 def is_valid_email(email):
@@ -31,6 +40,17 @@ def get_pseudo_names():
     return names
 
 
+def chunked(items, size):
+    """Split the given list into consecutive chunks of at most `size` items.
+
+    :param items: list of items to be split
+    :param size: the maximum no.of items in a chunk
+    :return: a generator of lists
+    """
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
 def update_canvas_token(user):
     url = app.config.get("CANVAS")["access_token_url"]
     response = requests.post(
@@ -47,3 +67,52 @@ def update_canvas_token(user):
     user.canvas_expiration_time = datetime.now(tz=timezone.utc) + timedelta(minutes=59)
     user.save()
     assert user.canvas_id == data["user"]["id"]
+
+
+def token_expires_within(user, margin):
+    """Check if the user's canvas token expires within the given time.
+
+    :param user: User object
+    :param margin: datetime.timedelta
+    """
+    if not user.canvas_expiration_time:
+        return True
+    return datetime.now(tz=timezone.utc) + margin > user.canvas_expiration_time
+
+
+def refresh_canvas_token(user, margin=timedelta(0), force=False):
+    """Refresh the canvas token of the user, making sure that only one refresh
+    of the user's token happens at a time across all the app and worker
+    processes.
+
+    The refresh is guarded by a Redis lock. A process which has to wait for the
+    lock reloads the token saved by the process that held it instead of
+    refreshing the token again.
+
+    :param user: User object
+    :param margin: datetime.timedelta - the token is refreshed only if it
+        expires within this time when the lock is acquired
+    :param force: refresh the token even if it is not about to expire, for
+        example when canvas has rejected it
+    """
+    lock = rq.connection.lock(
+        f"canvas-token-refresh:{user.id}",
+        timeout=TOKEN_LOCK_TIMEOUT,
+        blocking_timeout=TOKEN_LOCK_WAIT,
+    )
+    expiration_time = user.canvas_expiration_time
+    if not lock.acquire():
+        # the other process is taking too long, use whatever is saved now
+        db.session.refresh(user)
+        return
+
+    try:
+        db.session.refresh(user)
+        refreshed = user.canvas_expiration_time != expiration_time
+        if token_expires_within(user, margin) or (force and not refreshed):
+            update_canvas_token(user)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
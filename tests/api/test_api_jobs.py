@@ -1,10 +1,17 @@
 import pytest
 
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
-from peerfeedback.models import Feedback, Notification, Comment
+from peerfeedback.models import Feedback, Notification, Comment, Pairing, Task
 from peerfeedback.api.jobs.notifications import notify_discussion_participants
 from peerfeedback.api.jobs.feedback import reopen_submitted_feedback
+from peerfeedback.api.jobs.progress import ProgressReporter
+from peerfeedback.api.jobs import sendmail
+from peerfeedback.api.jobs.reminders import (
+    get_pending_reminders,
+    send_pending_review_reminder,
+)
+from peerfeedback.api.jobs.sendmail import email_templates, preload_email_templates
 
 
 @pytest.fixture
@@ -185,3 +192,217 @@ class TestChangeAssignmentRubric(object):
         """
         reopen_submitted_feedback(1, rubric.id, send_emails=True)
         assert mock_email.call_count == len(feedback)
+
+
+class TestProgressReporter(object):
+    """
+    CLASS   ProgressReporter
+    """
+
+    def test_updates_are_throttled_by_step(self):
+        """
+        GIVEN   a job with a progress reporter
+        WHEN    the progress is updated by less than the step size
+        THEN    the job meta is saved only when the step is crossed
+        """
+        job = Mock(meta={})
+        progress = ProgressReporter(job, step=5, interval=60)
+        for i in range(1, 10):
+            progress.update(i)
+
+        assert 1 == job.save_meta.call_count
+        assert 5 == job.meta["progress"]
+        assert 9 == progress.progress
+
+    def test_message_and_completion_are_saved_immediately(self):
+        """
+        GIVEN   a job with a progress reporter
+        WHEN    the message changes or the job is completed
+        THEN    the job meta is saved without waiting for the throttle limits
+        """
+        job = Mock(meta={})
+        progress = ProgressReporter(job, step=50, interval=60)
+        progress.update(1, "Starting")
+        assert "Starting" == job.meta["message"]
+
+        progress.track(2, 10, 0, 20)
+        assert 1 == job.meta["progress"]
+
+        progress.complete("Done")
+        assert 100 == job.meta["progress"]
+        assert "Done" == job.meta["message"]
+        assert 2 == job.save_meta.call_count
+
+    def test_works_without_a_job(self):
+        """
+        GIVEN   a progress reporter without a job
+        WHEN    the progress is updated
+        THEN    the values are tracked without errors
+        """
+        progress = ProgressReporter(None)
+        progress.update(40, "Halfway")
+        progress.complete()
+        assert 100 == progress.progress
+
+
+class TestEmailTemplates(object):
+    """
+    FUNCTION    preload_email_templates
+    """
+
+    def test_templates_are_compiled_once(self):
+        """
+        GIVEN   the email templates have been preloaded
+        WHEN    a template is requested by an email job
+        THEN    the already compiled template is returned
+        """
+        preload_email_templates()
+        template = email_templates.get_template("new_feedback.html")
+
+        assert template is email_templates.get_template("new_feedback.html")
+        assert "Hello" in template.render(heading="Hello", hostname="localhost")
+
+
+@pytest.fixture
+def pairings(users):
+    pairs = [
+        Pairing.create(
+            type=Pairing.STUDENT,
+            course_id=1,
+            assignment_id=1,
+            grader_id=grader.id,
+            recipient_id=recipient.id,
+            creator_id=users[0].id,
+        )
+        for grader, recipient in [
+            (users[1], users[2]),
+            (users[1], users[3]),
+            (users[4], users[2]),
+        ]
+    ]
+    yield pairs
+    for p in pairs:
+        p.delete()
+
+
+class TestSendPairingEmails(object):
+    """
+    FUNCTION    send_pairing_emails
+    """
+
+    def test_sends_one_email_per_grader_in_a_single_request(
+        self, pairings, users, mail_outbox, dispatch
+    ):
+        """
+        GIVEN   a grader has been assigned multiple submissions
+        WHEN    the pairing emails are sent
+        THEN    all the graders are emailed with one request and each grader
+                gets one email listing all their submissions
+        """
+        assert 2 == sendmail.send_pairing_emails([p.id for p in pairings])
+        dispatch()
+
+        assert 1 == len(mail_outbox)
+        first, second = mail_outbox[0]["personalizations"]
+        assert users[1].email == first["to"][0]["email"]
+        assert "Give feedback to 2 submissions" == first["subject"]
+        assert users[2].name in first["substitutions"]["-pairings-"]
+        assert users[3].name in first["substitutions"]["-pairings-"]
+        assert users[4].email == second["to"][0]["email"]
+        assert "-pairings-" in mail_outbox[0]["content"][0]["value"]
+
+    def test_splits_the_emails_by_the_personalization_limit(
+        self, pairings, mail_outbox, dispatch
+    ):
+        """
+        GIVEN   there are more graders than the personalizations allowed
+                in a request
+        WHEN    the pairing emails are sent
+        THEN    the emails are split into multiple requests
+        """
+        with patch.object(sendmail, "MAX_PERSONALIZATIONS", 1):
+            assert 2 == sendmail.send_pairing_emails([p.id for p in pairings])
+        dispatch()
+
+        assert 2 == len(mail_outbox)
+
+
+@pytest.fixture
+def pending_tasks(users):
+    tasks = [
+        Task.create(
+            status=status,
+            course_id=1,
+            course_name="Course",
+            assignment_id=assignment_id,
+            assignment_name="Assignment {0}".format(assignment_id),
+            user_id=user.id,
+        )
+        for user, assignment_id, status in [
+            (users[1], 1, Task.PENDING),
+            (users[1], 1, Task.IN_PROGRESS),
+            (users[1], 2, Task.PENDING),
+            (users[2], 1, Task.PENDING),
+            (users[3], 1, Task.COMPLETE),
+        ]
+    ]
+    yield tasks
+    for t in tasks:
+        t.delete()
+
+
+class TestGetPendingReminders(object):
+    """
+    FUNCTION    get_pending_reminders
+    """
+
+    def test_counts_the_pending_tasks_per_user_and_assignment(
+        self, pending_tasks, users
+    ):
+        """
+        GIVEN   users have pending tasks in multiple assignments
+        WHEN    the pending reminders are fetched
+        THEN    one reminder is returned per user and assignment with the count
+                of the tasks which aren't complete
+        """
+        reminders = get_pending_reminders(Task.course_id == 1)
+
+        counts = {(r.user_id, r.assignment_id): r.pending for r in reminders}
+        assert {(users[1].id, 1): 2, (users[1].id, 2): 1, (users[2].id, 1): 1} == counts
+        assert "Assignment 2" == next(
+            r.assignment_name for r in reminders if r.assignment_id == 2
+        )
+
+
+class TestSendPendingReviewReminder(object):
+    """
+    FUNCTION    send_pending_review_reminder
+    """
+
+    def test_sends_the_reminders_of_the_assignment_in_one_request(
+        self, pending_tasks, users, mail_outbox, dispatch
+    ):
+        """
+        GIVEN   users have pending tasks in an assignment
+        WHEN    the reminders are sent for the assignment
+        THEN    all the users are reminded with a single request
+        """
+        stats = send_pending_review_reminder(1, 1)
+        dispatch()
+
+        assert dict(total=2, succeeded=2, failed=0, requests=1) == stats
+        assert 1 == len(mail_outbox)
+        emails = [p["to"][0]["email"] for p in mail_outbox[0]["personalizations"]]
+        assert [users[1].email, users[2].email] == emails
+        assert "-count-" in mail_outbox[0]["content"][0]["value"]
+
+    def test_sends_the_reminder_to_the_given_user_only(
+        self, pending_tasks, users, mail_outbox
+    ):
+        """
+        GIVEN   users have pending tasks in an assignment
+        WHEN    the reminder is sent for one user
+        THEN    only that user is reminded
+        """
+        stats = send_pending_review_reminder(1, 1, users[2].id)
+        assert 1 == stats["total"]
@@ -688,6 +688,27 @@ class TestNotificationResource(object):
         assert 200 == response.status_code
         assert note.read
 
+    def test_get_returns_the_unread_notifications_in_pages(self, db, client, student):
+        """
+        GIVEN   a user has many unread notifications
+        WHEN    the notifications are fetched page by page
+        THEN    each page has the next newest notifications upto the limit
+        """
+        notes = [Notification.create(recipient_id=student.id) for _ in range(5)]
+        Notification.create(recipient_id=student.id, read=True)
+        ids = sorted((n.id for n in notes), reverse=True)
+
+        response = client.get("/api/notifications/?limit=3", headers=token(student))
+        assert 200 == response.status_code
+        assert ids[:3] == [n["id"] for n in response.get_json()]
+
+        response = client.get(
+            "/api/notifications/?limit=3&before={0}".format(ids[2]),
+            headers=token(student),
+        )
+        assert ids[3:] == [n["id"] for n in response.get_json()]
+        Notification.query.delete()
+
     def test_put_returns_404_for_non_existent_notifications(self, client, student):
         """
         GIVEN   no notification exists for a given ID
@@ -1,15 +1,23 @@
 import pytest
 import random
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
-from peerfeedback.api.utils import generate_review_matches
+from peerfeedback.api.utils import generate_review_matches, verify_review_matches
 from peerfeedback.api.utils import (
     assign_students_to_tas,
     user_is_ta_or_teacher,
     create_pairing,
+    create_pairings,
     generate_non_group_pairs,
+    cover_unassessed_recipients,
+    PairingHistory,
+    reduce_repeated_pairs,
     create_user,
+    is_valid_submission,
+    SubmissionIndex,
+    iter_csv,
+    upload_stream_to_s3,
 )
 from peerfeedback.models import Pairing, Feedback, Task, User, UserSettings
 from peerfeedback.api import errors
@@ -102,6 +110,26 @@ class TestGenerateReviewMatches(object):
         for student, peers in matches:
             assert 1 == len(peers)
 
+    def test_same_seed_generates_the_same_matches(self):
+        graders = list(range(50))
+        recipients = list(range(50))
+        first = list(generate_review_matches(graders, recipients, 4, seed=42))
+        second = list(generate_review_matches(graders, recipients, 4, seed=42))
+        assert first == second
+        assert list(range(50)) == recipients
+        verify_review_matches(first, 4)
+
+
+class TestVerifyReviewMatches(object):
+    def test_raises_error_on_broken_rules(self):
+        verify_review_matches([(1, [2, 3]), (2, [3, 1])], 2)
+        with pytest.raises(ValueError):
+            verify_review_matches([(1, [1, 3])], 2)
+        with pytest.raises(ValueError):
+            verify_review_matches([(1, [3, 3])], 2)
+        with pytest.raises(ValueError):
+            verify_review_matches([(1, [2, 3]), (2, [3])], 2)
+
 
 class TestAssignStudentsToTAs(object):
     allotment = [{"ta_id": 99, "student_count": 4}, {"ta_id": 98, "student_count": 5}]
@@ -236,6 +264,78 @@ class TestCreatePairing(object):
             create_pairing(teacher, grader, recipient, self.course, self.assignment)
 
 
+class TestCreatePairings(object):
+    """
+    FUNCTION    create_pairings
+    """
+
+    @classmethod
+    def setup_class(cls):
+        cls.course = Mock()
+        cls.course.configure_mock(id=1, name="Test Course")
+        cls.assignment = Mock()
+        cls.assignment.configure_mock(
+            id=1, name="Assignment 1", due_at="2018-01-01T12:00:00"
+        )
+
+    @pytest.mark.usefixtures("init_assignments")
+    def test_creates_pairings_with_tasks_and_feedback(self, db, users, teacher):
+        """
+        GIVEN   the course has been setup
+        WHEN    the function is called with a list of users who are not paired
+        THEN    pairings are created along with a task and feedback for each
+        """
+        matches = [(users[1], users[2]), (users[2], users[3]), (users[3], users[1])]
+
+        pairing_ids = create_pairings(teacher, matches, self.course, self.assignment)
+        assert 3 == len(pairing_ids)
+        assert 3 == db.session.query(Pairing).count()
+        assert 3 == db.session.query(Task).count()
+        assert 3 == db.session.query(Feedback).count()
+        for pairing_id in pairing_ids:
+            pair = Pairing.query.get(pairing_id)
+            assert pair.task.user_id == pair.grader_id
+            assert pair.feedback.reviewer_id == pair.grader_id
+            assert pair.feedback.receiver_id == pair.recipient_id
+            assert pair.feedback.draft
+            # Cleanup after test
+            pair.delete()
+
+    def test_raises_error_if_assignment_settings_not_found(self, teacher, users):
+        """
+        GIVEN   the course is not setup
+        WHEN    the function is called with params
+        THEN    a CourseNotSetup error is raised
+        """
+        with pytest.raises(errors.CourseNotSetup):
+            create_pairings(
+                teacher, [(users[1], users[2])], self.course, self.assignment
+            )
+
+    @pytest.mark.usefixtures("init_assignments")
+    def test_skips_self_and_existing_pairs(self, db, teacher, users, paired_students):
+        """
+        GIVEN   the course is setup and a pairing already exists for an assignment
+        WHEN    the function is called with the existing, self and duplicate pairs
+        THEN    only the new pairs are created
+        """
+        grader, recipient = paired_students
+        new_recipient = next(u for u in users if u.id not in (grader.id, recipient.id))
+        matches = [
+            (grader, recipient),
+            (grader, grader),
+            (grader, new_recipient),
+            (grader, new_recipient),
+        ]
+
+        pairing_ids = create_pairings(teacher, matches, self.course, self.assignment)
+        assert 1 == len(pairing_ids)
+        pair = Pairing.query.get(pairing_ids[0])
+        assert pair.recipient_id == new_recipient.id
+        # Cleanup after test
+        pair.delete()
+
+
 class TestGenerateNonGroupPairs():
     @classmethod
     def setup_class(cls):
@@ -295,6 +395,99 @@ class TestGenerateNonGroupPairs():
             for user in members:
                 assert all(m not in pairing[user] for m in members)
 
+    def test_same_seed_generates_the_same_pairs(self):
+        first = generate_non_group_pairs(self.groups, self.all, 3, seed=7)
+        second = generate_non_group_pairs(self.groups, self.all, 3, seed=7)
+        assert first == second
+
+    def test_raise_error_when_a_group_has_too_few_peers(self):
+        groups = {1: [1, 2, 3], 2: [4]}
+        with pytest.raises(ValueError):
+            generate_non_group_pairs(groups, [1, 2, 3, 4], 2)
+
+
+class TestCoverUnassessedRecipients(object):
+    def test_moves_a_review_along_a_chain_of_graders(self):
+        """Only the graders of the group "b" review the doubly reviewed 1. So
+        the grader 1 hands over its peer 4 to the grader 3, who gives up 1.
+        """
+        group_of = {1: "a", 2: "a", 3: "b", 5: "b", 4: "c"}
+        pairing = {1: [4], 2: [5], 3: [1], 4: [2], 5: [1]}
+        assessed = {1: 2, 2: 1, 3: 0, 4: 1, 5: 1}
+
+        assert [] == cover_unassessed_recipients(pairing, group_of, assessed)
+        assert all(assessed.values())
+        assert [3] == pairing[1]
+        assert [4] == pairing[3]
+        for grader, peers in pairing.items():
+            assert all(group_of[p] != group_of[grader] for p in peers)
+
+
+class TestPairingHistory(object):
+    def test_counts_the_pairs_of_the_earlier_assignments(self, db, users):
+        teacher = users[0]
+        a, b, c = users[1], users[2], users[3]
+        pairings = [
+            Pairing.create(
+                course_id=1,
+                assignment_id=assignment_id,
+                grader_id=grader.id,
+                recipient_id=recipient.id,
+                creator_id=teacher.id,
+                archived=archived,
+            )
+            for assignment_id, grader, recipient, archived in [
+                (1, a, b, False),
+                (2, a, b, False),
+                (2, b, c, True),
+                (3, c, a, False),
+            ]
+        ]
+
+        history = PairingHistory.for_course(1, exclude_assignment_id=3)
+        assert 2 == history.count(a.id, b.id)
+        assert 0 == history.count(b.id, a.id)
+        assert 0 == history.count(b.id, c.id)
+        assert 0 == history.count(c.id, a.id)
+        assert 1 == len(history)
+
+        for pairing in pairings:
+            pairing.delete()
+
+
+class TestReduceRepeatedPairs(object):
+    def test_swaps_the_repeated_peers_between_graders(self):
+        matches = {1: [2], 2: [3], 3: [4], 4: [1]}
+        history = PairingHistory({(1, 2): 1})
+
+        assert 0 == reduce_repeated_pairs(matches, history)
+        assert 2 not in matches[1]
+        verify_review_matches(matches.items(), 1)
+        received = sorted(p for peers in matches.values() for p in peers)
+        assert [1, 2, 3, 4] == received
+
+    def test_keeps_the_peers_out_of_the_graders_group(self):
+        matches = {1: [3], 2: [1], 3: [2], 4: [1], 5: [2]}
+        group_of = {1: "a", 2: "c", 3: "b", 4: "b", 5: "b"}
+        history = PairingHistory({(1, 3): 1})
+
+        # the only swap, with 5, would give 5 a peer from its own group
+        assert 1 == reduce_repeated_pairs(matches, history, group_of)
+        assert [3] == matches[1]
+
+    def test_avoids_the_repeats_in_a_large_course(self):
+        users = list(range(1000))
+        counts = {}
+        for assignment in range(10):
+            for grader, peers in generate_review_matches(users, users, 3):
+                for peer in peers:
+                    counts[(grader, peer)] = counts.get((grader, peer), 0) + 1
+        history = PairingHistory(counts)
+        matches = dict(generate_review_matches(users, users, 3))
+
+        assert 0 == reduce_repeated_pairs(matches, history)
+        verify_review_matches(matches.items(), 3)
+
 
 class TestCreateUser(object):
     def setup(self):
@@ -332,3 +525,123 @@ class TestCreateUser(object):
 
         assert len(User.query.all()) == 1
         assert len(UserSettings.query.all()) == 1
+
+
+class TestSubmissionIndex(object):
+    """
+    CLASS   SubmissionIndex
+    """
+
+    @classmethod
+    def setup_class(cls):
+        states = [
+            (1, "submitted", None),
+            (2, "unsubmitted", None),
+            (3, "graded", 0),
+            (4, "graded", 80),
+        ]
+        cls.submissions = []
+        for user_id, state, score in states:
+            submission = Mock()
+            submission.configure_mock(
+                user_id=user_id, workflow_state=state, score=score
+            )
+            cls.submissions.append(submission)
+
+    def test_submissions_are_fetched_only_once(self):
+        """
+        GIVEN   a canvas assignment
+        WHEN    the index is built for the assignment and queried multiple times
+        THEN    the submissions are fetched from canvas only once
+        """
+        assignment = Mock()
+        assignment.get_submissions.return_value = iter(self.submissions)
+        index = SubmissionIndex.for_assignment(assignment)
+
+        assert index.get(1) is self.submissions[0]
+        assert index.get(4) is self.submissions[3]
+        assert index.get(5) is None
+        assert 4 == len(index)
+        assignment.get_submissions.assert_called_once()
+
+    def test_user_ids_are_filtered_by_predicate(self):
+        """
+        GIVEN   an index of submissions in different states
+        WHEN    the user ids are requested with and without a predicate
+        THEN    the matching user ids are returned
+        """
+        index = SubmissionIndex(self.submissions)
+        assert [1, 2, 3, 4] == index.user_ids()
+        assert [1, 4] == index.user_ids(is_valid_submission)
+
+    def test_has_valid_submission(self):
+        """
+        GIVEN   an index of submissions in different states
+        WHEN    the validity of the submission is checked for users
+        THEN    only the users with non-empty submissions are valid
+        """
+        index = SubmissionIndex(self.submissions)
+        assert index.has_valid_submission(1)
+        assert not index.has_valid_submission(2)
+        assert not index.has_valid_submission(3)
+        assert index.has_valid_submission(4)
+        assert not index.has_valid_submission(5)
+
+
+class TestIterCSV(object):
+    """
+    FUNCTION    iter_csv
+    """
+
+    def test_yields_one_chunk_per_row(self):
+        """
+        GIVEN   a heading and rows of data
+        WHEN    the csv is generated
+        THEN    the heading and every row are yielded as separate csv lines
+        """
+        rows = iter([[1, "a, b"], [2, None]])
+        chunks = list(iter_csv(rows, ["id", "value"]))
+        assert ["id,value\r\n", '1,"a, b"\r\n', "2,\r\n"] == chunks
+
+
+@patch("peerfeedback.api.utils.get_s3_client")
+class TestUploadStreamToS3(object):
+    """
+    FUNCTION    upload_stream_to_s3
+    """
+
+    def test_chunks_are_uploaded_in_parts(self, get_s3_client, app):
+        """
+        GIVEN   a stream of text larger than the part size
+        WHEN    the stream is uploaded
+        THEN    it is uploaded in parts and the upload is completed
+        """
+        s3 = get_s3_client.return_value
+        s3.create_multipart_upload.return_value = {"UploadId": "abc"}
+        s3.upload_part.side_effect = [{"ETag": "1"}, {"ETag": "2"}]
+
+        upload_stream_to_s3(iter(["a" * 6, "b" * 6, "c" * 2]), "f.csv", part_size=10)
+
+        bodies = [c[1]["Body"] for c in s3.upload_part.call_args_list]
+        assert [b"a" * 6 + b"b" * 6, b"c" * 2] == bodies
+        parts = s3.complete_multipart_upload.call_args[1]["MultipartUpload"]
+        assert [1, 2] == [p["PartNumber"] for p in parts["Parts"]]
+        s3.abort_multipart_upload.assert_not_called()
+
+    def test_upload_is_aborted_on_error(self, get_s3_client, app):
+        """
+        GIVEN   a stream that fails midway
+        WHEN    the stream is uploaded
+        THEN    the multipart upload is aborted and the error is raised
+        """
+        s3 = get_s3_client.return_value
+        s3.create_multipart_upload.return_value = {"UploadId": "abc"}
+
+        def chunks():
+            yield "a"
+            raise ValueError("DB connection lost")
+
+        with pytest.raises(ValueError):
+            upload_stream_to_s3(chunks(), "f.csv")
+        s3.abort_multipart_upload.assert_called_once()
+        s3.complete_multipart_upload.assert_not_called()
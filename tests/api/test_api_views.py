@@ -552,6 +552,31 @@ class TestClearNotifications(object):
             n.delete()
 
 
+class TestUnreadNotificationsCount(object):
+    """
+    METHOD  unread_notifications_count
+    URL     /api/notifications/unread_count/
+    """
+
+    def test_returns_the_number_of_unread_notifications(self, client, student):
+        """
+        GIVEN   a user has read and unread notifications
+        WHEN    a get request is sent to the URL
+        THEN    the number of unread notifications is returned
+        """
+        for i in range(4):
+            Notification.create(recipient_id=student.id, read=i == 0)
+
+        resp = client.get("/api/notifications/unread_count/", headers=token(student))
+        assert 200 == resp.status_code
+        assert 3 == resp.get_json()["unread"]
+
+        client.post("/api/notifications/clear/", headers=token(student))
+        resp = client.get("/api/notifications/unread_count/", headers=token(student))
+        assert 0 == resp.get_json()["unread"]
+        Notification.query.delete()
+
+
 class TestGetExtraFeedbackCount(object):
     """
     METHOD  get_count_of_extra_feedback_given
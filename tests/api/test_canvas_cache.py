@@ -0,0 +1,55 @@
+from unittest.mock import Mock
+
+from canvasapi.course import Course
+
+from peerfeedback.api import canvas_cache
+
+
+class TestCanvasObjectSerialization(object):
+    """
+    FUNCTIONS   dump_object, load_object
+    """
+
+    def test_requester_is_not_stored(self):
+        """
+        GIVEN   a canvas object created with a requester
+        WHEN    the object is dumped for caching
+        THEN    the attributes are returned without the requester
+        """
+        course = Course(Mock(), {"id": 1, "name": "Test Course"})
+        data = canvas_cache.dump_object(course)
+        assert "_requester" not in data
+        assert 1 == data["id"]
+        assert "Test Course" == data["name"]
+
+    def test_object_is_rebuilt_with_the_new_requester(self):
+        """
+        GIVEN   the cached attributes of a canvas object
+        WHEN    the object is loaded with a requester
+        THEN    an object of the class with the same attributes is returned
+        """
+        requester = Mock()
+        data = canvas_cache.dump_object(Course(Mock(), {"id": 1, "name": "Course"}))
+        course = canvas_cache.load_object(Course, requester, data)
+        assert isinstance(course, Course)
+        assert course._requester is requester
+        assert 1 == course.id
+        assert "Course" == course.name
+
+
+class TestCachedFetch(object):
+    """
+    FUNCTION    get_course
+    """
+
+    def test_fetches_from_canvas_when_not_cached(self, app):
+        """
+        GIVEN   the course is not in the cache
+        WHEN    the course is requested
+        THEN    the course is fetched using the canvas client
+        """
+        canvas = Mock()
+        canvas.get_course.return_value = Course(Mock(), {"id": 1, "name": "Course"})
+        course = canvas_cache.get_course(canvas, 1)
+        canvas.get_course.assert_called_once_with(1)
+        assert 1 == course.id
@@ -0,0 +1,213 @@
+import json
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+from canvasapi.exceptions import Forbidden
+from canvasapi.paginated_list import PaginatedList
+from canvasapi.user import User as CanvasUser
+from flask import has_app_context
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from peerfeedback.api import canvas_fetch
+from peerfeedback.api.canvas_cache import get_requester
+from peerfeedback.api.utils import get_canvas_client
+
+BASE_URL = "https://canvas.test/api/v1/"
+
+
+class Item(object):
+    def __init__(self, requester, attributes):
+        self.__dict__.update(attributes)
+
+
+def make_response(ids, links=None, remaining="700.0"):
+    response = Mock()
+    response.json.return_value = [{"id": i} for i in ids]
+    response.links = links or {}
+    response.headers = {"X-Rate-Limit-Remaining": remaining}
+    return response
+
+
+def make_paginated(requester):
+    paginated = Mock(spec=PaginatedList)
+    paginated.configure_mock(
+        _requester=requester,
+        _content_class=Item,
+        _first_url="courses/1/users",
+        _first_params={"per_page": 2},
+        _extra_attribs={"course_id": 1},
+        _request_method="GET",
+        _root=None,
+    )
+    return paginated
+
+
+class PagesAdapter(BaseAdapter):
+    """Transport adapter returning numbered pages of users for any request."""
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+
+    def send(self, request, **kwargs):
+        params = dict(parse_qsl(urlparse(request.url).query))
+        last = "{0}?per_page=2&page={1}".format(
+            request.url.split("?")[0], len(self.pages)
+        )
+        response = Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response.headers = CaseInsensitiveDict(
+            {
+                "X-Rate-Limit-Remaining": "600.0",
+                "Link": '<{0}>; rel="last"'.format(last),
+            }
+        )
+        ids = self.pages[int(params.get("page", 1)) - 1]
+        response._content = json.dumps([{"id": i} for i in ids]).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+class TestFetchAll(object):
+    """
+    FUNCTION    fetch_all
+    """
+
+    def test_numbered_pages_are_fetched_concurrently_in_order(self):
+        """
+        GIVEN   a paginated list with a numbered last page link
+        WHEN    all the items are fetched
+        THEN    the remaining pages are requested directly and the items are
+                returned in the page order
+        """
+        last = {"url": BASE_URL + "courses/1/users?per_page=2&page=3"}
+        pages = {"2": make_response([3, 4]), "3": make_response([5])}
+
+        def request(method, endpoint, **kwargs):
+            if endpoint == "courses/1/users" and "_kwargs" not in kwargs:
+                return make_response([1, 2], {"next": last, "last": last})
+            return pages[dict(kwargs["_kwargs"])["page"]]
+
+        requester = Mock(base_url=BASE_URL)
+        requester.request.side_effect = request
+        items = canvas_fetch.fetch_all(make_paginated(requester))
+
+        assert [1, 2, 3, 4, 5] == [i.id for i in items]
+        assert all(i.course_id == 1 for i in items)
+        assert 3 == requester.request.call_count
+
+    def test_follows_next_links_without_numbered_pages(self):
+        """
+        GIVEN   a paginated list using bookmark based pagination
+        WHEN    all the items are fetched
+        THEN    the next links are followed one after the other
+        """
+        next_url = {"url": BASE_URL + "courses/1/users?page=bookmark:abc"}
+        requester = Mock(base_url=BASE_URL)
+        requester.request.side_effect = [
+            make_response([1, 2], {"next": next_url}),
+            make_response([3]),
+        ]
+        items = canvas_fetch.fetch_all(make_paginated(requester))
+
+        assert [1, 2, 3] == [i.id for i in items]
+        assert (
+            "courses/1/users?page=bookmark:abc"
+            == requester.request.call_args_list[1][0][1]
+        )
+
+    @patch("peerfeedback.api.canvas_fetch.time.sleep")
+    def test_throttled_requests_are_retried(self, sleep):
+        """
+        GIVEN   canvas rejects a request due to rate limiting
+        WHEN    the items are fetched
+        THEN    the request is retried after backing off
+        """
+        requester = Mock(base_url=BASE_URL)
+        requester.request.side_effect = [
+            Forbidden("403 Forbidden (Rate Limit Exceeded)"),
+            make_response([1]),
+        ]
+        items = canvas_fetch.fetch_all(make_paginated(requester))
+
+        assert [1] == [i.id for i in items]
+        assert 2 == requester.request.call_count
+        sleep.assert_called()
+
+    def test_other_forbidden_errors_are_raised(self):
+        """
+        GIVEN   canvas rejects a request as the user is not allowed to access it
+        WHEN    the items are fetched
+        THEN    the error is raised without retrying
+        """
+        requester = Mock(base_url=BASE_URL)
+        requester.request.side_effect = Forbidden("Unauthorized")
+        with pytest.raises(Forbidden):
+            canvas_fetch.fetch_all(make_paginated(requester))
+        assert 1 == requester.request.call_count
+
+    def test_other_iterables_are_read_as_they_are(self):
+        """
+        GIVEN   an iterator of items instead of a paginated list
+        WHEN    all the items are fetched
+        THEN    the items of the iterator are returned
+        """
+        assert [1, 2] == canvas_fetch.fetch_all(iter([1, 2]))
+
+    @pytest.mark.usefixtures("app")
+    def test_quota_is_tracked_from_the_worker_threads(self):
+        """
+        GIVEN   a canvas client tracking the quota of its token
+        WHEN    the pages of a paginated list are fetched concurrently
+        THEN    the quota is recorded from every page in an app context
+        """
+        canvas = get_canvas_client("secret-token")
+        requester = get_requester(canvas)
+        requester._session.mount(
+            requester.base_url, PagesAdapter([[1, 2], [3, 4], [5]])
+        )
+        paginated = PaginatedList(
+            CanvasUser, requester, "GET", "courses/1/users", per_page=2
+        )
+        recorded = []
+        cache = Mock()
+        cache.set.side_effect = lambda *args, **kwargs: recorded.append(
+            has_app_context()
+        )
+
+        with patch("peerfeedback.api.credentials.cache", cache):
+            items = canvas_fetch.fetch_all(paginated)
+
+        assert [1, 2, 3, 4, 5] == [i.id for i in items]
+        assert [True, True, True] == recorded
+
+
+class TestFetchGroupMembers(object):
+    """
+    FUNCTION    fetch_group_members
+    """
+
+    def test_members_are_mapped_to_their_groups(self):
+        """
+        GIVEN   a list of groups
+        WHEN    the members of the groups are fetched
+        THEN    a map of group id and the members is returned
+        """
+        groups = []
+        for group_id, member_ids in [(10, [1, 2]), (20, [3])]:
+            requester = Mock(base_url=BASE_URL)
+            requester.request.return_value = make_response(member_ids)
+            group = Mock(id=group_id)
+            group.get_users.return_value = make_paginated(requester)
+            groups.append(group)
+
+        members = canvas_fetch.fetch_group_members(groups)
+        assert [1, 2] == [u.id for u in members[10]]
+        assert [3] == [u.id for u in members[20]]
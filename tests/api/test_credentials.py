@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+import pytest
+
+from peerfeedback.api import credentials
+from peerfeedback.api.credentials import CredentialPool
+from peerfeedback.models import CourseUserMap
+
+
+def make_member(id, token, minutes, role=CourseUserMap.TEACHER):
+    expiry = datetime.now(tz=timezone.utc) + timedelta(minutes=minutes)
+    return Mock(id=id, canvas_access_token=token, canvas_expiration_time=expiry), role
+
+
+def make_response(remaining):
+    return Mock(headers={"X-Rate-Limit-Remaining": str(remaining)})
+
+
+@pytest.fixture
+def quotas():
+    store = {}
+    cache = Mock()
+    cache.get.side_effect = store.get
+    cache.set.side_effect = lambda key, value, timeout=None: store.update({key: value})
+    with patch("peerfeedback.api.credentials.cache", cache):
+        yield store
+
+
+@pytest.mark.usefixtures("app")
+class TestRecordQuota(object):
+    """
+    FUNCTIONS   record_quota, get_quota
+    """
+
+    def test_quota_is_read_from_the_response(self, quotas):
+        """
+        GIVEN   a canvas response with the rate limit header
+        WHEN    the quota is recorded
+        THEN    the remaining quota of the token is saved without the token
+        """
+        credentials.record_quota("secret-token", make_response(512.5))
+
+        assert 512.5 == credentials.get_quota("secret-token")
+        assert all("secret-token" not in key for key in quotas)
+
+    def test_cache_errors_are_ignored(self):
+        """
+        GIVEN   the cache is not reachable
+        WHEN    the quota is recorded
+        THEN    the error is not raised to the canvas request
+        """
+        with patch("peerfeedback.api.credentials.cache") as cache:
+            cache.set.side_effect = ConnectionError("redis is down")
+            credentials.record_quota("secret-token", make_response(512.5))
+
+    def test_default_quota_for_unknown_tokens(self, quotas):
+        """
+        GIVEN   a token which hasn't been used recently
+        WHEN    the quota is requested
+        THEN    the default quota is returned
+        """
+        assert credentials.DEFAULT_QUOTA == credentials.get_quota("unused-token")
+
+
+@pytest.mark.usefixtures("app")
+class TestCredentialPool(object):
+    """
+    CLASS   CredentialPool
+    """
+
+    def test_picks_the_token_with_most_quota(self, quotas):
+        """
+        GIVEN   staff members whose tokens have different quotas left
+        WHEN    the least loaded member is requested
+        THEN    the member with the most quota is returned
+        """
+        members = [
+            make_member(1, "teacher", 60),
+            make_member(2, "ta", 60, CourseUserMap.TA),
+        ]
+        credentials.record_quota("teacher", make_response(50))
+        pool = CredentialPool(1)
+        with patch.object(CredentialPool, "members", return_value=members):
+            assert 2 == pool.least_loaded().id
+            assert 1 == pool.primary().id
+
+    def test_prefers_valid_tokens(self, quotas):
+        """
+        GIVEN   a member whose token has expired and a member with a valid token
+        WHEN    the least loaded member is requested
+        THEN    the member with the valid token is returned
+        """
+        members = [make_member(1, "expired", -5), make_member(2, "valid", 30)]
+        credentials.record_quota("valid", make_response(10))
+        with patch.object(CredentialPool, "members", return_value=members):
+            assert 2 == CredentialPool(1).least_loaded().id
+
+    def test_includes_only_the_teachers_by_default(self):
+        """
+        GIVEN   the default configuration
+        WHEN    a credential pool is created for a course
+        THEN    only the tokens of the teachers are included
+        """
+        assert (CourseUserMap.TEACHER,) == CredentialPool(1).roles
+
+    def test_returns_none_without_staff(self):
+        """
+        GIVEN   a course without any staff with tokens
+        WHEN    the least loaded member is requested
+        THEN    None is returned
+        """
+        with patch.object(CredentialPool, "members", return_value=[]):
+            assert CredentialPool(1).least_loaded() is None
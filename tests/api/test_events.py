@@ -0,0 +1,173 @@
+import json
+from unittest.mock import Mock, patch
+
+from peerfeedback.api import events
+from tests.factories import token
+
+
+def make_pubsub(*messages):
+    pubsub = Mock()
+    pubsub.get_message.side_effect = list(messages) + [None] * 100
+    rq = Mock()
+    rq.connection.pubsub.return_value = pubsub
+    return rq, pubsub
+
+
+class TestPublish(object):
+    """
+    FUNCTION    publish
+    """
+
+    def test_publishes_the_event_to_the_user_channel(self, app):
+        """
+        GIVEN   publishing of the events is enabled
+        WHEN    an event is published for a user
+        THEN    the event is sent to the channel of the user
+        """
+        rq = Mock()
+        app.config["PUBLISH_EVENTS"] = True
+        try:
+            with patch.object(events, "rq", rq):
+                events.publish(5, events.NOTIFICATION, {"item": "comment"})
+        finally:
+            app.config["PUBLISH_EVENTS"] = False
+
+        channel, message = rq.connection.publish.call_args[0]
+        assert "events:5" == channel
+        assert {"event": "notification", "data": {"item": "comment"}} == json.loads(
+            message
+        )
+
+    def test_does_nothing_when_disabled(self, app):
+        """
+        GIVEN   publishing of the events is disabled
+        WHEN    an event is published
+        THEN    nothing is sent to Redis
+        """
+        rq = Mock()
+        with patch.object(events, "rq", rq):
+            assert 0 == events.publish(5, events.NOTIFICATION, {})
+        rq.connection.publish.assert_not_called()
+
+
+class TestStream(object):
+    """
+    FUNCTION    stream
+    """
+
+    def test_streams_the_published_events(self, app):
+        """
+        GIVEN   an event is published to the channel of the user
+        WHEN    the events of the user are streamed
+        THEN    the event is sent in the server-sent events format and the
+                stream ends after the duration
+        """
+        payload = json.dumps({"event": "job_progress", "data": {"progress": 50}})
+        rq, pubsub = make_pubsub({"type": "message", "data": payload})
+
+        with patch.object(events, "rq", rq), patch.object(
+            events.time, "monotonic", side_effect=range(0, 1000, 2)
+        ):
+            chunks = list(events.stream(3, heartbeat=3, duration=10))
+
+        pubsub.subscribe.assert_called_once_with("events:3")
+        assert chunks[0].startswith("retry:")
+        assert 'event: job_progress\ndata: {"progress": 50}\n\n' == chunks[1]
+        assert ": keep-alive\n\n" in chunks
+        pubsub.close.assert_called_once_with()
+
+
+class TestStreamToken(object):
+    """
+    FUNCTIONS   create_stream_token, redeem_stream_token
+    """
+
+    def test_token_can_be_used_only_once(self, app):
+        """
+        GIVEN   a stream token created for a user
+        WHEN    the token is redeemed twice
+        THEN    the user is returned only the first time
+        """
+        store = {}
+        rq = Mock()
+        rq.connection.setex.side_effect = lambda key, timeout, value: store.update(
+            {key: value.encode()}
+        )
+        pipe = rq.connection.pipeline.return_value
+        pipe.execute.side_effect = lambda: [
+            store.pop(pipe.get.call_args[0][0], None),
+            1,
+        ]
+
+        with patch.object(events, "rq", rq):
+            stream_token = events.create_stream_token(5)
+            assert 5 == events.redeem_stream_token(stream_token)
+            assert events.redeem_stream_token(stream_token) is None
+
+        assert events.STREAM_TOKEN_TIMEOUT == rq.connection.setex.call_args[0][1]
+
+
+class TestEventStream(object):
+    """
+    METHOD  event_stream
+    URL     /api/events/
+    """
+
+    @patch("peerfeedback.api.views.events.redeem_stream_token", return_value=None)
+    def test_rejects_invalid_tokens(self, redeem, client):
+        """
+        GIVEN   an invalid token is passed in the query
+        WHEN    the event stream is requested
+        THEN    a 401 error is returned
+        """
+        resp = client.get("/api/events/?token=invalid")
+        assert 401 == resp.status_code
+        redeem.assert_called_once_with("invalid")
+
+    @patch("peerfeedback.api.views.events.redeem_stream_token", return_value=999999)
+    def test_rejects_tokens_of_unknown_users(self, redeem, client, db):
+        """
+        GIVEN   a stream token of a user who doesn't exist
+        WHEN    the event stream is requested
+        THEN    a 401 error is returned
+        """
+        resp = client.get("/api/events/?token=stream-token")
+        assert 401 == resp.status_code
+
+    def test_streams_events_for_the_token_in_the_query(self, client, student):
+        """
+        GIVEN   a valid stream token is passed in the query
+        WHEN    the event stream is requested
+        THEN    an event stream of the user is returned
+        """
+        with patch("peerfeedback.api.views.events.stream") as stream, patch(
+            "peerfeedback.api.views.events.redeem_stream_token", return_value=student.id
+        ):
+            stream.return_value = iter(["retry: 3000\n\n"])
+            resp = client.get("/api/events/?token=stream-token")
+
+        assert 200 == resp.status_code
+        assert resp.mimetype == "text/event-stream"
+        stream.assert_called_once_with(student.id)
+
+
+class TestEventStreamToken(object):
+    """
+    METHOD  event_stream_token
+    URL     /api/events/token/
+    """
+
+    @patch(
+        "peerfeedback.api.views.events.create_stream_token", return_value="stream-token"
+    )
+    def test_returns_a_token_for_the_user(self, create, client, student):
+        """
+        GIVEN   a logged in user
+        WHEN    a stream token is requested
+        THEN    a token for the user is returned
+        """
+        resp = client.post("/api/events/token/", headers=token(student))
+
+        assert 200 == resp.status_code
+        assert "stream-token" == resp.json["token"]
+        create.assert_called_once_with(student.id)
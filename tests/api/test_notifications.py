@@ -0,0 +1,141 @@
+from unittest.mock import Mock, call, patch
+
+from sqlalchemy import event
+
+from peerfeedback.api import notifications
+from peerfeedback.api.notifications import build_notifications, fan_out
+from peerfeedback.models import Notification
+
+
+class TestBuildNotifications(object):
+    """
+    FUNCTION    build_notifications
+    """
+
+    def test_builds_one_row_per_recipient(self):
+        """
+        GIVEN   a list of recipients with duplicates and empty ids
+        WHEN    the notification rows are built
+        THEN    each recipient gets exactly one row with the common fields
+        """
+        rows = build_notifications(
+            Notification.COMMENT, 5, [3, None, 4, 3], course_id=1, notifier_id=2
+        )
+
+        assert [3, 4] == [r["recipient_id"] for r in rows]
+        for row in rows:
+            assert Notification.COMMENT == row["item"]
+            assert 5 == row["item_id"]
+            assert 1 == row["course_id"]
+            assert 2 == row["notifier_id"]
+            assert row["read"] is False
+
+
+class TestGetUnreadCount(object):
+    """
+    FUNCTION    get_unread_count
+    """
+
+    def test_counted_value_does_not_replace_the_cache(self, db, users):
+        """
+        GIVEN   the unread counter of the user is not loaded
+        WHEN    the unread count is requested
+        THEN    the count from the DB is added only if the key is still missing
+        """
+        cache = Mock()
+        cache.get.return_value = None
+
+        with patch.object(notifications, "cache", cache):
+            notifications.get_unread_count(users[0].id)
+
+        key = notifications.unread_key(users[0].id)
+        assert key == cache.add.call_args[0][0]
+        cache.set.assert_not_called()
+
+
+class TestFanOut(object):
+    """
+    FUNCTION    fan_out
+    """
+
+    def test_creates_notifications_with_a_single_insert(self, db, users):
+        """
+        GIVEN   an event with several recipients
+        WHEN    the notifications are fanned out
+        THEN    a notification is created for every recipient with one INSERT
+        """
+        recipients = [u.id for u in users[:5]]
+        inserts = []
+
+        def count(conn, cursor, statement, *args):
+            if statement.startswith("INSERT INTO notification"):
+                inserts.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            created = fan_out(
+                Notification.LIKE, 7, recipients, notifier_id=users[5].id, course_id=1
+            )
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        assert 5 == created
+        assert 1 == len(inserts)
+        notes = Notification.query.filter(Notification.item_id == 7).all()
+        assert sorted(recipients) == sorted(n.recipient_id for n in notes)
+        assert all(n.notifier_id == users[5].id for n in notes)
+        Notification.query.delete()
+
+    def test_does_nothing_without_recipients(self, db):
+        """
+        GIVEN   an event without any recipients
+        WHEN    the notifications are fanned out
+        THEN    no notification is created
+        """
+        assert 0 == fan_out(Notification.COMMENT, 1, [None])
+        assert 0 == db.session.query(Notification).count()
+
+    def test_updates_the_recipients_after_the_commit(self, db, users):
+        """
+        GIVEN   the notifications are left in the open transaction of the caller
+        WHEN    the caller commits the transaction
+        THEN    the unread counters are dropped and the events are published
+                only after the commit
+        """
+        first, second = users[0].id, users[1].id
+        cache = Mock()
+
+        with patch.object(notifications, "cache", cache), patch.object(
+            notifications, "publish"
+        ) as publish:
+            fan_out(Notification.COMMENT, 3, [first, second], commit=False)
+            cache.delete.assert_not_called()
+            publish.assert_not_called()
+
+            db.session.commit()
+
+        assert [
+            call(notifications.unread_key(first)),
+            call(notifications.unread_key(second)),
+        ] == cache.delete.call_args_list
+        assert [first, second] == [c[0][0] for c in publish.call_args_list]
+        Notification.query.delete()
+
+    def test_rolled_back_notifications_are_not_sent(self, db, users):
+        """
+        GIVEN   the notifications are left in the open transaction of the caller
+        WHEN    the caller rolls back the transaction
+        THEN    the counters and the recipients are not updated
+        """
+        cache = Mock()
+
+        with patch.object(notifications, "cache", cache), patch.object(
+            notifications, "publish"
+        ) as publish:
+            fan_out(Notification.COMMENT, 3, [users[0].id], commit=False)
+            db.session.rollback()
+            db.session.commit()
+
+        cache.delete.assert_not_called()
+        publish.assert_not_called()
+        assert 0 == Notification.query.count()
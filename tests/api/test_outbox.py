@@ -0,0 +1,215 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+from sendgrid.helpers.mail import Mail
+
+from peerfeedback.api.jobs import outbox
+from peerfeedback.api.jobs.outbox import (
+    TokenBucket,
+    enqueue_mail,
+    prune_outbox,
+    retry_delay,
+)
+from peerfeedback.models import OutboxEmail
+
+
+def new_mail(subject="Hello"):
+    return Mail(
+        from_email="notification@peerfeedback.io",
+        to_emails="student0000@example.edu",
+        subject=subject,
+        html_content="<p>Hello</p>",
+    )
+
+
+def id_of(subject):
+    return next(e.id for e in OutboxEmail.query if e.payload["subject"] == subject)
+
+
+class FailingTransport(object):
+    def __init__(self, status_code=500):
+        self.response = Mock(status_code=status_code, body="error")
+        self.calls = 0
+
+    def send(self, mail):
+        self.calls += 1
+        return self.response
+
+
+class TestTokenBucket(object):
+    """
+    CLASS   TokenBucket
+    """
+
+    def test_waits_for_the_tokens_after_a_burst(self):
+        """
+        GIVEN   a bucket allowing 2 sends per second
+        WHEN    more tokens are taken than its capacity
+        THEN    the sends over the capacity wait for the tokens to be added
+        """
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            bucket.acquire()
+
+        assert [0.5, 0.5] == waits
+
+
+class TestEnqueueMail(object):
+    """
+    FUNCTION    enqueue_mail
+    """
+
+    def test_adds_the_mail_only_once_for_a_dedup_key(self, mail_outbox):
+        """
+        GIVEN   a mail has been added to the outbox with a dedup key
+        WHEN    a mail with the same key is added again
+        THEN    it is ignored and the mail is stored only once
+        """
+        assert enqueue_mail(new_mail(), dedup_key="key") is True
+        assert enqueue_mail(new_mail(), dedup_key="key") is False
+        assert enqueue_mail(new_mail(), dedup_key="other") is True
+
+        assert 2 == OutboxEmail.query.count()
+        assert 2 == outbox.dispatch_outbox.queue.call_count
+
+    def test_adds_the_mails_without_a_dedup_key(self, mail_outbox):
+        """
+        GIVEN   a mail has been added to the outbox without a dedup key
+        WHEN    the same mail is added again
+        THEN    both the mails are stored
+        """
+        assert enqueue_mail(new_mail()) is True
+        assert enqueue_mail(new_mail()) is True
+
+        assert 2 == OutboxEmail.query.count()
+
+    def test_leaves_the_session_of_the_caller_alone(self, mail_outbox, db):
+        """
+        GIVEN   the caller has an open transaction
+        WHEN    a mail is added to the outbox
+        THEN    the transaction of the caller is not committed or rolled back
+        """
+        with patch.object(db.session, "commit") as commit, patch.object(
+            db.session, "rollback"
+        ) as rollback:
+            enqueue_mail(new_mail())
+
+        commit.assert_not_called()
+        rollback.assert_not_called()
+        assert 1 == OutboxEmail.query.count()
+
+
+class TestDispatchOutbox(object):
+    """
+    FUNCTION    dispatch_outbox
+    """
+
+    def test_sends_the_pending_mails(self, mail_outbox, dispatch):
+        """
+        GIVEN   mails waiting in the outbox
+        WHEN    the dispatcher is run
+        THEN    all the mails are sent and marked as sent
+        """
+        for i in range(3):
+            enqueue_mail(new_mail("Mail {0}".format(i)))
+
+        assert dict(sent=3, retrying=0, failed=0) == dispatch(batch_size=2)
+        assert ["Mail 0", "Mail 1", "Mail 2"] == sorted(
+            m["subject"] for m in mail_outbox
+        )
+        assert all(e.status == OutboxEmail.SENT for e in OutboxEmail.query)
+        assert dict(sent=0, retrying=0, failed=0) == dispatch()
+
+    def test_retries_the_failed_mails_with_a_backoff(self, mail_outbox, dispatch):
+        """
+        GIVEN   the mail transport returns an error
+        WHEN    the dispatcher is run
+        THEN    the mail is scheduled for a retry after the backoff delay
+                and isn't picked up again before it
+        """
+        enqueue_mail(new_mail())
+        transport = FailingTransport()
+
+        with patch.object(outbox, "get_mail_transport", return_value=transport):
+            assert dict(sent=0, retrying=1, failed=0) == dispatch()
+            assert dict(sent=0, retrying=0, failed=0) == dispatch()
+
+        email = OutboxEmail.query.one()
+        assert 1 == email.attempts
+        assert OutboxEmail.PENDING == email.status
+        assert "HTTP 500" in email.last_error
+        assert email.next_attempt_at > datetime.utcnow() + timedelta(seconds=20)
+        assert 1 == transport.calls
+
+    def test_gives_up_after_the_maximum_attempts(self, mail_outbox, dispatch):
+        """
+        GIVEN   a mail which has failed on all but the last attempt
+        WHEN    the last attempt fails too
+        THEN    the mail is marked as failed
+        """
+        enqueue_mail(new_mail())
+        email = OutboxEmail.query.one()
+        email.update(attempts=outbox.MAX_ATTEMPTS - 1)
+
+        with patch.object(
+            outbox, "get_mail_transport", return_value=FailingTransport()
+        ):
+            assert dict(sent=0, retrying=0, failed=1) == dispatch()
+
+        assert OutboxEmail.FAILED == OutboxEmail.query.one().status
+
+    def test_does_nothing_when_another_dispatcher_is_running(self, mail_outbox):
+        """
+        GIVEN   the dispatch lock is held by another dispatcher
+        WHEN    the dispatcher is run
+        THEN    it returns without sending any mail
+        """
+        enqueue_mail(new_mail())
+
+        with patch.object(outbox, "rq") as rq:
+            rq.connection.lock.return_value.acquire.return_value = False
+            assert outbox.dispatch_outbox() is None
+
+        assert [] == mail_outbox
+
+
+class TestPruneOutbox(object):
+    """
+    FUNCTION    prune_outbox
+    """
+
+    def test_deletes_the_old_sent_mails(self, mail_outbox, dispatch, db):
+        """
+        GIVEN   sent and pending mails older than the retention period and a
+                recently sent mail
+        WHEN    the outbox is pruned
+        THEN    only the old sent mails are deleted
+        """
+        enqueue_mail(new_mail("Old"))
+        enqueue_mail(new_mail("Recent"))
+        dispatch()
+        enqueue_mail(new_mail("Pending"))
+
+        old = datetime.now(tz=timezone.utc) - timedelta(days=40)
+        OutboxEmail.query.filter(OutboxEmail.id != id_of("Recent")).update(
+            dict(updated_on=old), synchronize_session=False
+        )
+        db.session.commit()
+
+        assert 1 == prune_outbox(days=30)
+        assert ["Pending", "Recent"] == sorted(
+            e.payload["subject"] for e in OutboxEmail.query
+        )
+
+
+def test_retry_delay_doubles_upto_the_maximum():
+    assert timedelta(seconds=30) == retry_delay(1)
+    assert timedelta(seconds=120) == retry_delay(3)
+    assert outbox.MAX_RETRY_DELAY == retry_delay(20)
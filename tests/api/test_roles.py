@@ -0,0 +1,81 @@
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event
+
+from peerfeedback.api import roles
+from peerfeedback.models import CourseUserMap
+
+
+@pytest.mark.usefixtures("setup_coursemap")
+class TestGetRoles(object):
+    """
+    FUNCTION    get_roles
+    """
+
+    def test_returns_the_mapped_roles(self, teacher, student):
+        """
+        GIVEN   users mapped to a course
+        WHEN    the roles of the users are requested
+        THEN    the roles from the course user map are returned
+        """
+        assert [CourseUserMap.TEACHER] == roles.get_roles(teacher.id, 1)
+        assert [CourseUserMap.STUDENT] == roles.get_roles(student.id, 1)
+        assert [] == roles.get_roles(student.id, 2)
+
+    def test_roles_are_memoized_for_the_request(self, db, student):
+        """
+        GIVEN   the roles of a user have been resolved once
+        WHEN    the roles are requested again
+        THEN    the database is not queried again
+        """
+        roles.get_roles(student.id, 1)
+        queries = []
+
+        def count(*args):
+            queries.append(args)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            assert [CourseUserMap.STUDENT] == roles.get_roles(student.id, 1)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        assert 0 == len(queries)
+
+    def test_changing_the_mapping_invalidates_the_roles(self, db, student):
+        """
+        GIVEN   the roles of a user have been resolved
+        WHEN    the mapping of the user is changed
+        THEN    the new roles are returned
+        """
+        assert [] == roles.get_roles(student.id, 5)
+        mapping = CourseUserMap.create(
+            user_id=student.id, course_id=5, role=CourseUserMap.TA
+        )
+        assert [CourseUserMap.TA] == roles.get_roles(student.id, 5)
+
+        mapping.delete()
+        assert [] == roles.get_roles(student.id, 5)
+
+    def test_roles_are_dropped_only_on_commit(self, db, student):
+        """
+        GIVEN   the mapping of a user is changed in a transaction
+        WHEN    the transaction is rolled back or committed
+        THEN    the cached roles are dropped only after the commit
+        """
+        with patch.object(roles, "cache") as cache:
+            cache.get.return_value = None
+            CourseUserMap(user_id=student.id, course_id=6, role=CourseUserMap.TA).save(
+                commit=False
+            )
+            db.session.flush()
+            cache.delete.assert_not_called()
+            db.session.rollback()
+            cache.delete.assert_not_called()
+
+            mapping = CourseUserMap.create(
+                user_id=student.id, course_id=6, role=CourseUserMap.TA
+            )
+            cache.delete.assert_called_once_with(roles.make_key(student.id, 6))
+
+        mapping.delete()
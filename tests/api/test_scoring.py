@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+from peerfeedback.api.scoring import RubricScorer
+
+
+def make_criteria(id, rubric_id, points):
+    levels = [
+        {"position": position, "text": str(p), "points": p}
+        for position, p in enumerate(points)
+    ]
+    return SimpleNamespace(id=id, rubric_id=rubric_id, levels=levels)
+
+
+class TestRubricScorer(object):
+    """
+    CLASS   RubricScorer
+    """
+
+    def setup_method(self):
+        self.scorer = RubricScorer(
+            [
+                make_criteria(2, 1, [3, 2, 1]),
+                make_criteria(1, 1, [5, 4]),
+                make_criteria(3, 2, [10, 0]),
+            ]
+        )
+
+    def test_criteria_are_grouped_by_rubric_in_order(self):
+        """
+        GIVEN   criteria of multiple rubrics
+        WHEN    the criteria of a rubric are requested
+        THEN    they are returned in the order of their ids
+        """
+        assert [1, 2] == [c.id for c in self.scorer.criteria_for(1)]
+        assert [3] == [c.id for c in self.scorer.criteria_for(2)]
+        assert [] == self.scorer.criteria_for(3)
+
+    def test_points_are_looked_up_by_level_position(self):
+        """
+        GIVEN   the criteria and the position of a level
+        WHEN    the points of the level are requested
+        THEN    the points are returned or None when there is no such level
+        """
+        assert 4 == self.scorer.level_points(1, 1)
+        assert 1 == self.scorer.level_points(2, 2)
+        assert self.scorer.level_points(2, None) is None
+        assert self.scorer.level_points(1, 5) is None
+
+    def test_grades_are_scored(self):
+        """
+        GIVEN   the grades of a feedback with one level not selected
+        WHEN    the grades are scored
+        THEN    the points of every grade and the total are calculated
+        """
+        grades = [{"criteria_id": 1, "level": 0}, {"criteria_id": 2, "level": None}]
+        assert [5, None] == self.scorer.grade_points(grades)
+        assert 5 == self.scorer.score(grades)
+
+    def test_unknown_criteria_fall_back_to_rubric_order(self):
+        """
+        GIVEN   grades referring to criteria which no longer exist
+        WHEN    the grades are scored with the rubric of the feedback
+        THEN    the grades are matched to the rubric criteria by their position
+        """
+        grades = [{"criteria_id": 8, "level": 1}, {"criteria_id": 9, "level": 0}]
+        assert [None, None] == self.scorer.grade_points(grades)
+        assert [4, 3] == self.scorer.grade_points(grades, rubric_id=1)
+        assert 7 == self.scorer.score(grades, rubric_id=1)
+
+    def test_grades_without_criteria_fall_back_to_rubric_order(self):
+        """
+        GIVEN   legacy grades which don't have a criteria id
+        WHEN    the grades are scored with the rubric of the feedback
+        THEN    the grades are matched to the rubric criteria by their position
+        """
+        grades = [{"level": 0}, {"level": 2}]
+        assert [None, None] == self.scorer.grade_points(grades)
+        assert [5, 1] == self.scorer.grade_points(grades, rubric_id=1)
+
+    def test_rubrics_are_loaded_from_the_db(self, rubric):
+        """
+        GIVEN   a rubric saved in the DB
+        WHEN    the scorer is loaded for the rubric
+        THEN    the points of the criteria levels can be looked up
+        """
+        scorer = RubricScorer.for_rubrics([rubric.id, None])
+        criteria = scorer.criteria_for(rubric.id)
+        assert 2 == len(criteria)
+        assert 10 == scorer.level_points(criteria[0].id, 1)
+        assert 4 == scorer.level_points(criteria[1].id, 2)
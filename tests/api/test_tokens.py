@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+
+from peerfeedback.api.jobs import tokens
+from peerfeedback.api.jobs.tokens import refresh_expiring_tokens
+
+
+@pytest.fixture
+def expiring_teacher(db, teacher):
+    saved = (teacher.canvas_refresh_token, teacher.canvas_expiration_time)
+    teacher.update(
+        canvas_refresh_token="refresh-token",
+        canvas_expiration_time=datetime.now(tz=timezone.utc) + timedelta(minutes=5),
+    )
+    yield teacher
+    teacher.update(canvas_refresh_token=saved[0], canvas_expiration_time=saved[1])
+
+
+class TestRefreshExpiringTokens(object):
+    """
+    FUNCTION    refresh_expiring_tokens
+    """
+
+    @patch.object(tokens, "refresh_canvas_token")
+    def test_refreshes_the_teachers_of_active_courses(
+        self, refresh, expiring_teacher, pairing
+    ):
+        """
+        GIVEN   a teacher whose token is expiring and the course has a new pairing
+        WHEN    the expiring tokens are refreshed
+        THEN    the token of the teacher is refreshed
+        """
+        refresh_expiring_tokens()
+        assert expiring_teacher in [c[0][0] for c in refresh.call_args_list]
+
+    @patch.object(tokens, "refresh_canvas_token")
+    def test_skips_the_teachers_of_inactive_courses(
+        self, refresh, expiring_teacher, setup_coursemap
+    ):
+        """
+        GIVEN   a teacher whose token is expiring and the course has no recent
+                activity
+        WHEN    the expiring tokens are refreshed
+        THEN    the token of the teacher is not refreshed
+        """
+        with patch.object(tokens, "ACTIVE_COURSE_PERIOD", timedelta(0)):
+            refresh_expiring_tokens()
+        assert expiring_teacher not in [c[0][0] for c in refresh.call_args_list]
@@ -190,6 +190,34 @@ class TestAutomaticPairing(object):
         )
         assert res.status_code == 200
         assert "job-id" == res.get_json()["id"]
+        assert mock_job.queue.call_args[1]["avoid_repeats"] is False
+
+    @patch("peerfeedback.api.views.pairing.pair_automatically")
+    def test_avoid_repeats_is_passed_as_keyword(self, mock_job, client, teacher):
+        """
+        GIVEN   the app is setup and course initialized
+        WHEN    an automatic pairing request is made to avoid repeated pairs
+        THEN    the option is passed to the job as a keyword argument
+        """
+        mock_job.queue.return_value.id = "job-id"
+        data = dict(
+            course_id=1,
+            assignment_id=1,
+            reviewRounds=2,
+            excludeDefaulters=True,
+            excludedStudents="",
+            avoidRepeats=True,
+        )
+        res = client.post(
+            "/api/pairing/automatic/",
+            data=json.dumps(data),
+            headers=token(teacher),
+            content_type="application/json",
+        )
+        assert res.status_code == 200
+        args, kwargs = mock_job.queue.call_args
+        assert 7 == len(args)
+        assert kwargs["avoid_repeats"] is True
 
 
 @pytest.mark.usefixtures("setup_coursemap")
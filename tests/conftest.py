@@ -9,6 +9,7 @@ from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
 from peerfeedback.app import create_app
 from peerfeedback.database import db as _db
@@ -23,7 +24,8 @@ from peerfeedback.models import (
     AssignmentSettings,
     ExtraFeedback,
 )
-from peerfeedback.models import CourseUserMap
+from peerfeedback.models import CourseUserMap, OutboxEmail
+from peerfeedback.api.jobs import outbox as _outbox
 
 from .mocks import start_mock_server
 
@@ -317,3 +319,30 @@ def extra_requests(users):
     extras = ExtraFeedback.query.all()
     for ex in extras:
         ex.delete()
+
+
+@pytest.fixture
+def mail_outbox(db):
+    """The emails sent by the outbox dispatcher through the local transport.
+    The dispatcher isn't queued when the emails are added, use the `dispatch`
+    fixture to send them.
+    """
+    sent = _outbox.mail_transports["local"].outbox
+    sent.clear()
+    with patch.object(_outbox.dispatch_outbox, "queue"):
+        yield sent
+    sent.clear()
+    OutboxEmail.query.delete()
+    _db.session.commit()
+
+
+@pytest.fixture
+def dispatch(mail_outbox):
+    """Function running the outbox dispatcher without taking the Redis lock."""
+
+    def run(**kwargs):
+        with patch.object(_outbox, "rq") as rq:
+            rq.connection.lock.return_value.acquire.return_value = True
+            return _outbox.dispatch_outbox(**kwargs)
+
+    return run
@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+from unittest.mock import patch
+
+from peerfeedback import crons
+from peerfeedback.crons import update_user_reputation
+from peerfeedback.models import MetaFeedback, Pairing, User
+
+
+class TestUpdateUserReputation(object):
+    """
+    FUNCTION    update_user_reputation
+    """
+
+    def test_metrics_are_updated(self, db, feedback, teacher):
+        """
+        GIVEN   users who have given feedback and received ratings for them
+        WHEN    the reputation is updated
+        THEN    the count, oldest review and reputation of the users are set
+        """
+        fb, ta_fb = feedback
+        ratings = [
+            MetaFeedback.create(
+                points=points,
+                feedback_id=fb.id,
+                receiver_id=fb.reviewer_id,
+                reviewer_id=fb.receiver_id,
+            )
+            for points in (2, 4)
+        ]
+
+        update_user_reputation()
+        db.session.expire_all()
+
+        reviewer = User.query.get(fb.reviewer_id)
+        assert 1 == reviewer.feedback_given
+        assert 3 == reviewer.reputation
+        assert reviewer.oldest_review == fb.end_date
+
+        ta = User.query.get(ta_fb.reviewer_id)
+        assert 1 == ta.feedback_given
+        assert 0 == ta.reputation
+
+        assert 0 == User.query.get(teacher.id).feedback_given
+
+        for rating in ratings:
+            rating.delete()
+
+    @pytest.mark.usefixtures("feedback")
+    def test_incremental_update_without_last_run_updates_everyone(self, db, teacher):
+        """
+        GIVEN   the reputation has never been updated before
+        WHEN    the reputation is updated in the incremental mode
+        THEN    all the users are updated
+        """
+        User.query.filter(User.id == teacher.id).update({"feedback_given": None})
+        db.session.commit()
+
+        update_user_reputation(incremental=True)
+        db.session.expire_all()
+
+        assert 0 == User.query.get(teacher.id).feedback_given
+
+    def test_incremental_update_includes_archived_pairings(self, db, feedback):
+        """
+        GIVEN   the pairing of a feedback has been archived since the last run
+        WHEN    the reputation is updated in the incremental mode
+        THEN    the feedback is no longer counted for its reviewer
+        """
+        fb, _ = feedback
+        update_user_reputation()
+        last_run = datetime.datetime.now(tz=datetime.timezone.utc)
+
+        Pairing.query.get(fb.pairing_id).update(archived=True)
+        with patch.object(crons.cache, "get", return_value=last_run):
+            update_user_reputation(incremental=True)
+        db.session.expire_all()
+
+        assert 0 == User.query.get(fb.reviewer_id).feedback_given
+        Pairing.query.get(fb.pairing_id).update(archived=False)
@@ -1,6 +1,64 @@
-from peerfeedback.utils import get_pseudo_names
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+from peerfeedback.utils import get_pseudo_names, refresh_canvas_token
 
 
 def test_alternate_names_cycles_through_names():
     names = get_pseudo_names()
     assert len(names) == 25
+
+
+@patch("peerfeedback.utils.db")
+@patch("peerfeedback.utils.update_canvas_token")
+@patch("peerfeedback.utils.rq")
+class TestRefreshCanvasToken(object):
+    """
+    FUNCTION    refresh_canvas_token
+    """
+
+    def make_user(self, minutes):
+        now = datetime.now(tz=timezone.utc)
+        return Mock(id=1, canvas_expiration_time=now + timedelta(minutes=minutes))
+
+    def test_expiring_token_is_refreshed_under_lock(self, rq, update, db):
+        """
+        GIVEN   a user whose token is about to expire
+        WHEN    the token is refreshed
+        THEN    the token is refreshed while holding the user's lock
+        """
+        user = self.make_user(1)
+        refresh_canvas_token(user, timedelta(minutes=5))
+
+        rq.connection.lock.assert_called_once()
+        assert "canvas-token-refresh:1" == rq.connection.lock.call_args[0][0]
+        update.assert_called_once_with(user)
+        rq.connection.lock.return_value.release.assert_called_once()
+
+    def test_token_refreshed_by_another_process_is_reused(self, rq, update, db):
+        """
+        GIVEN   another process has refreshed the token while waiting for the lock
+        WHEN    the lock is acquired
+        THEN    the token is not refreshed again
+        """
+        user = self.make_user(1)
+
+        def reload(u):
+            u.canvas_expiration_time += timedelta(minutes=60)
+
+        db.session.refresh.side_effect = reload
+        refresh_canvas_token(user, timedelta(minutes=5), force=True)
+        update.assert_not_called()
+
+    def test_gives_up_waiting_for_a_busy_lock(self, rq, update, db):
+        """
+        GIVEN   the lock is held by another process for too long
+        WHEN    the token is refreshed
+        THEN    the saved token is reloaded without refreshing it
+        """
+        rq.connection.lock.return_value.acquire.return_value = False
+        user = self.make_user(1)
+        refresh_canvas_token(user, timedelta(minutes=5))
+
+        update.assert_not_called()
+        db.session.refresh.assert_called_once_with(user)
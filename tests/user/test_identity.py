@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+from peerfeedback.models import User
+from peerfeedback.user import identity as identity_module
+from peerfeedback.user.identity import (
+    UserIdentity,
+    get_user_record,
+    invalidate_user_record,
+    load_identity,
+)
+
+
+class TestLoadIdentity(object):
+    """
+    FUNCTION    load_identity
+    """
+
+    def test_returns_identity_of_the_user(self, teacher):
+        """
+        GIVEN   a user in the database
+        WHEN    the identity of the user is loaded
+        THEN    the identity provides the basic user fields
+        """
+        identity = load_identity(teacher.id)
+        assert isinstance(identity, UserIdentity)
+        assert teacher.id == identity.id
+        assert teacher.username == identity.username
+        assert teacher.email == identity.email
+        assert str(teacher.id) == identity.get_id()
+
+    def test_returns_none_for_missing_user(self, db):
+        """
+        GIVEN   there is no user with the id
+        WHEN    the identity is loaded
+        THEN    None is returned
+        """
+        assert load_identity(99999) is None
+
+    def test_full_user_is_loaded_on_demand(self, teacher):
+        """
+        GIVEN   the identity of a user
+        WHEN    an attribute outside the record is accessed
+        THEN    the value is read from the user object
+        """
+        identity = load_identity(teacher.id)
+        assert identity._user is None
+        assert teacher.canvas_access_token == identity.canvas_access_token
+        assert isinstance(identity.get_user(), User)
+
+    def test_identity_equals_the_user(self, teacher, student):
+        """
+        GIVEN   the identity of a user
+        WHEN    it is compared with user objects
+        THEN    it is equal only to the same user
+        """
+        identity = load_identity(teacher.id)
+        assert identity == teacher
+        assert identity != student
+        assert identity in [student, teacher]
+
+
+class TestUserRecordInvalidation(object):
+    """
+    FUNCTIONS   get_user_record, invalidate_user_record
+    """
+
+    def test_updating_the_user_refreshes_the_record(self, student):
+        """
+        GIVEN   the record of a user has been loaded
+        WHEN    the user is updated
+        THEN    the record has the updated values
+        """
+        name = student.name
+        assert name == get_user_record(student.id).name
+
+        student.update(name="Changed Name")
+        assert "Changed Name" == get_user_record(student.id).name
+
+        student.update(name=name)
+        invalidate_user_record(student.id)
+        assert name == get_user_record(student.id).name
+
+    def test_record_is_dropped_only_on_commit(self, db, student):
+        """
+        GIVEN   the user is updated in a transaction
+        WHEN    the transaction is rolled back or committed
+        THEN    the cached record is dropped only after the commit
+        """
+        name = student.name
+        with patch.object(identity_module, "cache") as cache:
+            cache.get.return_value = None
+            student.update(name="Rolled Back", commit=False)
+            db.session.flush()
+            db.session.rollback()
+            cache.delete.assert_not_called()
+
+            student.update(name="Committed")
+            cache.delete.assert_called_once_with(identity_module.make_key(student.id))
+
+        student.update(name=name)
+
+    def test_bulk_updates_drop_all_the_records(self, db, student):
+        """
+        GIVEN   the users are updated with a query level update
+        WHEN    the transaction is committed
+        THEN    the records of all the users are dropped
+        """
+        with patch.object(identity_module, "cache") as cache:
+            User.query.filter(User.id == student.id).update(
+                {"bio": "Bulk"}, synchronize_session=False
+            )
+            cache.inc.assert_not_called()
+            db.session.commit()
+            cache.inc.assert_called_once_with(identity_module.GENERATION_KEY)
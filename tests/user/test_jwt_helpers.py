@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
 import pytest
 
 from flask_jwt_extended import create_access_token, decode_token
@@ -9,6 +12,7 @@ from peerfeedback.user.jwt_helpers import (
     add_token_to_database,
     revoke_token,
     is_token_revoked,
+    prune_database,
     _epoch_utc_to_datetime,
 )
 
@@ -115,3 +119,96 @@ class TestIsTokenRevoked(object):
         """
         raw = decode_token(token)
         assert False == is_token_revoked(raw)
+
+
+class TestTokenStateCache(object):
+    """
+    FUNCTIONS   is_token_revoked, revoke_token with the token state cache
+    """
+
+    @pytest.fixture
+    def cache(self):
+        store = {}
+        fake = Mock()
+        fake.get.side_effect = store.get
+        fake.set.side_effect = lambda key, value, timeout=None: store.update(
+            {key: value}
+        )
+        fake.add.side_effect = lambda key, value, timeout=None: (
+            store.setdefault(key, value) is value
+        )
+        with patch("peerfeedback.user.jwt_helpers.cache", fake):
+            yield store
+
+    def test_cached_state_is_used_without_the_db(self, cache):
+        """
+        GIVEN   the state of a token is in the cache
+        WHEN    the function is called
+        THEN    the cached state is returned without querying the DB
+        """
+        cache["jwt:revoked:cached_token"] = False
+        with patch("peerfeedback.user.jwt_helpers.JWTToken") as model:
+            assert False == is_token_revoked({"jti": "cached_token"})
+        model.query.filter_by.assert_not_called()
+
+    @pytest.mark.usefixtures("db")
+    def test_revoked_state_is_written_to_the_cache(self, cache, token):
+        """
+        GIVEN   an active token which has been checked once
+        WHEN    the token is revoked
+        THEN    the cache reports the token as revoked
+        """
+        raw = decode_token(token)
+        assert False == is_token_revoked(raw)
+        assert False == cache["jwt:revoked:" + raw["jti"]]
+
+        revoke_token(raw)
+        assert cache["jwt:revoked:" + raw["jti"]]
+        assert is_token_revoked(raw)
+
+    @pytest.mark.usefixtures("db")
+    def test_read_does_not_overwrite_a_revocation(self, cache, token):
+        """
+        GIVEN   a token is revoked while its state is being read from the DB
+        WHEN    the read state is written to the cache
+        THEN    the revoked state in the cache is kept
+        """
+        raw = decode_token(token)
+        key = "jwt:revoked:" + raw["jti"]
+
+        def revoke_meanwhile(*args):
+            cache[key] = True
+
+        with patch(
+            "peerfeedback.user.jwt_helpers.cache.get", side_effect=revoke_meanwhile
+        ):
+            assert False == is_token_revoked(raw)
+
+        assert cache[key]
+
+
+class TestPruneDatabase(object):
+    """
+    FUNCTION    prune_database(batch_size)
+    """
+
+    def test_deletes_expired_tokens_in_chunks(self, db, token):
+        """
+        GIVEN   there are more expired tokens than the batch size
+        WHEN    the database is pruned
+        THEN    all the expired tokens are deleted and the active one is kept
+        """
+        for i in range(5):
+            JWTToken.create(
+                jti=f"expired_{i}",
+                token_type="access",
+                user_identity="testuser",
+                expires=datetime.now() - timedelta(hours=1),
+                revoked=False,
+            )
+
+        result = prune_database(batch_size=2)
+
+        assert 5 == result["deleted"]
+        assert result["duration"] >= 0
+        assert 1 == JWTToken.query.count()